@@ -26,6 +26,7 @@ from impactutils.mapping.mercatormap import MercatorMap
 from impactutils.textformat.text import commify, pop_round_short, round_to_nearest
 
 # local imports
+from losspager.utils.datacache import read_excel_cached
 from losspager.vis.impactscale import GREEN, ORANGE, RED, YELLOW
 from shapely.geometry import GeometryCollection
 from shapely.geometry import Polygon as sPolygon
@@ -118,7 +119,7 @@ class HazusInfo(object):
         homedir = os.path.dirname(os.path.abspath(__file__))
         datadir = os.path.join(homedir, "..", "data")
         fipsfile = os.path.join(datadir, "fips_codes.xlsx")
-        fips = pd.read_excel(
+        fips = read_excel_cached(
             fipsfile,
             dtype={
                 "FIPS": int,
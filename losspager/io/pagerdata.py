@@ -15,6 +15,7 @@ from losspager.utils.exception import PagerException
 
 # local imports
 from losspager.utils.expocat import ExpoCat
+from losspager.utils.timing import timed
 
 # third party libraries
 from lxml import etree
@@ -57,6 +58,7 @@ class PagerData(object):
         self._comments_set = False
         self._mapinfo_set = True
         self._is_validated = False
+        self._timings = None
 
     def __repr__(self):
         if not self._is_validated:
@@ -215,6 +217,20 @@ class PagerData(object):
         self._map_cities = mapcities
         self._mapinfo_set = True
 
+    def setTimings(self, timings):
+        """Fill in the timings of the processing stages of this PAGER run.
+
+        Can be called before or after validate(); the timings are saved in the pager section
+        of event.json.
+
+        :param timings:
+          List of stage dictionaries returned by StageTimings.getStages().
+        """
+        self._timings = timings
+        if "pager" in self._pagerdict:
+            self._pagerdict["pager"]["timings"] = timings
+
+    @timed("PagerData.validate")
     def validate(self):
         """Ensure that all inputs have been passed in prior to rendering PagerData object."""
         if not self._input_set:
@@ -284,12 +300,24 @@ class PagerData(object):
             - maxmmi Highest intensity level with at least 1000 people exposed.
             - elapsed_time String indicating elapsed time between origin and processing times.
             - local_time_string String representation of local time at origin in YYYY-MM-DD HH:MM:SS format.
+            - timings List of processing stage timings (if set, see getTimings()).
         """
         if not self._is_validated:
             raise PagerException("PagerData object has not yet been validated.")
         pager_info = self._pagerdict["pager"].copy()
         return pager_info
 
+    def getTimings(self):
+        """Return the timings of the processing stages of this PAGER run.
+
+        :returns:
+          List of stage dictionaries (see StageTimings.getStages()), empty if no timings were
+          recorded.
+        """
+        if not self._is_validated:
+            raise PagerException("PagerData object has not yet been validated.")
+        return self._pagerdict["pager"].get("timings", [])
+
     def getImpactComments(self):
         """Return a tuple of the two impact comments.
 
@@ -605,6 +633,7 @@ class PagerData(object):
         return sd
 
     #########Savers/Loaders########
+    @timed("PagerData.saveToJSON")
     def saveToJSON(self, jsonfolder):
         """Serialize PagerData object to JSON files.
 
@@ -891,6 +920,7 @@ class PagerData(object):
         comment_tag.text = etree.CDATA(history_text)
         return pager
 
+    @timed("PagerData.saveToLegacyXML")
     def saveToLegacyXML(self, versionfolder):
         """Render PAGER results to legacy XML format (pager.xml).
 
@@ -1066,6 +1096,8 @@ class PagerData(object):
         ltimestr = localtime.strftime(DATETIMEFMT)
         pager["local_time_string"] = ltimestr
         self._local_time = localtime
+        if self._timings is not None:
+            pager["timings"] = self._timings
 
         return pager
 
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+
+# stdlib imports
+import os.path
+import glob
+import json
+import tempfile
+import uuid
+
+# third party imports
+import pandas as pd
+
+# pyarrow is optional - without it, partitions are saved as pickle files
+try:
+    import pyarrow.parquet as pq
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+# file (in the store folder) describing the store
+STORE_FILE = 'store.json'
+
+# partition file extensions for each supported format
+EXTENSIONS = {'parquet': '.parquet',
+              'pickle': '.pkl'}
+
+# name of the table containing pagerall results
+PAGERALL_TABLE = 'pagerall'
+
+
+class ResultsStore(object):
+    def __init__(self, folder, fmt=None):
+        """Open (or create) a columnar store of results tables, saved as partition files.
+
+        Each call to append() adds a new partition file to a table, so tables can grow to
+        millions of rows without ever being held in memory, and can be read back one partition
+        (or a subset of columns) at a time.
+
+        :param folder:
+          Folder containing the store.
+        :param fmt:
+          Partition file format, one of 'parquet' (requires pyarrow) or 'pickle'.  Defaults to
+          the format of an existing store, otherwise 'parquet' if pyarrow is installed.
+        :raises:
+          ValueError when fmt is not supported, or is different from the format of an existing store.
+        """
+        self._folder = folder
+        storefile = os.path.join(folder, STORE_FILE)
+        if os.path.isfile(storefile):
+            with open(storefile, 'rt') as f:
+                store_fmt = json.load(f)['format']
+            if fmt is not None and fmt != store_fmt:
+                raise ValueError('Store %s was created with %s format.' % (folder, store_fmt))
+            fmt = store_fmt
+        elif fmt is None:
+            fmt = 'parquet' if HAS_PYARROW else 'pickle'
+        if fmt not in EXTENSIONS:
+            raise ValueError('Unsupported store format %s.' % fmt)
+        if fmt == 'parquet' and not HAS_PYARROW:
+            raise ValueError('The pyarrow package is required for parquet stores.')
+        if not os.path.isfile(storefile):
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+            with open(storefile, 'wt') as f:
+                json.dump({'format': fmt}, f)
+        self._format = fmt
+
+    def getFolder(self):
+        """Return the folder containing the store.
+
+        :returns:
+          Path to store folder.
+        """
+        return self._folder
+
+    def getFormat(self):
+        """Return the format of the partition files.
+
+        :returns:
+          One of 'parquet' or 'pickle'.
+        """
+        return self._format
+
+    def getTables(self):
+        """Return the names of the tables in the store.
+
+        :returns:
+          Sorted list of table names.
+        """
+        tables = []
+        for name in os.listdir(self._folder):
+            if os.path.isdir(os.path.join(self._folder, name)):
+                tables.append(name)
+        return sorted(tables)
+
+    def getPartitions(self, table):
+        """Return the partition files of a table, in the order they were appended.
+
+        :param table:
+          Table name.
+        :returns:
+          List of paths to partition files.
+        """
+        pattern = os.path.join(self._folder, table, 'part-*' + EXTENSIONS[self._format])
+        return sorted(glob.glob(pattern))
+
+    def newPartition(self, table=PAGERALL_TABLE):
+        """Return the path of a new (not yet written) partition file of a table.
+
+        Partition files are named with the number of partitions already in the table (so they
+        sort in the order they were appended) and a random token, so the name is never re-used,
+        even if the partition is not written.
+
+        :param table:
+          Table name.
+        :returns:
+          Path to partition file, to be passed to append().
+        """
+        nparts = len(self.getPartitions(table))
+        ext = EXTENSIONS[self._format]
+        partname = 'part-%06i-%s%s' % (nparts, uuid.uuid4().hex[:8], ext)
+        return os.path.join(self._folder, table, partname)
+
+    def append(self, dataframe, table=PAGERALL_TABLE, partfile=None):
+        """Append rows to a table, as a new partition file.
+
+        :param dataframe:
+          DataFrame of rows to append (with the same columns as the rest of the table).
+        :param table:
+          Table name.
+        :param partfile:
+          Path to the partition file to write, as returned by newPartition(), or None to
+          write a new partition file.
+        :returns:
+          Path to the new partition file.
+        """
+        tablefolder = os.path.join(self._folder, table)
+        if not os.path.isdir(tablefolder):
+            os.makedirs(tablefolder)
+        if partfile is None:
+            partfile = self.newPartition(table)
+        # write to a temporary file and rename it, so readers never see a partial partition
+        handle, tmpfile = tempfile.mkstemp(dir=tablefolder, suffix='.tmp')
+        os.close(handle)
+        try:
+            dataframe = dataframe.reset_index(drop=True)
+            if self._format == 'parquet':
+                dataframe.to_parquet(tmpfile, index=False)
+            else:
+                dataframe.to_pickle(tmpfile)
+            os.replace(tmpfile, partfile)
+        finally:
+            if os.path.isfile(tmpfile):
+                os.remove(tmpfile)
+        return partfile
+
+    def clear(self, table=PAGERALL_TABLE):
+        """Remove all rows (partition files) from a table.
+
+        :param table:
+          Table name.
+        """
+        for partfile in self.getPartitions(table):
+            os.remove(partfile)
+
+    def _readPartition(self, partfile, columns=None):
+        if self._format == 'parquet':
+            return pd.read_parquet(partfile, columns=columns)
+        dataframe = pd.read_pickle(partfile)
+        if columns is not None:
+            dataframe = dataframe[columns]
+        return dataframe
+
+    def iterFrames(self, table=PAGERALL_TABLE, columns=None):
+        """Read a table one partition at a time.
+
+        :param table:
+          Table name.
+        :param columns:
+          List of columns to read, or None to read all columns.
+        :returns:
+          Generator of DataFrames, one per partition.
+        """
+        for partfile in self.getPartitions(table):
+            yield self._readPartition(partfile, columns=columns)
+
+    def getRowCount(self, table=PAGERALL_TABLE):
+        """Return the number of rows in a table.
+
+        :param table:
+          Table name.
+        :returns:
+          Number of rows in all partitions of the table.
+        """
+        nrows = 0
+        for partfile in self.getPartitions(table):
+            if self._format == 'parquet':
+                nrows += pq.read_metadata(partfile).num_rows
+            else:
+                nrows += len(self._readPartition(partfile))
+        return nrows
+
+    def read(self, table=PAGERALL_TABLE, columns=None, where=None):
+        """Read (a subset of) a table into memory.
+
+        :param table:
+          Table name.
+        :param columns:
+          List of columns to read, or None to read all columns.
+        :param where:
+          Function taking a DataFrame (one partition) and returning a boolean Series of the rows
+          to keep, or None to keep all rows.  Only the selected rows of each partition are
+          kept in memory.
+        :returns:
+          DataFrame containing the selected rows and columns of the table.
+        """
+        frames = []
+        for dataframe in self.iterFrames(table, columns=columns):
+            if where is not None:
+                dataframe = dataframe[where(dataframe)]
+            frames.append(dataframe)
+        if not len(frames):
+            return pd.DataFrame(columns=columns)
+        return pd.concat(frames, ignore_index=True)
+
+    def exportExcel(self, excelfile, table=PAGERALL_TABLE):
+        """Export a table to an Excel file.
+
+        NB: Excel files are limited to about one million rows.
+
+        :param excelfile:
+          Path to output Excel file.
+        :param table:
+          Table name.
+        """
+        self.read(table).to_excel(excelfile, index=False)
@@ -8,15 +8,23 @@ import numpy as np
 # stdlib imports
 import re
 import os.path
+import threading
 
 # local imports
 from .exposure import Exposure
 from .emploss import EmpiricalLoss
 from .growth import PopulationGrowth
 from losspager.utils.country import Country
+from losspager.utils.datacache import read_excel_cached
+from losspager.utils.exception import PagerException
+from losspager.utils.timing import timed
 
 GLOBAL_GDP = 16100  # from https://en.wikipedia.org/wiki/Gross_world_product
 
+# process-wide GDP object created from the default World Bank spreadsheet
+_DEFAULT_GDP = None
+_DEFAULT_GDP_LOCK = threading.Lock()
+
 class GDP(object):
     def __init__(self, dataframe):
         """Create an instance of a GDP object with a dataframe of countries/GDP values over time.
@@ -34,9 +42,21 @@ class GDP(object):
 
     @classmethod
     def fromDefault(cls):
-        homedir = os.path.dirname(os.path.abspath(__file__))  # where is this module?
-        excelfile = os.path.join(homedir, '..', 'data', 'API_NY.GDP.PCAP.CD_DS2_en_excel_v2.xls')
-        return cls.fromWorldBank(excelfile)
+        """Return the GDP object created from the World Bank spreadsheet included with this code.
+
+        The spreadsheet is only loaded once per process, and the same object is returned on
+        subsequent calls.
+
+        :returns:
+          GDP instance.
+        """
+        global _DEFAULT_GDP
+        with _DEFAULT_GDP_LOCK:
+            if _DEFAULT_GDP is None:
+                homedir = os.path.dirname(os.path.abspath(__file__))  # where is this module?
+                excelfile = os.path.join(homedir, '..', 'data', 'API_NY.GDP.PCAP.CD_DS2_en_excel_v2.xls')
+                _DEFAULT_GDP = cls.fromWorldBank(excelfile)
+        return _DEFAULT_GDP
         
     @classmethod
     def fromWorldBank(cls, excelfile):
@@ -48,7 +68,7 @@ class GDP(object):
         :returns:
           GDP instance.
         """
-        df = pd.read_excel(excelfile, sheet_name='Data', header=3)
+        df = read_excel_cached(excelfile, sheet_name='Data', header=3)
         return cls(df)
 
     def getGDP(self, ccode, year):
@@ -115,7 +135,7 @@ class GDP(object):
         
 
 class EconExposure(Exposure):
-    def __init__(self, popfile, popyear, isofile):
+    def __init__(self, popfile, popyear, isofile, popgrowth=None):
         """Create instance of EconExposure class (subclass of Exposure, and shares methods of that class.)
 
         :param popfile:
@@ -124,12 +144,33 @@ class EconExposure(Exposure):
           Integer indicating year when population data is valid.
         :param isofile:
           Any GMT or ESRI style grid file supported by MapIO, containing country code data (ISO 3166-1 numeric).
+        :param popgrowth:
+          PopulationGrowth object, or None to use the default population growth rates.
         """
         self._emploss = EmpiricalLoss.fromDefaultEconomic()
         self._gdp = GDP.fromDefault()
         self._econpopgrid = None
-        popgrowth = PopulationGrowth.fromDefault()
-        super(EconExposure, self).__init__(popfile, popyear, isofile)
+        super(EconExposure, self).__init__(popfile, popyear, isofile, popgrowth=popgrowth)
+
+    @classmethod
+    def fromExposure(cls, expmodel):
+        """Create an EconExposure object sharing the grids of an Exposure object.
+
+        The ShakeMap, country and (growth adjusted) population grids already loaded by
+        the Exposure object are re-used, so that calcEconExposure() does not have to read,
+        resample or adjust any grids again.
+
+        :param expmodel:
+          Exposure object whose calcExposure() method has been called.
+        :returns:
+          EconExposure instance.
+        """
+        econexp = cls(expmodel._popfile, expmodel._popyear, expmodel._isofile,
+                      popgrowth=expmodel._popgrowth)
+        econexp._shakegrid = expmodel._shakegrid
+        econexp._isogrid = expmodel._isogrid
+        econexp._popgrid = expmodel._popgrid
+        return econexp
 
     def getEconPopulationGrid(self):
         """Return the internal economic exposure population grid, created during calcExposure().
@@ -141,7 +182,7 @@ class EconExposure(Exposure):
             raise PagerException('Must call calcExposure() before calling getEconPopulationGrid().')
         return self._econpopgrid
         
-    def calcExposure(self, shakefile):
+    def calcExposure(self, shakefile, context=None):
         """Calculate population exposure to shaking.
 
         Calculate population exposure to shaking, per country, multiplied by event-year per-capita GDP and 
@@ -150,17 +191,48 @@ class EconExposure(Exposure):
 
         :param shakefile:
           Path to ShakeMap grid.xml file.
+        :param context:
+          Optional GridContext object, already containing the ShakeMap, population and country grids
+          for this event.  If not supplied, the grids will be read from disk.
         :returns:
           Dictionary containing country code (ISO2) keys, and values of
           10 element arrays representing population exposure to MMI 1-10.
           Dictionary will contain an additional key 'Total', with value of exposure across all countries.
         """
-        # create a copy of population grid to hold population * gdp * alpha
-        expdict = super(EconExposure, self).calcExposure(shakefile)
-        self._econpopgrid = Grid2D.copyFromGrid(self._popgrid)
-        econdict = {}
+        expdict = super(EconExposure, self).calcExposure(shakefile, context=context)
+        return self.calcEconExposure(expdict)
+
+    @timed('EconExposure.calcEconExposure')
+    def calcEconExposure(self, expdict):
+        """Multiply population exposure by event-year per-capita GDP and alpha correction factor.
+
+        Also create the economic population grid, which is the internal population grid
+        multiplied by GDP and alpha in each country.
+
+        :param expdict:
+          Dictionary of population exposure returned by calcExposure() on this object, or
+          on the Exposure object this object was created from (see fromExposure()).
+        :returns:
+          Dictionary containing country code (ISO2) keys, and values of
+          10 element arrays representing population exposure to MMI 1-10 multiplied
+          by GDP and alpha.
+          Dictionary will contain an additional key 'TotalEconomicExposure', with value of
+          economic exposure across all countries.
+        :raises:
+          PagerException when the population grid has not been loaded by calcExposure().
+        """
+        if self._popgrid is None:
+            raise PagerException('calcExposure() method must be called first.')
+        popdata = self._popgrid.getData()
         isodata = self._isogrid.getData()
         eventyear = self.getShakeGrid().getEventDict()['event_timestamp'].year
+
+        # GDP and alpha for each country code in the grid - cells in countries without
+        # exposure (or with unknown codes) are left as they are.
+        isocodes, cidx = np.unique(isodata, return_inverse=True)
+        gdps = np.ones(len(isocodes))
+        alphas = np.ones(len(isocodes))
+        econdict = {}
         total = np.zeros((10,))
         for ccode, exparray in expdict.items():
             if ccode.find('Total') > -1 or ccode.find('maximum') > -1:
@@ -172,13 +244,20 @@ class EconExposure(Exposure):
             isocode = self._country.getCountry(ccode)['ISON']
             alpha = lossmodel.alpha
             econarray = exparray * gdp * alpha
-            cidx = (isodata == isocode)
-            # multiply the population grid by GDP and alpha, so that when the loss model
-            # queries the grid later, those calculations don't have to be re-done.
-            self._econpopgrid._data[cidx] = self._econpopgrid._data[cidx] * gdp * alpha
+            idx = np.searchsorted(isocodes, isocode)
+            if idx < len(isocodes) and isocodes[idx] == isocode:
+                gdps[idx] = gdp
+                alphas[idx] = alpha
             econdict[ccode] = econarray
             total += econarray
 
+        # multiply the population grid by GDP and alpha, so that when the loss model
+        # queries the grid later, those calculations don't have to be re-done.
+        # The products are computed in double precision, and only the result is cast
+        # back to the population type.
+        cidx = cidx.reshape(isodata.shape)
+        econdata = (popdata * gdps[cidx] * alphas[cidx]).astype(popdata.dtype, copy=False)
+        self._econpopgrid = Grid2D(econdata, self._popgrid.getGeoDict())
+
         econdict['TotalEconomicExposure'] = total
         return econdict
-    
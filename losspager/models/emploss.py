@@ -13,8 +13,9 @@ from mapio.grid2d import Grid2D
 
 # local imports
 from losspager.utils.country import Country
-from losspager.utils.probs import calcEmpiricalProbFromRange
+from losspager.utils.probs import calcEmpiricalProbsFromBins
 from losspager.utils.exception import PagerException
+from losspager.utils.timing import timed
 
 # TODO: What should these values be?  Mean loss rates for all countries?
 DEFAULT_THETA = 16.0
@@ -22,6 +23,23 @@ DEFAULT_BETA = 0.15
 DEFAULT_L2G = 1.0
 DEFAULT_ALPHA = 1.0
 
+# edges of the MMI 5-9 loss bins (bin i covers [i-0.5, i+0.5))
+LOSS_MMI_BIN_EDGES = np.arange(4.5, 10.0, 1.0)
+
+# alert levels, and the losses (fatalities or millions of USD) at which each level above green starts
+ALERT_LEVELS = ['green', 'yellow', 'orange', 'red']
+ALERT_THRESHOLDS = [1, 100, 1000]
+
+# standard PAGER loss ranges (fatalities or millions of USD) for probability calculations.
+# the high end of the highest red range should be a very large number (ideally infinity).
+# one trillion should do it.
+PROBABILITY_RANGE_KEYS = ['0-1', '1-10', '10-100', '100-1000', '1000-10000',
+                          '10000-100000', '100000-10000000']
+PROBABILITY_RANGE_EDGES = np.array([0, 1, 10, 100, 1000, 10000, 100000, 1e12])
+
+# MMI values (1.0-10.0 in 0.1 steps) at which parametric models precompute their loss rates
+RATE_TABLE_MMI = np.round(np.arange(1.0, 10.05, 0.1), 1)
+
 class LossModel(object):
     def __init__(self, name, rates, l2g, alpha=None):
         """Create a loss model from an array of loss rates at MMI 1-10.
@@ -60,6 +78,30 @@ class LossModel(object):
         idx = mmirange - 1
         return self._rates[idx]
 
+    def _buildRateTable(self):
+        """Precompute (and freeze) the loss rates at every MMI value in RATE_TABLE_MMI.
+
+        Subclasses must implement _calcLossRates(mmi).
+        """
+        rate_table = np.array(self._calcLossRates(RATE_TABLE_MMI), dtype=np.float64)
+        rate_table.flags.writeable = False
+        self._rate_table = rate_table
+
+    def _lookupLossRates(self, mmirange):
+        """Get loss rates from the precomputed table, calculating them only for off-table MMI values.
+
+        :param mmirange:
+          Array-like range of MMI values at which loss rates will be returned.
+        :returns:
+          Array of loss rates for input MMI values.
+        """
+        mmi = np.asarray(mmirange, dtype=np.float64)
+        idx = np.clip(np.round((mmi - RATE_TABLE_MMI[0]) * 10),
+                      0, len(RATE_TABLE_MMI) - 1).astype(np.int64)
+        if np.all(RATE_TABLE_MMI[idx] == mmi):
+            return self._rate_table[idx]
+        return self._calcLossRates(mmi)
+
     @property
     def name(self):
         """Return the name associated with this model.
@@ -225,18 +267,25 @@ class LoglinearModel(LossModel):
         self._beta = beta
         self._l2g = l2g
         self._alpha = alpha
+        self._buildRateTable()
+
+    def _calcLossRates(self, mmi):
+        mmi = np.asarray(mmi, dtype=np.float64)
+        yy = np.power(10, (self._theta - (mmi*self._beta)))
+        return yy
 
     def getLossRates(self, mmirange):
         """Get the loss rates at each of input MMI values.
 
+        Rates for MMI values on the 0.1 step grid in RATE_TABLE_MMI are read from
+        a table computed when the model was created.
+
         :param mmirange:
           Array-like range of MMI values at which loss rates will be calculated.
         :returns:
           Array of loss rates for input MMI values.
         """
-        mmi = np.array(mmirange)
-        yy = numpy.power(10, (theta - (mmi*beta)))
-        return yy    
+        return self._lookupLossRates(mmirange)
     
 class LognormalModel(LossModel):
     """Lognormal loss model (defined by theta/beta (or mu/sigma) values.
@@ -263,19 +312,80 @@ class LognormalModel(LossModel):
         self._beta = beta
         self._l2g = l2g
         self._alpha = alpha
+        self._buildRateTable()
+
+    def _calcLossRates(self, mmi):
+        mmi = np.asarray(mmi, dtype=np.float64)
+        xx = np.log(mmi/self._theta)/self._beta
+        yy = 0.5*erfc(-xx/np.sqrt(2))
+        return yy
 
     def getLossRates(self, mmirange):
         """Get the loss rates at each of input MMI values.
 
+        Rates for MMI values on the 0.1 step grid in RATE_TABLE_MMI are read from
+        a table computed when the model was created.
+
         :param mmirange:
           Array-like range of MMI values at which loss rates will be calculated.
         :returns:
           Array of loss rates for input MMI values.
         """
-        mmi = np.array(mmirange)
-        xx = np.log(mmirange/self._theta)/self._beta
-        yy = 0.5*erfc(-xx/np.sqrt(2))
-        return yy
+        return self._lookupLossRates(mmirange)
+
+def stack_exposures(exposure_list):
+    """Stack exposure dictionaries from many events into a dense array for EmpiricalLoss.getBatchLosses().
+
+    :param exposure_list:
+      Sequence of E exposure dictionaries, as returned by Exposure.calcExposure() or
+      EconExposure.calcExposure().  Total and maximum_border_mmi entries are ignored.
+    :returns:
+      Tuple of:
+        - (E x C x 10) array of exposures, with zeros where a country is not in an event.
+        - List of the C country codes found in any of the input dictionaries, sorted.
+    """
+    ccodes = set()
+    for expdict in exposure_list:
+        for ccode in expdict.keys():
+            if ccode.find('Total') > -1 or ccode.find('maximum') > -1:
+                continue
+            ccodes.add(ccode)
+    ccodes = sorted(ccodes)
+    cindex = dict([(ccode, i) for i, ccode in enumerate(ccodes)])
+    exposures = np.zeros((len(exposure_list), len(ccodes), 10))
+    for i, expdict in enumerate(exposure_list):
+        for ccode, exparray in expdict.items():
+            if ccode in cindex:
+                exposures[i, cindex[ccode]] = exparray
+    return (exposures, ccodes)
+
+
+# model used for any country without its own model (shared by all EmpiricalLoss instances)
+DEFAULT_MODEL = LognormalModel('default', DEFAULT_THETA, DEFAULT_BETA, DEFAULT_L2G, alpha=DEFAULT_ALPHA)
+
+
+def _get_overlapping(polygons):
+    """Find the polygons that overlap (share some area with) at least one other polygon.
+
+    :param polygons:
+      Sequence of shapely polygons.
+    :returns:
+      Set of indices of the overlapping polygons.
+    """
+    overlapping = set()
+    if len(polygons) < 2:
+        return overlapping
+    bounds = np.array([polygon.bounds for polygon in polygons])
+    for i in range(len(polygons) - 1):
+        # only polygons with overlapping bounding boxes can overlap
+        others = bounds[i + 1:]
+        candidates = np.nonzero((others[:, 0] < bounds[i, 2]) & (others[:, 2] > bounds[i, 0]) &
+                                (others[:, 1] < bounds[i, 3]) & (others[:, 3] > bounds[i, 1]))[0]
+        for j in candidates + i + 1:
+            if polygons[i].intersection(polygons[j]).area > 0:
+                overlapping.update((i, int(j)))
+    return overlapping
+
 
 class EmpiricalLoss(object):
     """Container class for multiple LognormalModel objects.
@@ -309,11 +419,10 @@ class EmpiricalLoss(object):
           LognormalModel instance containing model for input country code, or a default model.
         """
         ccode = ccode.upper()
-        default = LognormalModel('default', DEFAULT_THETA, DEFAULT_BETA, DEFAULT_L2G, alpha=DEFAULT_ALPHA)
         if ccode in self._model_dict:
             return self._model_dict[ccode]
         else:
-            return default
+            return DEFAULT_MODEL
 
     @classmethod
     def fromDefaultFatality(cls):
@@ -387,6 +496,7 @@ class EmpiricalLoss(object):
         yy = model.getLossRates(mmirange)
         return yy
     
+    @timed('EmpiricalLoss.getLosses')
     def getLosses(self, exposure_dict):
         """Given an input dictionary of ccode (usually ISO numeric), calculate losses per country and total losses.
 
@@ -470,32 +580,13 @@ class EmpiricalLoss(object):
            - '10000-100000' (red alert)
            - '100000-10000000' (red alert)
         """
-        ranges = OrderedDict([('0-1', 0.0),
-                              ('1-10', 0.0),
-                              ('10-100', 0.0),
-                              ('100-1000', 0.0),
-                              ('1000-10000', 0.0),
-                              ('10000-100000', 0.0),
-                              ('100000-10000000', 0.0)])
-        
         if self._loss_type == 'economic':
             expected = lossdict['TotalDollars']
             expected = expected / 1e6  # turn USD into millions of USD
         else:
             expected = lossdict['TotalFatalities']
-        for rangekey, value in ranges.items():
-            rparts = rangekey.split('-')
-            rmin = int(rparts[0])
-            if len(rparts) == 1:
-                rmax = int(rparts[0])
-            else:
-                rmax = int(rparts[1])
-                # the high end of the highest red range should be a very large number (ideally infinity).
-                # one trillion should do it. 
-                if rmax == 10000000:
-                    rmax = 1e12
-            prob = calcEmpiricalProbFromRange(G, expected, (rmin, rmax))
-            ranges[rangekey] = prob
+        probs = calcEmpiricalProbsFromBins(G, expected, PROBABILITY_RANGE_EDGES)
+        ranges = OrderedDict(zip(PROBABILITY_RANGE_KEYS, probs.tolist()))
         return ranges
 
     def getAlertLevel(self, lossdict):
@@ -517,6 +608,70 @@ class EmpiricalLoss(object):
                 return thislevel
         return 'red'  # we should never get here, unless we have 1e18 USD in losses!
     
+    def getBatchLosses(self, exposures, ccodes):
+        """Calculate losses, alert levels, combined G values and probabilities for many events at once.
+
+        :param exposures:
+          (E x C x 10) array of population exposures to shaking from MMI values 1-10, for E events and
+          C countries.  If loss type is economic, then this input represents exposure *x* per capita
+          GDP *x* alpha (a correction factor).  See stack_exposures().
+        :param ccodes:
+          Sequence of C (usually two letter ISO) country codes, one per column of exposures.
+        :returns:
+          Dictionary containing:
+            - losses: (E x C) integer array of losses per event and country ('UK' columns are zero).
+            - total: E element integer array of total losses per event.
+            - alert: E element array of alert level strings ('green','yellow','orange','red').
+            - G: E element array of combined G values (see getCombinedG()).
+            - probabilities: (E x 7) array of probabilities over the standard PAGER loss
+              ranges (see getProbabilities()), columns in the same order as those ranges.
+        """
+        exposures = np.asarray(exposures, dtype=np.float64)
+        if exposures.ndim != 3 or exposures.shape[1:] != (len(ccodes), 10):
+            raise PagerException('exposures must be an (events x %i x 10) array.' % len(ccodes))
+        ccodes = [ccode.upper() for ccode in ccodes]
+
+        # (C x 5) table of loss rates for MMI 5-9, and the L2G value for each country
+        rates = np.zeros((len(ccodes), 5))
+        l2g = np.zeros(len(ccodes))
+        for i, ccode in enumerate(ccodes):
+            model = self.getModel(ccode)
+            if ccode in self._overrides:
+                rates[i] = self.getOverrideModel(ccode)[4:9]
+            else:
+                rates[i] = model.getLossRates(np.arange(5, 10))
+            l2g[i] = model.l2g
+        known = np.array([ccode != 'UK' for ccode in ccodes])
+
+        # MMI 10 exposures are treated as MMI 9 exposures
+        expo = exposures[:, :, 4:9].copy()
+        expo[:, :, 4] += exposures[:, :, 9]
+        losses = np.nansum(expo * rates, axis=2).astype(np.int64)
+        losses[:, ~known] = 0
+        total = losses.sum(axis=1)
+
+        if self._loss_type == 'fatality':
+            expected = total
+        else:
+            expected = total / 1e6  # turn USD into millions of USD
+        ilevel = np.searchsorted(ALERT_THRESHOLDS, expected, side='right')
+        alert = np.array(ALERT_LEVELS)[ilevel]
+
+        # countries with no exposure are not part of an event.  As with getCombinedG() called on
+        # the output of getLosses(), the total losses entry contributes the default model L2G.
+        present = np.any(exposures > 0, axis=2) & known
+        contributing = np.where((total > 0)[:, np.newaxis], present & (losses > 0), present)
+        gsquared = np.sum(contributing * np.power(l2g, 2), axis=1) + DEFAULT_MODEL.l2g ** 2
+        G = np.minimum(np.sqrt(gsquared), 2.5)
+
+        probabilities = calcEmpiricalProbsFromBins(G, expected, PROBABILITY_RANGE_EDGES)
+
+        return {'losses': losses,
+                'total': total,
+                'alert': alert,
+                'G': G,
+                'probabilities': probabilities}
+
     def overrideModel(self, ccode, rates):
         """Override the rates determined from theta,beta values with these hard-coded ones.
         Once set on the instance object, these will be the preferred rates.
@@ -550,9 +705,31 @@ class EmpiricalLoss(object):
         """
         self._overrides.clear()
 
+    def getLossRateTable(self, isocodes):
+        """Build a lookup table of loss rates for a sequence of numeric country codes.
+
+        :param isocodes:
+          Sequence of numeric (ISO 3166-1) country codes.
+        :returns:
+          (N x 6) array of loss rates, where N is the number of input country codes.
+          Column 0 is all zeros (no losses outside MMI 5-9), and columns 1-5 contain the
+          loss rates for MMI 5-9 (using override rates where they have been set).
+        """
+        ratetable = np.zeros((len(isocodes), 6))
+        iso2codes = self._country.getIndex().translate(isocodes, 'ISO2')
+        for i, ccode in enumerate(iso2codes):
+            if ccode not in self._overrides:
+                ratetable[i, 1:] = self.getLossRates(ccode, np.arange(5, 10))
+            else:
+                ratetable[i, 1:] = self.getOverrideModel(ccode)[4:9]
+        return ratetable
+
+    @timed('EmpiricalLoss.getLossGrid')
     def getLossGrid(self, mmidata, popdata, isodata):
         """Calculate floating point losses on a grid.
 
+        The input arrays are not modified.
+
         :param mmidata:
           Array of MMI values, dimensions (M,N).
         :param popdata:
@@ -562,39 +739,29 @@ class EmpiricalLoss(object):
         :returns:
           Grid of floating point loss values, dimensions (M,N).
         """
-        ucodes = np.unique(isodata)
-        fatgrid = np.zeros_like(mmidata)
+        ucodes, cidx = np.unique(isodata, return_inverse=True)
+        cidx = cidx.reshape(np.shape(isodata))
+        ratetable = self.getLossRateTable(ucodes)
+
+        # MMI bins 1-5 hold MMI 5-9, bin 0 holds everything with no loss rate.
         # we treat MMI 10 as MMI 9 for modeling purposes...
-        mmidata[mmidata > 9.5] = 9.0
-        
-        for isocode in ucodes:
-            countrydict = self._country.getCountry(int(isocode))
-            if countrydict is None:
-                ccode = 'unknown'
-            else:
-                ccode = countrydict['ISO2']
-            
-            if ccode not in self._overrides:
-                rates = self.getLossRates(ccode, np.arange(5, 10))
-            else:
-                rates = self.getOverrideModel(ccode)[4:9]
+        mmibins = np.digitize(mmidata, LOSS_MMI_BIN_EDGES)
+        mmibins[mmibins == len(LOSS_MMI_BIN_EDGES)] = 0
+        mmibins[mmidata > 9.5] = len(LOSS_MMI_BIN_EDGES) - 1
 
-            tcidx = np.where(isodata == isocode)
-            cidx = np.ravel_multi_index(tcidx, isodata.shape)
-            for i in range(0, len(rates)):
-                mmi = i+5
-                mmi_lower = mmi-0.5
-                mmi_upper = mmi+0.5
-                midx = np.ravel_multi_index(np.where((mmidata >= mmi_lower) & (mmidata < mmi_upper)), mmidata.shape)
-                idx = np.intersect1d(cidx, midx)
-                idx2d = np.unravel_index(idx, mmidata.shape)
-                fatgrid[idx2d] = popdata[idx2d]*rates[i]
+        fatgrid = np.zeros_like(mmidata)
+        inbin = mmibins > 0
+        fatgrid[inbin] = popdata[inbin] * ratetable[cidx[inbin], mmibins[inbin]]
 
         return fatgrid
 
     def getLossByShapes(self, mmidata, popdata, isodata, shapes, geodict, eventyear=None, gdpobj=None):
         """Divide the losses calculated per grid cell into polygons that intersect with the grid.
 
+        Polygons that do not overlap any other polygon are rasterized in a single pass.  Polygons
+        that overlap are rasterized one at a time, so cells shared by several polygons count
+        towards the losses of each of them.
+
         :param mmidata:
           Array of MMI values, dimensions (M,N).
         :param popdata:
@@ -620,14 +787,38 @@ class EmpiricalLoss(object):
             fieldname = 'fatalities'
         else:
             fieldname = 'dollars_lost'
-        for polyrec in shapes:
-            polygon = shapely.geometry.shape(polyrec['geometry'])
-            # overlay the polygon on top of a grid, turn polygon pixels to 1, non-polygon pixels to 0.
-            tgrid = Grid2D.rasterizeFromGeometry([polygon], geodict, fillValue=0, burnValue=1.0, attribute='value', mustContainCenter=True)
-            # get the indices of the polygon cells
+        shapes = list(shapes)
+        if not len(shapes):
+            return (polyshapes, totloss)
+
+        polygons = [shapely.geometry.shape(polyrec['geometry']) for polyrec in shapes]
+        overlapping = _get_overlapping(polygons)
+
+        # burn all of the polygons that do not overlap into one grid, where each cell holds the
+        # (1-based) label of the polygon containing its center, and 0 where there is no polygon.
+        labelshapes = []
+        for i, polygon in enumerate(polygons):
+            if i not in overlapping:
+                labelshapes.append({'geometry': polygon, 'properties': {'label': i + 1}})
+        losses_by_label = np.zeros(len(shapes) + 1)
+        if len(labelshapes):
+            labelgrid = Grid2D.rasterizeFromGeometry(labelshapes, geodict, fillValue=0,
+                                                     attribute='label', mustContainCenter=True)
+            labels = labelgrid.getData().astype(np.int64).ravel()
+            # sum the losses under each label
+            losses_by_label = np.bincount(labels, weights=np.nan_to_num(lossgrid).ravel(),
+                                          minlength=len(shapes) + 1)
+
+        # a cell can only hold one label, so overlapping polygons get a grid each
+        for i in sorted(overlapping):
+            tgrid = Grid2D.rasterizeFromGeometry([polygons[i]], geodict, fillValue=0,
+                                                 burnValue=1.0, attribute='value',
+                                                 mustContainCenter=True)
             shapeidx = tgrid.getData() == 1.0
-            # get the sum of those cells in the loss grid
-            losses = np.nansum(lossgrid[shapeidx])
+            losses_by_label[i + 1] = np.nansum(lossgrid[shapeidx])
+
+        for i, polyrec in enumerate(shapes):
+            losses = losses_by_label[i + 1]
             polyrec['properties'][fieldname] = int(losses)
             polyshapes.append(polyrec)
             totloss += int(losses)
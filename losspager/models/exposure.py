@@ -1,21 +1,119 @@
 #!/usr/bin/env python
 
 # stdlib
+import os.path
+import logging
 import warnings
 
 # third party
 import numpy as np
-from mapio.shake import ShakeGrid
-from mapio.reader import get_file_geodict, read
+from mapio.grid2d import Grid2D
+from mapio.geodict import GeoDict
 
 # local imports
 from losspager.utils.exception import PagerException
 from losspager.utils.country import Country
+from losspager.utils.gridstore import get_file_key
+from losspager.utils.timing import timed
 from .growth import PopulationGrowth
+from .gridcontext import GridContext
 
 SCENARIO_WARNING = 10  # number of years after date of population data to issue a warning
 SCENARIO_ERROR = 20  # number of years after date of population data to raise an exception
 
+# edges of the MMI 1-10 exposure bins (bin i covers [i-0.5, i+0.5))
+MMI_BIN_EDGES = np.arange(0.5, 11.0, 1.0)
+
+# name of the file (in a PAGER version folder) containing the per-cell exposure state
+EXPOSURE_STATE = 'exposure_state.npz'
+
+# geodict fields saved in exposure state files
+GEODICT_KEYS = ['xmin', 'xmax', 'ymin', 'ymax', 'dx', 'dy', 'nx', 'ny']
+
+
+def get_mmi_bins(mmidata):
+    """Return the MMI exposure bin of each MMI value.
+
+    :param mmidata:
+      Array of floating point MMI data values.
+    :returns:
+      Array (same shape as mmidata) of bin numbers, where bins 1-10 hold MMI values in the half-open
+      intervals [i-0.5, i+0.5), 0 holds values below 0.5 and 11 holds values above 10.5 (and NaN).
+    """
+    return np.digitize(mmidata, MMI_BIN_EDGES).astype(np.int8)
+
+
+def calc_exposure_matrix(mmidata, popdata, isodata):
+    """Calculate population exposure to shaking for all countries in a single pass.
+
+    Each grid cell is assigned a combined (country index, MMI bin) key, and population
+    is summed per key with a weighted bincount, so the grids are only scanned once no
+    matter how many countries they cover.
+
+    :param mmidata:
+      Scalar or array-like value containing floating point MMI data values (range 1-10).
+    :param popdata:
+      Scalar or array-like value containing integer population data values.
+    :param isodata:
+      Scalar or array-like value containing integer country-code (ISO 3166-1 numeric) data values.
+    :returns:
+      Tuple of:
+        - Array of unique (non-NaN) country codes found in isodata.
+        - (Ncountries x 10) float array of population exposure to MMI 1-10, rows
+          ordered as the country code array.
+    """
+    mmidata = np.asarray(mmidata).ravel()
+    popdata = np.asarray(popdata).ravel()
+    isodata = np.asarray(isodata).ravel()
+    valid = ~np.isnan(isodata)
+    ccodes, cidx = np.unique(isodata[valid], return_inverse=True)
+    # MMI bin i (1-10) holds values in the half-open interval [i-0.5, i+0.5)
+    mmibins = get_mmi_bins(mmidata[valid])
+    expmatrix = _sum_exposure(len(ccodes), cidx, mmibins, popdata[valid])
+    return (ccodes, expmatrix)
+
+
+def update_exposure_matrix(ccodes, expmatrix, oldbins, newbins, popdata, isodata):
+    """Update population exposure to shaking for cells whose MMI bin has changed.
+
+    :param ccodes:
+      Array of unique country codes, as returned by calc_exposure_matrix().
+    :param expmatrix:
+      (Ncountries x 10) array of population exposure, as returned by calc_exposure_matrix().
+    :param oldbins:
+      Array of MMI bins (see get_mmi_bins()) the exposure matrix was calculated from.
+    :param newbins:
+      Array of new MMI bins, same shape as oldbins.
+    :param popdata:
+      Array of population data values, same shape as oldbins.
+    :param isodata:
+      Array of country-code (ISO 3166-1 numeric) data values, same shape as oldbins.  All (non-NaN)
+      codes must be in ccodes.
+    :returns:
+      Tuple of:
+        - New (Ncountries x 10) array of population exposure to MMI 1-10.
+        - Number of cells whose MMI bin changed.
+    """
+    changed = np.flatnonzero(np.asarray(oldbins).ravel() != np.asarray(newbins).ravel())
+    isocells = np.asarray(isodata).ravel()[changed]
+    valid = ~np.isnan(isocells)
+    cells = changed[valid]
+    cidx = np.searchsorted(ccodes, isocells[valid])
+    popcells = np.asarray(popdata).ravel()[cells]
+    # remove the population of changed cells from their old bins, and add it to the new ones
+    removed = _sum_exposure(len(ccodes), cidx, np.asarray(oldbins).ravel()[cells], popcells)
+    added = _sum_exposure(len(ccodes), cidx, np.asarray(newbins).ravel()[cells], popcells)
+    return (expmatrix - removed + added, len(changed))
+
+
+def _sum_exposure(ncodes, cidx, mmibins, popdata):
+    # sum population per (country index, MMI bin) for bins 1-10
+    inrange = (mmibins >= 1) & (mmibins <= 10) & ~np.isnan(popdata)
+    keys = cidx[inrange] * 10 + (mmibins[inrange] - 1)
+    expmatrix = np.bincount(keys, weights=popdata[inrange],
+                            minlength=ncodes * 10)
+    return expmatrix.reshape((ncodes, 10))
+
 
 def calc_exposure(mmidata, popdata, isodata):
     """Calculate population exposure to shaking per country.
@@ -29,23 +127,16 @@ def calc_exposure(mmidata, popdata, isodata):
     :returns:
       Dictionary of population exposures to shaking, keys are country code, values are 10-element arrays.
     """
-    mmidata = np.array(mmidata)
-    popdata = np.array(popdata)
-    isodata = np.array(isodata)
+    ccodes, expmatrix = calc_exposure_matrix(mmidata, popdata, isodata)
+    return _get_exposure_dict(ccodes, expmatrix)
+
+
+def _get_exposure_dict(ccodes, expmatrix):
+    # dictionary of exposures per country code, from an exposure matrix
+    expmatrix = expmatrix.astype(np.uint32)
     exposures = {}
-    ccodes = np.unique(isodata[~np.isnan(isodata)])
-    for ccode in ccodes:
-        cidx = np.ravel_multi_index(np.where(isodata == ccode), isodata.shape)
-        expsum = np.zeros((10), dtype=np.uint32)
-        for mmi in range(1, 11):
-            mmi_lower = mmi - 0.5
-            mmi_upper = mmi + 0.5
-            midx = np.ravel_multi_index(
-                np.where((mmidata >= mmi_lower) & (mmidata < mmi_upper)), mmidata.shape)
-            idx = np.unravel_index(np.intersect1d(cidx, midx), mmidata.shape)
-            popsum = np.nansum(popdata[idx])
-            expsum[mmi - 1] = int(popsum)
-        exposures[ccode] = expsum[:]
+    for i, ccode in enumerate(ccodes):
+        exposures[ccode] = expmatrix[i]
 
     return exposures
 
@@ -68,17 +159,28 @@ class Exposure(object):
         self._popgrid = None
         self._isogrid = None
         self._shakegrid = None
+        self._state = None
+        self._nchanged = None
         if popgrowth is not None:
             self._popgrowth = popgrowth
         else:
             self._popgrowth = PopulationGrowth.fromDefault()
         self._country = Country()
 
-    def calcExposure(self, shakefile):
+    @timed('Exposure.calcExposure')
+    def calcExposure(self, shakefile, context=None, statefile=None):
         """Calculate population exposure to shaking, per country, plus total exposure across all countries.
 
         :param shakefile:
           Path to ShakeMap grid.xml file.
+        :param context:
+          Optional GridContext object, already containing the ShakeMap, population and country grids
+          for this event.  If not supplied, the grids will be read from disk.
+        :param statefile:
+          Optional exposure state file saved (by saveState()) for a previous version of the ShakeMap.
+          If the state was calculated on the same grid cells from the same population and country
+          data, the exposure is updated from the cells whose MMI bin has changed, instead of being
+          calculated from scratch.
         :returns:
           Dictionary containing country code (ISO2) keys, and values of
           10 element arrays representing population exposure to MMI 1-10.
@@ -86,37 +188,24 @@ class Exposure(object):
           Dictionary will also contain a field "maximum_border_mmi" which indicates the maximum MMI value along
           any edge of the ShakeMap.
         """
-        # get shakemap geodict
-        shakedict = ShakeGrid.getFileGeoDict(shakefile, adjust='res')
-
-        # get population geodict
-        popdict = get_file_geodict(self._popfile)
-
-        # get country code geodict
-        isodict = get_file_geodict(self._isofile)
+        if context is None:
+            context = GridContext(shakefile, self._popfile, self._isofile)
+        else:
+            context.checkFiles(self._popfile, self._isofile)
+        self._state = None
+        self._nchanged = None
 
         # special case for very high latitude events that may be outside the bounds
         # of our population data...
-        if not popdict.intersects(shakedict):
+        if not context.intersects():
             expdict = {'UK': np.zeros((10,)), 'TotalExposure': np.zeros((10,))}
             return expdict
 
-        if popdict == shakedict == isodict:
-            # special case, probably for testing...
-            self._shakegrid = ShakeGrid.load(shakefile, adjust='res')
-            self._popgrid = read(self._popfile)
-            self._isogrid = read(self._isofile)
-        else:
-            sampledict = popdict.getBoundsWithin(shakedict)
-            self._shakegrid = ShakeGrid.load(shakefile, samplegeodict=sampledict, resample=True,
-                                             method='linear', adjust='res')
-            self._popgrid = read(self._popfile, samplegeodict=sampledict,
-                                 resample=False, doPadding=True, padValue=np.nan)
-            self._isogrid = read(self._isofile, samplegeodict=sampledict,
-                                 resample=True, method='nearest', doPadding=True, padValue=0)
+        self._shakegrid = context.getShakeGrid()
+        self._isogrid = context.getCountryGrid()
+        popgrid = context.getPopulationGrid()
 
         mmidata = self._shakegrid.getLayer('mmi').getData()
-        popdata = self._popgrid.getData()
         isodata = self._isogrid.getData()
 
         eventyear = self._shakegrid.getEventDict()['event_timestamp'].year
@@ -135,22 +224,39 @@ class Exposure(object):
                 PAGER results for events this far in the future are not valid. Stopping.''' % SCENARIO_ERROR
                 raise PagerException(msg)
 
-        ucodes = np.unique(isodata[~np.isnan(isodata)])
-        for ccode in ucodes:
-            cidx = (isodata == ccode)
-            popdata[cidx] = self._popgrowth.adjustPopulation(
-                popdata[cidx], ccode, self._popyear, eventyear)
+        geodict = popgrid.getGeoDict()
+        inputs = self._getStateInputs(eventyear)
+        mmibins = get_mmi_bins(mmidata)
+        state = None
+        if statefile is not None:
+            state = self._loadState(statefile, geodict, inputs)
+        if state is None:
+            # the context grids are shared, so the growth adjustment is done on a new copy of the population data
+            popdata = self._popgrowth.adjustPopulationGrid(popgrid.getData(), isodata,
+                                                           self._popyear, eventyear)
+            ccodes, expmatrix = calc_exposure_matrix(mmidata, popdata, isodata)
+        else:
+            # the growth adjusted population is the same as in the previous version
+            popdata = state['popdata']
+            ccodes = state['ccodes']
+            expmatrix, self._nchanged = update_exposure_matrix(ccodes, state['expmatrix'],
+                                                               state['mmibins'], mmibins,
+                                                               popdata, isodata)
+        self._popgrid = Grid2D(popdata, geodict)
+        self._state = {'geodict': np.array([geodict.asDict()[key] for key in GEODICT_KEYS]),
+                       'inputs': np.array(inputs),
+                       'mmibins': mmibins,
+                       'popdata': popdata,
+                       'ccodes': ccodes,
+                       'expmatrix': expmatrix}
 
-        exposure_dict = calc_exposure(mmidata, popdata, isodata)
+        exposure_dict = _get_exposure_dict(ccodes, expmatrix)
         newdict = {}
         # Get rolled up exposures
         total = np.zeros((10,), dtype=np.uint32)
-        for isocode, value in exposure_dict.items():
-            cdict = self._country.getCountry(int(isocode))
-            if cdict is None:
-                ccode = 'UK'
-            else:
-                ccode = cdict['ISO2']
+        isocodes = list(exposure_dict.keys())
+        iso2codes = self._country.getIndex().translate(isocodes, 'ISO2')
+        for ccode, value in zip(iso2codes, exposure_dict.values()):
             newdict[ccode] = value
             total += value
 
@@ -167,6 +273,50 @@ class Exposure(object):
 
         return newdict
 
+    def _getStateInputs(self, eventyear):
+        # identify the data an exposure state was calculated from
+        return '%s:%s:%i:%i' % (get_file_key(self._popfile), get_file_key(self._isofile),
+                                self._popyear, eventyear)
+
+    def _loadState(self, statefile, geodict, inputs):
+        # return the contents of an exposure state file, or None if it can't be used
+        # for the current grids
+        if not os.path.isfile(statefile):
+            return None
+        try:
+            with np.load(statefile) as data:
+                state = dict(data.items())
+        except Exception as e:
+            logging.warning('Could not read exposure state %s: "%s".' % (statefile, str(e)))
+            return None
+        gdict = dict(zip(GEODICT_KEYS, state['geodict'].tolist()))
+        gdict['nx'] = int(gdict['nx'])
+        gdict['ny'] = int(gdict['ny'])
+        if GeoDict(gdict) != geodict or str(state['inputs']) != inputs:
+            return None
+        return state
+
+    def saveState(self, statefile):
+        """Save the per-cell exposure state, for incremental updates of later ShakeMap versions.
+
+        :param statefile:
+          Path to output file (.npz).
+        :raises:
+          PagerException when calcExposure() has not been called, or the ShakeMap did not overlap the
+          population data.
+        """
+        if self._state is None:
+            raise PagerException('calcExposure() method must be called first.')
+        np.savez_compressed(statefile, **self._state)
+
+    def getChangedCells(self):
+        """Return the number of cells whose MMI bin changed since the exposure state passed to calcExposure().
+
+        :returns:
+          Number of changed cells, or None if the exposure was calculated from scratch.
+        """
+        return self._nchanged
+
     def getPopulationGrid(self):
         """Return the internal population grid.
 
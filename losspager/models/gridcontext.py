@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+
+# third party imports
+import numpy as np
+from mapio.shake import ShakeGrid
+from mapio.reader import get_file_geodict, read
+
+# local imports
+from losspager.utils.exception import PagerException
+from losspager.utils.gridstore import get_grid_store
+
+# value used to pad the urban/rural grid (same as RURAL in semimodel)
+URBAN_PAD_VALUE = 1
+
+
+def _read_window(store, gridfile, sampledict, **kwargs):
+    """Read the window of a grid file matching a sample geodict.
+
+    :param store:
+      GridStore object, or None.
+    :param gridfile:
+      Any GMT or ESRI style grid file supported by MapIO.
+    :param sampledict:
+      GeoDict aligned with the population grid.
+    :param kwargs:
+      Keyword arguments to mapio read(), used when the grid is not in the store.
+    :returns:
+      Grid2D object.
+    """
+    if store is not None:
+        grid = store.getGrid(gridfile, sampledict)
+        if grid is not None:
+            return grid
+    return read(gridfile, samplegeodict=sampledict, **kwargs)
+
+
+class GridContext(object):
+    def __init__(self, shakefile, popfile, isofile, urbanfile=None):
+        """Load the ShakeMap and global grids needed for one PAGER run, resampled once onto a common geodict.
+
+        The population grid defines the sampling: the ShakeMap is resampled (linear) and the country
+        code and urban/rural grids (nearest neighbor) onto the population cells within the ShakeMap
+        bounds.  The Exposure, EconExposure and SemiEmpiricalFatality models can all be handed the
+        same GridContext, instead of each of them reading and resampling the same files.
+
+        Grids in the context are shared - consumers must not modify their data in place.  When a
+        GridStore has been created for the population grid, the population, country code and urban/rural
+        windows are read-only views into the memory mapped store.
+
+        :param shakefile:
+          Path to ShakeMap grid.xml file.
+        :param popfile:
+          Any GMT or ESRI style grid file supported by MapIO, containing population data.
+        :param isofile:
+          Any GMT or ESRI style grid file supported by MapIO, containing country code data (ISO 3166-1 numeric).
+        :param urbanfile:
+          Optional grid file containing urban/rural data (rural cells indicated with a 1, urban cells with a 2).
+        """
+        self._shakefile = shakefile
+        self._popfile = popfile
+        self._isofile = isofile
+        self._urbanfile = urbanfile
+        self._popgrid = None
+        self._isogrid = None
+        self._urbgrid = None
+
+        shakedict = ShakeGrid.getFileGeoDict(shakefile, adjust='res')
+        popdict = get_file_geodict(popfile)
+        isodict = get_file_geodict(isofile)
+
+        # special case for very high latitude events that may be outside the bounds
+        # of our population data...
+        self._intersects = popdict.intersects(shakedict)
+        if not self._intersects:
+            self._shakegrid = ShakeGrid.load(shakefile, adjust='res')
+            self._sampledict = self._shakegrid.getGeoDict()
+            return
+
+        same = popdict == shakedict == isodict
+        if urbanfile is not None:
+            same = same and get_file_geodict(urbanfile) == popdict
+        if same:
+            # special case, probably for testing...
+            self._shakegrid = ShakeGrid.load(shakefile, adjust='res')
+            self._popgrid = read(popfile)
+            self._isogrid = read(isofile)
+            if urbanfile is not None:
+                self._urbgrid = read(urbanfile)
+        else:
+            sampledict = popdict.getBoundsWithin(shakedict)
+            self._shakegrid = ShakeGrid.load(shakefile, samplegeodict=sampledict, resample=True,
+                                             method='linear', adjust='res')
+            # windows of the global grids come from the memory mapped grid store, when there is one
+            store = get_grid_store(popfile)
+            self._popgrid = _read_window(store, popfile, sampledict,
+                                         resample=False, doPadding=True, padValue=np.nan)
+            self._isogrid = _read_window(store, isofile, sampledict,
+                                         resample=True, method='nearest', doPadding=True, padValue=0)
+            if urbanfile is not None:
+                self._urbgrid = _read_window(store, urbanfile, sampledict,
+                                             resample=True, method='nearest', doPadding=True,
+                                             padValue=URBAN_PAD_VALUE)
+        self._sampledict = self._popgrid.getGeoDict()
+
+    def checkFiles(self, popfile, isofile, urbanfile=None):
+        """Make sure this context was built from the same global grid files a model is configured with.
+
+        :param popfile:
+          File name of population grid.
+        :param isofile:
+          File name of numeric ISO country code grid.
+        :param urbanfile:
+          File name of urban/rural grid, or None if the model does not use one.
+        :raises:
+          PagerException when any of the files differ from the ones used to build the context.
+        """
+        if popfile != self._popfile or isofile != self._isofile:
+            raise PagerException('Grid context was built from different population/country grid files.')
+        if urbanfile is not None and urbanfile != self._urbanfile:
+            raise PagerException('Grid context was built from a different urban/rural grid file.')
+
+    def intersects(self):
+        """Indicate whether the ShakeMap overlaps the population data.
+
+        :returns:
+          False if the ShakeMap is entirely outside the population grid, in which case
+          only the ShakeMap grid is loaded, True otherwise.
+        """
+        return self._intersects
+
+    def getShakeFile(self):
+        """Return the path to the ShakeMap grid.xml file.
+
+        :returns:
+          Path to ShakeMap grid.xml file.
+        """
+        return self._shakefile
+
+    def getSampleDict(self):
+        """Return the geodict all of the grids in the context are sampled on.
+
+        :returns:
+          GeoDict object.
+        """
+        return self._sampledict
+
+    def getShakeGrid(self):
+        """Return the ShakeGrid object, resampled to the population grid.
+
+        :returns:
+          ShakeGrid object.
+        """
+        return self._shakegrid
+
+    def getPopulationGrid(self):
+        """Return the (unadjusted) population grid.
+
+        :returns:
+          Grid2D object containing population data.
+        """
+        if self._popgrid is None:
+            raise PagerException('ShakeMap does not intersect the population grid.')
+        return self._popgrid
+
+    def getCountryGrid(self):
+        """Return the Grid2D object containing ISO numeric country codes.
+
+        :returns:
+          Grid2D object containing ISO numeric country codes.
+        """
+        if self._isogrid is None:
+            raise PagerException('ShakeMap does not intersect the population grid.')
+        return self._isogrid
+
+    def getUrbanGrid(self):
+        """Return the Grid2D object containing urban/rural classes.
+
+        :returns:
+          Grid2D object containing urban (2) and rural (1) values.
+        """
+        if self._urbanfile is None:
+            raise PagerException('Grid context was created without an urban/rural grid file.')
+        if self._urbgrid is None:
+            raise PagerException('ShakeMap does not intersect the population grid.')
+        return self._urbgrid
@@ -3,6 +3,7 @@
 # stdlib imports
 import re
 import os.path
+import threading
 
 # third party imports
 import pandas as pd
@@ -11,9 +12,14 @@ import numpy as np
 # local imports
 from losspager.utils.exception import PagerException
 from losspager.utils.country import Country
+from losspager.utils.datacache import read_excel_cached
 
 DEFAULT_RATE = 1.17 / 100.0
 
+# process-wide PopulationGrowth object created from the default UN spreadsheet
+_DEFAULT_GROWTH = None
+_DEFAULT_GROWTH_LOCK = threading.Lock()
+
 
 def adjust_pop(population, tpop, tevent, rate):
     """Adjust input population between two input years given growth rate.
@@ -62,14 +68,28 @@ class PopulationGrowth(object):
                     'Length of start/end year arrays must match length of rate arrays.')
         self._dataframe = pd.DataFrame(ratedict)
         self._default = default_rate
+        # tables of yearly growth factors, keyed on (tpop,tevent)
+        self._factor_tables = {}
 
     @classmethod
     def fromDefault(cls):
-        homedir = os.path.dirname(os.path.abspath(
-            __file__))  # where is this module?
-        excelfile = os.path.join(
-            homedir, '..', 'data', 'WPP2015_POP_F02_POPULATION_GROWTH_RATE.xls')
-        return cls.fromUNSpreadsheet(excelfile)
+        """Return the PopulationGrowth object created from the UN spreadsheet included with this code.
+
+        The spreadsheet is only loaded once per process, and the same object is returned on
+        subsequent calls.
+
+        :returns:
+          PopulationGrowth instance.
+        """
+        global _DEFAULT_GROWTH
+        with _DEFAULT_GROWTH_LOCK:
+            if _DEFAULT_GROWTH is None:
+                homedir = os.path.dirname(os.path.abspath(
+                    __file__))  # where is this module?
+                excelfile = os.path.join(
+                    homedir, '..', 'data', 'WPP2015_POP_F02_POPULATION_GROWTH_RATE.xls')
+                _DEFAULT_GROWTH = cls.fromUNSpreadsheet(excelfile)
+        return _DEFAULT_GROWTH
 
     @classmethod
     def fromUNSpreadsheet(cls, excelfile, default_rate=DEFAULT_RATE):
@@ -84,7 +104,7 @@ class PopulationGrowth(object):
           PopulationGrowth instance.
         """
         re_year = '[0-9]*'
-        df = pd.read_excel(excelfile, header=16)
+        df = read_excel_cached(excelfile, header=16)
         ratedict = {}
         starts = []
         ends = []
@@ -187,3 +207,74 @@ class PopulationGrowth(object):
             newpop = adjust_pop(newpop, startpop, endpop, rate)
 
         return newpop
+
+    def getGrowthFactors(self, tpop, tevent):
+        """Return a table of the yearly growth factors used to adjust population between two years.
+
+        Tables are computed once per (tpop,tevent) pair, and cached.
+
+        :param tpop:
+          Year of population data collection.
+        :param tevent:
+          Year to which population data should be adjusted from tpop.
+        :returns:
+          Read-only (N+1 x abs(tevent-tpop)) array of growth factors, where row i contains the factors
+          for numeric country code i (0 <= i < N) and row N contains the factors for the default growth rate.
+          Column j is the factor for the j-th year moving from tpop to tevent.
+        """
+        key = (int(tpop), int(tevent))
+        if key not in self._factor_tables:
+            if tpop < tevent:
+                interval = 1
+            else:
+                interval = -1
+            years = np.arange(tpop, tevent, interval)
+            ccodes = [int(ccode) for ccode in self._dataframe.columns]
+            ncodes = max(ccodes + [0]) + 1
+            rates = np.full((ncodes + 1, len(years)), self._default)
+            for ccode in ccodes:
+                if ccode < 0:
+                    continue
+                rates[ccode] = [self.getRate(ccode, year) for year in years]
+            # same factor as adjust_pop() uses for a one year step
+            table = np.power((1 + rates), interval)
+            table.flags.writeable = False
+            self._factor_tables[key] = table
+        return self._factor_tables[key]
+
+    def adjustPopulationGrid(self, popdata, isodata, tpop, tevent):
+        """Adjust an array of population for growth rates, using an array of country codes.
+
+        This gives the same results as calling adjustPopulation() for the cells of each country
+        in turn, but all countries are adjusted together, one year at a time.
+
+        :param popdata:
+          Array of population values.
+        :param isodata:
+          Array (same shape as popdata) of numeric country codes.  Cells with NaN country codes are
+          not adjusted, and cells with codes not found in the growth data use the default rate.
+        :param tpop:
+          Year of population data collection.
+        :param tevent:
+          Year to which population data should be adjusted from tpop.
+        :returns:
+          New array (same shape and type as popdata) of population adjusted for growth rates in years
+          between tpop and tevent.
+        """
+        popdata = np.asarray(popdata)
+        isodata = np.asarray(isodata)
+        newpop = popdata.copy()
+        if tpop == tevent:
+            return newpop
+        table = self.getGrowthFactors(tpop, tevent)
+        default_row = table.shape[0] - 1
+        valid = ~np.isnan(isodata)
+        codes = isodata[valid].astype(np.int64)
+        rows = np.where((codes >= 0) & (codes < default_row), codes, default_row)
+        # like adjustPopulation(), do the yearly steps in double precision and cast back
+        # to the population type only once, at the end.
+        pop = popdata[valid]
+        for i in range(table.shape[1]):
+            pop = np.round(pop * table[rows, i])
+        newpop[valid] = pop
+        return newpop
@@ -4,19 +4,22 @@
 from datetime import timedelta
 import os.path
 import logging
+import threading
 
 # third party imports
 import pandas as pd
 import numpy as np
-from mapio.shake import ShakeGrid
-from mapio.reader import read, get_file_geodict
 
 # neic imports
 from impactutils.io.container import HDFContainer
 
 # local imports
 from .growth import PopulationGrowth
+from .gridcontext import GridContext
 from losspager.utils.country import Country
+from losspager.utils.datacache import get_cache_file, get_file_hash, load_cached
+from losspager.utils.gridstore import get_file_key
+from losspager.utils.timing import timed
 
 # constants indicating what values in urban/rural grid stand for
 URBAN = 2
@@ -45,6 +48,22 @@ TIMES = {'day': 'CasualtyDay',
          'transit': 'CasualtyDay',
          'night': 'CasualtyNight'}
 
+# MMI values (and collapse columns) used by the model
+MMI_VALUES = np.arange(6, 9.5, 0.5)
+
+# inventory sheets, by density class
+INVENTORY_SHEETS = {URBAN: ('UrbanResidential', 'UrbanNonResidential'),
+                    RURAL: ('RuralResidential', 'RuralNonResidential')}
+
+# version of the SemiTables layout, part of the cache file key.  Increment this when the
+# attributes of SemiTables change, so cache files written by older code are not loaded.
+SEMI_TABLES_VERSION = 2
+
+# process-wide dictionary of SemiTables objects, keyed on the names, sizes and modification
+# times of the HDF files
+_TABLES = {}
+_TABLES_LOCK = threading.Lock()
+
 
 def add_dicts(dict1, dict2):
     """Sum the values of two dictionaries.
@@ -75,6 +94,47 @@ def add_dicts(dict1, dict2):
     return result
 
 
+def group_cells(mmidata, popdata, isodata, urbdata):
+    """Group the population of cells at MMI 6-9 by country code, MMI and density class.
+
+    :param mmidata:
+      Array of MMI values, rounded to the nearest 0.5.
+    :param popdata:
+      Array of population values.
+    :param isodata:
+      Array of numeric country codes.
+    :param urbdata:
+      Array of density classes (URBAN or RURAL).
+    :returns:
+      Dictionary with (country code, MMI, density class) keys, and values of arrays of the
+      population of cells in each group, in the same (row-major) order as the input grids.
+    """
+    mmidata = np.asarray(mmidata).ravel()
+    popdata = np.asarray(popdata).ravel()
+    isodata = np.asarray(isodata).ravel()
+    urbdata = np.asarray(urbdata).ravel()
+    valid = (mmidata >= 6.0) & (mmidata <= 9.0) & ~np.isnan(isodata)
+    valid &= (urbdata == URBAN) | (urbdata == RURAL)
+    cells = np.flatnonzero(valid)
+    ccodes, cidx = np.unique(isodata[cells], return_inverse=True)
+    mmibins = np.round((mmidata[cells] - 6.0) / 0.5).astype(np.int64)
+    dbins = (urbdata[cells] == RURAL).astype(np.int64)
+    keys = (cidx * 7 + mmibins) * 2 + dbins
+    # a stable sort keeps the cells in each group in grid order
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    popcells = popdata[cells[order]]
+    ukeys, starts = np.unique(keys, return_index=True)
+    ends = np.append(starts[1:], len(keys))
+    groups = {}
+    for key, start, end in zip(ukeys, starts, ends):
+        ic, rem = divmod(int(key), 14)
+        mbin, dbin = divmod(rem, 2)
+        dclass = [URBAN, RURAL][dbin]
+        groups[(ccodes[ic], 6.0 + mbin * 0.5, dclass)] = popcells[start:end]
+    return groups
+
+
 def pop_dist(popi, workforce, time, dclass):
     """
     Calculate population distribution (residential, non-residential, and outdoor).
@@ -280,10 +340,138 @@ def get_time_of_day(dtime, lon):
     return (timeofday, event_year, event_hour)
 
 
+class SemiTables(object):
+    def __init__(self, inventory, collapse, casualty, workforce):
+        """Read all of the semi-empirical vulnerability data into memory, indexed for lookups.
+
+        :param inventory:
+          HDFContainer containing inventory DataFrames (see SemiEmpiricalFatality).
+        :param collapse:
+          HDFContainer containing one collapse rate DataFrame per country (see SemiEmpiricalFatality).
+        :param casualty:
+          HDFContainer containing one casualty rate DataFrame per country (see SemiEmpiricalFatality).
+        :param workforce:
+          DataFrame of workforce data, indexed by two letter country code (see SemiEmpiricalFatality).
+        """
+        self._buildings = inventory.getDataFrame('BuildingTypes').set_index('Code')
+        self._inventories = {}
+        for sheets in INVENTORY_SHEETS.values():
+            for sheet in sheets:
+                self._inventories[sheet] = inventory.getDataFrame(sheet).set_index('CountryCode')
+        self._collapse = {}
+        self._collapse_rates = {}
+        mmicols = ['MMI_%s' % str(mmi) for mmi in MMI_VALUES]
+        for ccode in collapse.getDataFrames():
+            collapse_frame = collapse.getDataFrame(ccode).set_index('BuildingCode')
+            self._collapse[ccode] = collapse_frame
+            rates = collapse_frame[mmicols].values.astype(np.float64)
+            self._collapse_rates[ccode] = (collapse_frame.index, rates)
+        self._casualty = {}
+        for ccode in casualty.getDataFrames():
+            self._casualty[ccode] = casualty.getDataFrame(ccode).set_index('BuildingCode')
+        self._workforce = workforce
+
+    @classmethod
+    def fromFiles(cls, inventory_file, collapse_file, casualty_file, workforce_file):
+        """Return the SemiTables object for a set of HDF files.
+
+        Tables are cached on disk (keyed on the contents of the files), and in memory (keyed
+        on the names, sizes and modification times of the files), so the HDF files are only
+        read, or hashed, the first time a given version of them is used.
+
+        :param inventory_file:
+          HDF5 file containing Semi-Empirical building inventory data in an HDFContainer.
+        :param collapse_file:
+          HDF5 file containing Semi-Empirical collapse rate data in an HDFContainer.
+        :param casualty_file:
+          HDF5 file containing Semi-Empirical casualty rate data in an HDFContainer.
+        :param workforce_file:
+          HDF5 file containing Semi-Empirical workforce data in an HDFContainer.
+        :returns:
+          SemiTables object.
+        """
+        hdffiles = (inventory_file, collapse_file, casualty_file, workforce_file)
+        filekey = tuple(get_file_key(hdffile) for hdffile in hdffiles)
+
+        def load_tables():
+            workforce = HDFContainer.load(workforce_file).getDataFrame('Workforce')
+            return cls(HDFContainer.load(inventory_file),
+                       HDFContainer.load(collapse_file),
+                       HDFContainer.load(casualty_file),
+                       workforce.set_index('CountryCode'))
+
+        with _TABLES_LOCK:
+            if filekey not in _TABLES:
+                hashes = [get_file_hash(hdffile) for hdffile in hdffiles[1:]]
+                cachefile = get_cache_file(inventory_file, SEMI_TABLES_VERSION, *hashes)
+                _TABLES[filekey] = load_cached(cachefile, load_tables)
+            return _TABLES[filekey]
+
+    def getBuildingTypes(self):
+        """Return the building type descriptions.
+
+        :returns:
+          DataFrame of building type descriptions, indexed by building code.
+        """
+        return self._buildings
+
+    def getInventory(self, sheet):
+        """Return one of the inventory tables.
+
+        :param sheet:
+          One of 'UrbanResidential','UrbanNonResidential','RuralResidential','RuralNonResidential'.
+        :returns:
+          DataFrame of inventory fractions, indexed by two letter country code.
+        """
+        return self._inventories[sheet]
+
+    def getCollapse(self, ccode):
+        """Return the collapse rates for a country.
+
+        :param ccode:
+          Two letter ISO country code.
+        :returns:
+          DataFrame of collapse rates, indexed by building code.
+        """
+        return self._collapse[ccode]
+
+    def getCollapseRates(self, ccode):
+        """Return the collapse rates for a country as an array, for fast lookups.
+
+        :param ccode:
+          Two letter ISO country code.
+        :returns:
+          Tuple of (Index of building codes, array of collapse rates with one row per building
+          code and one column per MMI value in MMI_VALUES).
+        """
+        return self._collapse_rates[ccode]
+
+    def getCasualty(self, ccode):
+        """Return the casualty rates (given collapse) for a country.
+
+        :param ccode:
+          Two letter ISO country code.
+        :returns:
+          DataFrame of casualty rates, indexed by building code.
+        """
+        return self._casualty[ccode]
+
+    def getWorkforce(self):
+        """Return the workforce table.
+
+        :returns:
+          DataFrame of workforce fractions, indexed by two letter country code.
+        """
+        return self._workforce
+
+
 class SemiEmpiricalFatality(object):
-    def __init__(self, inventory, collapse, casualty, workforce, growth):
+    def __init__(self, inventory, collapse, casualty, workforce, growth, tables=None):
         """Create Semi-Empirical Fatality Model object.
 
+        All of the inventory, collapse, casualty and workforce data are read into memory (as
+        a SemiTables object) when the model is created.
+
         :param inventory:
           HDFContainer, containing DataFrames named: 
            - 'BuildingTypes',
@@ -323,12 +511,14 @@ class SemiEmpiricalFatality(object):
             - WorkforceServices Fraction of the total workforce employed in services.
         :param growth:
           PopulationGrowth object.
-
+        :param tables:
+          SemiTables object already containing the data from the inventory, collapse, casualty and workforce
+          inputs, which are then ignored.
         """
-        self._inventory = inventory
-        self._collapse = collapse
-        self._casualty = casualty
-        self._workforce = workforce
+        if tables is None:
+            tables = SemiTables(inventory, collapse, casualty, workforce)
+        self._tables = tables
+        self._workforce = tables.getWorkforce()
         self._popgrowth = growth
         self._country = Country()
 
@@ -363,19 +553,13 @@ class SemiEmpiricalFatality(object):
         :returns:
           SemiEmpiricalFatality object.
         """
-        # turn the inventory,collapse, and casualty spreadsheets into Panels...
-        inventory = HDFContainer.load(inventory_file)
-        collapse = HDFContainer.load(collapse_file)
-        casualty = HDFContainer.load(casualty_file)
-        workforce = HDFContainer.load(workforce_file)
-        # extract the one dataframe from the Panel
-        workforce = workforce.getDataFrame('Workforce')
-        workforce = workforce.set_index('CountryCode')
+        # load the (cached) inventory, collapse, casualty and workforce tables
+        tables = SemiTables.fromFiles(inventory_file, collapse_file, casualty_file, workforce_file)
 
         # read the growth spreadsheet into a PopulationGrowth object...
         popgrowth = PopulationGrowth.fromDefault()
 
-        return cls(inventory, collapse, casualty, workforce, popgrowth)
+        return cls(None, None, None, tables.getWorkforce(), popgrowth, tables=tables)
 
     def setGlobalFiles(self, popfile, popyear, urbanfile, isofile):
         """Set the global data files (population,urban/rural, country code) for use of model with ShakeMaps.
@@ -410,8 +594,7 @@ class SemiEmpiricalFatality(object):
         :returns:
           Either a short, operational, or long description of building types.
         """
-        bsheet = self._inventory.getDataFrame('BuildingTypes')
-        bsheet = bsheet.set_index('Code')
+        bsheet = self._tables.getBuildingTypes()
         row = bsheet.loc[btype]
         if desctype == 'short':
             return row['ShortDescription']
@@ -447,19 +630,22 @@ class SemiEmpiricalFatality(object):
         :returns:
           Pandas Series object containing the collapse rates for given building types, ccode, and MMI.
         """
-        collapse_frame = self._collapse.getDataFrame(ccode)
-        collapse_frame = collapse_frame.set_index('BuildingCode')
-        try:
+        codes, rates = self._tables.getCollapseRates(ccode)
+        rows = None
+        if 'Unnamed: 0' in inventory.index:
             idx = inventory.index.drop('Unnamed: 0')
-            collapse_frame = collapse_frame.loc[idx]
-        except Exception:
+            rows = codes.get_indexer(idx)
+        if rows is None or (rows < 0).any():
             collapse_dict = inventory.to_dict()
             collapse = pd.Series(collapse_dict)
             for key, value in collapse_dict.items():
                 collapse[key] = np.nan
             return collapse
         mmicol = 'MMI_%s' % str(mmi)
-        collapse = collapse_frame[mmicol]
+        if mmi not in MMI_VALUES:
+            raise KeyError(mmicol)
+        imt = int(np.flatnonzero(MMI_VALUES == mmi)[0])
+        collapse = pd.Series(rates[rows, imt], index=codes[rows], name=mmicol)
         return collapse
 
     def getFatalityRates(self, ccode, timeofday, inventory):
@@ -474,8 +660,7 @@ class SemiEmpiricalFatality(object):
         :returns:
           Pandas Series object containing fatality rates for given country, time of day, and inventory.
         """
-        fatalframe = self._casualty.getDataFrame(ccode)
-        fatalframe = fatalframe.set_index('BuildingCode')
+        fatalframe = self._tables.getCasualty(ccode)
         timecol = TIMES[timeofday]
         if 'Unnamed: 0' in inventory.index:
             idx = inventory.index.drop('Unnamed: 0')
@@ -495,13 +680,11 @@ class SemiEmpiricalFatality(object):
           Two Pandas Series: 1) Residential Inventory and 2) Non-Residential Inventory.
         """
         if density == URBAN:
-            resinv = self._inventory.getDataFrame('UrbanResidential')
-            nresinv = self._inventory.getDataFrame('UrbanNonResidential')
+            ressheet, nressheet = INVENTORY_SHEETS[URBAN]
         else:
-            resinv = self._inventory.getDataFrame('RuralResidential')
-            nresinv = self._inventory.getDataFrame('RuralNonResidential')
-        resinv = resinv.set_index('CountryCode')
-        nresinv = nresinv.set_index('CountryCode')
+            ressheet, nressheet = INVENTORY_SHEETS[RURAL]
+        resinv = self._tables.getInventory(ressheet)
+        nresinv = self._tables.getInventory(nressheet)
 
         # we may be missing inventory for certain countries (Bonaire?). Return empty series.
         if ccode not in resinv.index or ccode not in nresinv.index:
@@ -522,57 +705,75 @@ class SemiEmpiricalFatality(object):
 
         return (resrow, nresrow)
 
-    def getLosses(self, shakefile):
+    def _getBuildingFatalities(self, ccode, mmicells, popcells, inventory, fatalcol):
+        """Sum fatalities per building type and MMI over the cells of one country and density class.
+
+        :param ccode:
+          Two letter ISO country code.
+        :param mmicells:
+          Array of MMI values (in MMI_VALUES) of the cells, in ascending order.
+        :param popcells:
+          Array of (residential or non-residential) population in the cells.
+        :param inventory:
+          Pandas Series containing an inventory for the given country and density class.
+        :param fatalcol:
+          Pandas Series of fatality rates (given collapse) for the inventory building types.
+        :returns:
+          Array of fatalities with one row per building type in inventory and one column per
+          MMI value in MMI_VALUES, where fatalities of less than one in any cell are ignored.
+        """
+        numtypes = len(inventory)
+        fatsums = np.zeros((numtypes, len(MMI_VALUES)), dtype=np.float32)
+        if numtypes == 0 or len(popcells) == 0:
+            return fatsums
+        invmat = np.reshape(
+            inventory.values, (numtypes, 1)).astype(np.float32)
+        # collapse rates of the building types (rows) at each MMI value (columns)
+        rates = np.column_stack([self.getCollapse(ccode, mmi, inventory).values
+                                 for mmi in MMI_VALUES]).astype(np.float32)
+        fatal = np.reshape(
+            fatalcol.values.astype(np.float32), (numtypes, 1))
+        mmibins = np.round((mmicells - MMI_VALUES[0]) / 0.5).astype(np.int64)
+        # rows are building types, columns are population cells
+        fatmat = (popcells[np.newaxis, :] * invmat) * rates[:, mmibins] * fatal
+
+        # zero out the cells where fatalities are less than 1, ignore nan
+        fatmat[fatmat < 1] = 0.0
+        fatmat = np.nan_to_num(fatmat)
+
+        # sum the cells at each MMI, which are contiguous
+        counts = np.bincount(mmibins, minlength=len(MMI_VALUES))
+        starts = np.cumsum(counts) - counts
+        nonempty = counts > 0
+        fatsums[:, nonempty] = np.add.reduceat(fatmat, starts[nonempty], axis=1)
+        return fatsums
+
+    @timed('SemiEmpiricalFatality.getLosses')
+    def getLosses(self, shakefile, context=None):
         """Calculate number of fatalities using semi-empirical approach.
 
         :param shakefile:
           Path to a ShakeMap grid.xml file.
+        :param context:
+          Optional GridContext object, already containing the ShakeMap, population, country and
+          urban/rural grids for this event.  If not supplied, the grids will be read from disk.
         :returns:
           Tuple of:
             1) Total number of fatalities
             2) Dictionary of residential fatalities per building type, per country.
             3) Dictionary of non-residential fatalities per building type, per country.
         """
-        # get shakemap geodict
-        shakedict = ShakeGrid.getFileGeoDict(shakefile, adjust='res')
-        # get population geodict
-        popdict = get_file_geodict(self._popfile)
-
-        # get country code geodict
-        isodict = get_file_geodict(self._isofile)
-
-        # get urban grid geodict
-        urbdict = get_file_geodict(self._urbanfile)
-
         # load all of the grids we need
-        if popdict == shakedict == isodict == urbdict:
-            # special case, probably for testing...
-            shakegrid = ShakeGrid.load(shakefile, adjust='res')
-            popgrid = read(self._popfile)
-            isogrid = read(self._isofile)
-            urbgrid = read(self._urbanfile)
+        if context is None:
+            context = GridContext(shakefile, self._popfile, self._isofile, urbanfile=self._urbanfile)
         else:
-            sampledict = popdict.getBoundsWithin(shakedict)
-            shakegrid = ShakeGrid.load(shakefile,
-                                       samplegeodict=sampledict,
-                                       resample=True,
-                                       method='linear',
-                                       adjust='res')
-            popgrid = read(self._popfile,
-                           samplegeodict=sampledict,
-                           resample=False)
-            isogrid = read(self._isofile,
-                           samplegeodict=sampledict,
-                           resample=True,
-                           method='nearest',
-                           doPadding=True,
-                           padValue=0)
-            urbgrid = read(self._urbanfile,
-                           samplegeodict=sampledict,
-                           resample=True,
-                           method='nearest',
-                           doPadding=True,
-                           padValue=RURAL)
+            context.checkFiles(self._popfile, self._isofile, urbanfile=self._urbanfile)
+        if not context.intersects():
+            return (0, {}, {})
+        shakegrid = context.getShakeGrid()
+        popgrid = context.getPopulationGrid()
+        isogrid = context.getCountryGrid()
+        urbgrid = context.getUrbanGrid()
 
         # determine the local apparent time of day (based on longitude)
         edict = shakegrid.getEventDict()
@@ -591,12 +792,10 @@ class SemiEmpiricalFatality(object):
         isodata = isogrid.getData()
         urbdata = urbgrid.getData()
 
-        # modify the population values for growth rate by country
-        ucodes = np.unique(isodata[~np.isnan(isodata)])
-        for ccode in ucodes:
-            cidx = (isodata == ccode)
-            popdata[cidx] = self._popgrowth.adjustPopulation(
-                popdata[cidx], ccode, self._popyear, event_year)
+        # modify the population values for growth rate by country (this makes a new array,
+        # leaving the shared population grid alone)
+        popdata = self._popgrowth.adjustPopulationGrid(popdata, isodata,
+                                                       self._popyear, event_year)
 
         # create a dictionary containing indoor populations by building type (in cells where MMI >= 6)
         #popbystruct = get_indoor_pop(mmidata,popdata,urbdata,isodata,time_of_day)
@@ -604,6 +803,10 @@ class SemiEmpiricalFatality(object):
         # find all mmi values greater than 9, set them to 9
         mmidata[mmidata > 9.0] = 9.0
 
+        # sort the cells at MMI 6-9 into groups by country, MMI and density class, in one pass
+        groups = group_cells(mmidata, popdata, isodata, urbdata)
+        empty = np.zeros((0,), dtype=popdata.dtype)
+
         # dictionary containers for sums of fatalities (res/nonres) by building type
         res_fatal_by_ccode = {}
         nonres_fatal_by_ccode = {}
@@ -613,112 +816,72 @@ class SemiEmpiricalFatality(object):
 
         # loop over countries
         ucodes = np.unique(isodata[~np.isnan(isodata)])
-        for ucode in ucodes:
-            if ucode == 0:
-                continue
+        ucodes = ucodes[ucodes != 0]
+        index = self._country.getIndex()
+        iso2codes = index.translate(ucodes, 'ISO2')
+        names = index.translate(ucodes, 'Name')
+        for ucode, ccode, cname in zip(ucodes, iso2codes, names):
             res_fatal_by_btype = {}
             nonres_fatal_by_btype = {}
 
-            cdict = self._country.getCountry(int(ucode))
-            ccode = cdict['ISO2']
             # get the workforce Series data for the current country
             wforce = self.getWorkforce(ccode)
             if wforce is None:
                 logging.info('No workforce data for %s.  Skipping.' %
-                             (cdict['Name']))
+                             (cname))
                 continue
 
-            # loop over MMI values 6-9
-            for mmi in np.arange(6, 9.5, 0.5):
-                c1 = (mmidata == mmi)
-                c2 = (isodata == ucode)
-                if ucode > 900 and ucode != CALIFORNIA_US_CCODE:
-                    ucode = US_CCODE
-                for dclass in [URBAN, RURAL]:
-                    c3 = (urbdata == dclass)
-
-                    # get the population data in those cells at MMI, in country, and density class
-                    # I think I want an AND condition here
-                    popcells = popdata[c1 & c2 & c3]
-
-                    # get the population distribution across residential, non-residential, and outdoor.
-                    res, nonres, outside = pop_dist(
-                        popcells, wforce, time_of_day, dclass)
-
-                    # get the inventory for urban residential
-                    resrow, nresrow = self.getInventories(ccode, dclass)
-
-                    # TODO - figure out why this is happening, make the following lines
-                    # not necessary
-                    if 'Unnamed: 0' in resrow:
-                        resrow = resrow.drop('Unnamed: 0')
-                    if 'Unnamed: 0' in nresrow:
-                        nresrow = nresrow.drop('Unnamed: 0')
-                    # now multiply the residential/non-residential population through the inventory data
-                    numres = len(resrow)
-                    numnonres = len(nresrow)
-                    resmat = np.reshape(
-                        resrow.values, (numres, 1)).astype(np.float32)
-                    nresmat = np.reshape(
-                        nresrow.values, (numnonres, 1)).astype(np.float32)
-                    popres = np.tile(res, (numres, 1))
-                    popnonres = np.tile(nonres, (numnonres, 1))
-                    popresbuilding = (popres * resmat)
-                    popnonresbuilding = (popnonres * nresmat)
-
-                    # now we have the residential and non-residental population
-                    # distributed through the building types for each cell that matches
-                    # MMI,country, and density criteria.
-                    # popresbuilding rows are building types, columns are population cells
-
-                    # next, we get the collapse rates for these buildings
-                    # and multiply them by the population by building.
-                    collapse_res = self.getCollapse(ccode, mmi, resrow)
-                    collapse_nonres = self.getCollapse(ccode, mmi, nresrow)
-                    resrates = np.reshape(
-                        collapse_res.values.astype(np.float32), (numres, 1))
-                    nonresrates = np.reshape(
-                        collapse_nonres.values.astype(np.float32), (numnonres, 1))
-                    rescollapse = popresbuilding * resrates
-                    nonrescollapse = popnonresbuilding * nonresrates
-
-                    # get the fatality rates given collapse by building type and
-                    # multiply through the result of collapse*population per building
-                    resfatalcol = self.getFatalityRates(
-                        ccode, time_of_day, resrow)
-                    nonresfatalcol = self.getFatalityRates(
-                        ccode, time_of_day, nresrow)
-                    resfatal = np.reshape(
-                        resfatalcol.values.astype(np.float32), (numres, 1))
-                    nonresfatal = np.reshape(
-                        nonresfatalcol.values.astype(np.float32), (numnonres, 1))
-                    resfat = rescollapse * resfatal
-                    nonresfat = nonrescollapse * nonresfatal
-
-                    # zero out the cells where fatalities are less than 1 or nan
-                    try:
-                        if len(resfat) and len(resfat[0]):
-                            resfat[np.ma.masked_less(resfat, 1).mask] = 0.0
-                    except:
-                        resfat[np.isnan(resfat)] = 0.0
-                    try:
-                        if len(nonresfat) and len(nonresfat[0]):
-                            nonresfat[np.ma.masked_less(
-                                nonresfat, 1).mask] = 0.0
-                    except:
-                        nonresfat[np.isnan(nonresfat)] = 0.0
-
-                    # sum the fatalities per building through all cells
-                    resfatbybuilding = np.nansum(resfat, axis=1)
-                    nonresfatbybuilding = np.nansum(nonresfat, axis=1)
-                    resfdict = dict(
-                        zip(resrow.index, resfatbybuilding.tolist()))
-                    nonresfdict = dict(
-                        zip(nresrow.index, nonresfatbybuilding.tolist()))
-                    res_fatal_by_btype = add_dicts(
-                        res_fatal_by_btype, resfdict)
-                    nonres_fatal_by_btype = add_dicts(
-                        nonres_fatal_by_btype, nonresfdict)
+            # inventories and fatality rates depend only on the density class
+            tables = {}
+            for dclass in [URBAN, RURAL]:
+                resrow, nresrow = self.getInventories(ccode, dclass)
+                # TODO - figure out why this is happening, make the following lines
+                # not necessary
+                if 'Unnamed: 0' in resrow:
+                    resrow = resrow.drop('Unnamed: 0')
+                if 'Unnamed: 0' in nresrow:
+                    nresrow = nresrow.drop('Unnamed: 0')
+                resfatalcol = self.getFatalityRates(ccode, time_of_day, resrow)
+                nonresfatalcol = self.getFatalityRates(ccode, time_of_day, nresrow)
+                tables[dclass] = (resrow, nresrow, resfatalcol, nonresfatalcol)
+
+            for dclass in [URBAN, RURAL]:
+                resrow, nresrow, resfatalcol, nonresfatalcol = tables[dclass]
+
+                # get the population data in the cells at MMI 6-9 in country and density class,
+                # in order of MMI.
+                # NB: after MMI 6.0, the eastern and western US regions are matched to
+                # US (840) cells, as they always have been in this model.
+                gcode = ucode
+                popcells = []
+                mmicells = []
+                for mmi in MMI_VALUES:
+                    cells = groups.get((gcode, mmi, dclass), empty)
+                    popcells.append(cells)
+                    mmicells.append(np.full(len(cells), mmi))
+                    if gcode > 900 and gcode != CALIFORNIA_US_CCODE:
+                        gcode = US_CCODE
+                popcells = np.concatenate(popcells)
+                mmicells = np.concatenate(mmicells)
+
+                # get the population distribution across residential, non-residential, and outdoor.
+                res, nonres, outside = pop_dist(
+                    popcells, wforce, time_of_day, dclass)
+
+                # multiply the residential/non-residential population through the
+                # inventory, collapse rates and fatality rates (given collapse), summed over MMI
+                resfatbybuilding = self._getBuildingFatalities(
+                    ccode, mmicells, res, resrow, resfatalcol).sum(axis=1, dtype=np.float64)
+                nonresfatbybuilding = self._getBuildingFatalities(
+                    ccode, mmicells, nonres, nresrow, nonresfatalcol).sum(axis=1, dtype=np.float64)
+                resfdict = dict(
+                    zip(resrow.index, resfatbybuilding.tolist()))
+                nonresfdict = dict(
+                    zip(nresrow.index, nonresfatbybuilding.tolist()))
+                res_fatal_by_btype = add_dicts(
+                    res_fatal_by_btype, resfdict)
+                nonres_fatal_by_btype = add_dicts(
+                    nonres_fatal_by_btype, nonresfdict)
 
             # add the fatalities by building type to the dictionary containing fatalities by country
             res_fatal_by_ccode[ccode] = res_fatal_by_btype.copy()
@@ -402,10 +402,11 @@ def get_structure_comment(resfat, nonresfat, semimodel):
 
 def get_secondary_hazards(expocat, mag):
     WAVETHRESH = 0.50
-    fireevents = expocat.selectByHazard("fire")
-    liquidevents = expocat.selectByHazard("liquefaction")
-    slideevents = expocat.selectByHazard("landslide")
-    waveevents = expocat.selectByHazard("tsunami")
+    # queries only count events, only the tsunami events are copied out of the catalog
+    fireevents = expocat.query().byHazard("fire")
+    liquidevents = expocat.query().byHazard("liquefaction")
+    slideevents = expocat.query().byHazard("landslide")
+    waveevents = expocat.query().byHazard("tsunami")
     # get numbers of each type of secondary event
     nwaves = len(waveevents)
     nslides = len(slideevents)
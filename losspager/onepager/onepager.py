@@ -12,6 +12,9 @@ from impactutils.comcat.query import ComCatInfo
 from impactutils.io.cmd import get_command_output
 import numpy as np
 
+# local imports
+from losspager.utils.timing import timed
+
 LATEX_TO_PDF_BIN = 'pdflatex'
 
 LATEX_SPECIAL_CHARACTERS = OrderedDict([('\\', '\\textbackslash{}'),
@@ -36,6 +39,7 @@ def texify(text):
     return newtext
 
 
+@timed('create_onepager')
 def create_onepager(pdata, version_dir, debug=False):
     """
     :param pdata:
@@ -0,0 +1,438 @@
+#!/usr/bin/env python
+
+# stdlib imports
+import json
+import os.path
+import pathlib
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+# third party imports
+import pandas as pd
+import rasterio
+from impactutils.time.timeutils import LocalTime
+from mapio.shake import getHeaderData
+from rasterio.sample import sample_gen
+
+# local imports
+from losspager.io.resultstore import PAGERALL_TABLE
+from losspager.models.econexposure import EconExposure
+from losspager.models.emploss import EmpiricalLoss
+from losspager.models.exposure import Exposure
+from losspager.utils.country import Country
+from losspager.utils.exception import PagerException
+
+# columns (in order) of the pagerall output
+HEADER_COLS = [
+    "EventID",
+    "Time",
+    "LocalTime",
+    "Latitude",
+    "Longitude",
+    "Depth",
+    "Magnitude",
+    "Location",
+    "EpicentralCountryCode",
+    "CountryCode",
+    "MMI01",
+    "MMI02",
+    "MMI03",
+    "MMI04",
+    "MMI05",
+    "MMI06",
+    "MMI07",
+    "MMI08",
+    "MMI09",
+    "MMI10",
+    "MaxMMI1000",
+    "Fatalities",
+    "EconMMI01",
+    "EconMMI02",
+    "EconMMI03",
+    "EconMMI04",
+    "EconMMI05",
+    "EconMMI06",
+    "EconMMI07",
+    "EconMMI08",
+    "EconMMI09",
+    "EconMMI10",
+    "Dollars",
+]
+
+# number of grids whose results are saved in each partition of a ResultsStore
+STORE_PARTITION_SIZE = 100
+
+# configuration and loss models loaded once in each batch worker process
+_WORKER_STATE = {}
+
+
+def get_pop_year(config, event_year):
+    # find the population data collected most closely to the event_year
+    pop_year = None
+    tmin = 10000000
+    popfile = None
+    for popdict in config["model_data"]["population_data"]:
+        popyear = popdict["population_year"]
+        popgrid = pathlib.Path(popdict["population_grid"])
+        if not popgrid.is_file():
+            raise PagerException("Population grid file %s does not exist." % popgrid)
+        if abs(popyear - event_year) < tmin:
+            tmin = abs(popyear - event_year)
+            pop_year = popyear
+            popfile = popgrid
+
+    return (pop_year, popfile)
+
+
+def get_exposure(master_row, isofile, popfile, pop_year, gridfile):
+    # Get exposure results
+
+    expomodel = Exposure(popfile, pop_year, isofile)
+    exposure = expomodel.calcExposure(gridfile)
+    exp_rows = []
+    for key, value in exposure.items():
+        if key != "TotalExposure" and len(key) != 2:
+            continue
+        row = {}
+        ccode = key
+        if key == "TotalExposure":
+            ccode = "Total"
+        row["CountryCode"] = ccode
+        headers = [f"MMI{i:02d}" for i in range(1, 11)]
+        mmi_dict = dict(zip(headers, value))
+        row.update(mmi_dict)
+        exp_rows.append(row)
+
+    expframe = pd.DataFrame(data=exp_rows)
+    for key, value in master_row.items():
+        expframe[key] = value
+    allcols = expframe.columns
+    remainder = set(allcols) - set(master_row.keys())
+    newcols = list(master_row.keys()) + sorted(list(remainder))
+    expframe = expframe[newcols]
+    maxmmi_array = []
+    for _, row in expframe.iterrows():
+        mmi_idx = row[headers] > 1000
+        if not len(mmi_idx[mmi_idx].index):
+            maxmmi_array.append(0)
+            continue
+        maxmmi_col = mmi_idx[mmi_idx].index[-1]
+        maxmmi_array.append(headers.index(maxmmi_col) + 1)
+    expframe["MaxMMI1000"] = maxmmi_array
+    return (expframe, exposure, expomodel)
+
+
+def get_fatalities(expframe, exposure, fatmodel=None):
+    if fatmodel is None:
+        fatmodel = EmpiricalLoss.fromDefaultFatality()
+    fatdict = fatmodel.getLosses(exposure)
+    fatdict["Total"] = fatdict.pop("TotalFatalities")
+    fatframe = expframe.copy()
+    fatframe["Fatalities"] = 0
+    for key, value in fatdict.items():
+        fatframe.loc[fatframe["CountryCode"] == key, "Fatalities"] = value
+    return fatframe
+
+
+def get_econ_losses(fatframe, expomodel, exposure, ecomodel=None):
+    # re-use the grids already loaded (and growth adjusted) by the exposure model
+    econexpmodel = EconExposure.fromExposure(expomodel)
+    if ecomodel is None:
+        ecomodel = EmpiricalLoss.fromDefaultEconomic()
+    econexposure = econexpmodel.calcEconExposure(exposure)
+    rows = []
+    for key, value in econexposure.items():
+        if key != "TotalEconomicExposure" and len(key) != 2:
+            continue
+        row = {}
+        ccode = key
+        if key == "TotalEconomicExposure":
+            ccode = "Total"
+        row["CountryCode"] = ccode
+        headers = [f"EconMMI{i:02d}" for i in range(1, 11)]
+        mmi_dict = dict(zip(headers, value))
+        row.update(mmi_dict)
+        rows.append(row)
+    econframe = pd.DataFrame(data=rows)
+    econframe = pd.merge(fatframe, econframe, on="CountryCode")
+    ecodict = ecomodel.getLosses(econexposure)
+    ecodict["Total"] = ecodict.pop("TotalDollars")
+    econframe["Dollars"] = 0
+    for key, value in ecodict.items():
+        econframe.loc[econframe["CountryCode"] == key, "Dollars"] = value
+    return econframe
+
+
+def get_local_time(etime, timezone_file, lat, lon):
+    ltime = LocalTime(timezone_file, etime, lat, lon)
+    localtime = ltime.getLocalTime()
+    return localtime
+
+
+def get_event_frame(gridfile, config, fatmodel=None, ecomodel=None):
+    """Calculate empirical PAGER exposure and losses for one ShakeMap.
+
+    :param gridfile:
+      Path to ShakeMap grid.xml file.
+    :param config:
+      Dictionary containing configuration parameters.
+    :param fatmodel:
+      EmpiricalLoss fatality model, or None to load the default model.
+    :param ecomodel:
+      EmpiricalLoss economic model, or None to load the default model.
+    :returns:
+      DataFrame with the HEADER_COLS columns, one row per country plus a row of totals.
+    """
+    # get all the basic event information
+    shake_tuple = getHeaderData(gridfile)
+    local_time = get_local_time(
+        shake_tuple[1]["event_timestamp"],
+        config["model_data"]["timezones_file"],
+        shake_tuple[1]["lat"],
+        shake_tuple[1]["lon"],
+    )
+    master_row = {}
+    master_row["EventID"] = shake_tuple[1]["event_id"]
+    master_row["Time"] = shake_tuple[1]["event_timestamp"]
+    master_row["LocalTime"] = local_time
+    master_row["Latitude"] = shake_tuple[1]["lat"]
+    master_row["Longitude"] = shake_tuple[1]["lon"]
+    master_row["Depth"] = shake_tuple[1]["depth"]
+    master_row["Magnitude"] = shake_tuple[1]["magnitude"]
+    master_row["Location"] = shake_tuple[1]["event_description"]
+    event_year = shake_tuple[1]["event_timestamp"].year
+    isofile = config["model_data"]["country_grid"]
+    country = Country()
+    with rasterio.open(isofile, "r") as dataset:
+        xy = [(shake_tuple[1]["lon"], shake_tuple[1]["lat"])]
+        isocode = list(sample_gen(dataset, xy))[0][0]
+        ccode = country.getCountry(isocode)["ISO2"]
+    master_row["EpicentralCountryCode"] = ccode
+    pop_year, popfile = get_pop_year(config, event_year)
+    expframe, exposure, expomodel = get_exposure(
+        master_row, isofile, popfile, pop_year, gridfile
+    )
+    fatframe = get_fatalities(expframe, exposure, fatmodel=fatmodel)
+    ecoframe = get_econ_losses(fatframe, expomodel, exposure, ecomodel=ecomodel)
+    return ecoframe
+
+
+def _init_worker(config):
+    # load configuration and models once per worker process
+    _WORKER_STATE["config"] = config
+    _WORKER_STATE["fatmodel"] = EmpiricalLoss.fromDefaultFatality()
+    _WORKER_STATE["ecomodel"] = EmpiricalLoss.fromDefaultEconomic()
+    Country()
+
+
+def _process_grid(gridfile):
+    # run in a worker process, return (gridfile, list of row dictionaries, error message)
+    try:
+        frame = get_event_frame(
+            gridfile,
+            _WORKER_STATE["config"],
+            fatmodel=_WORKER_STATE["fatmodel"],
+            ecomodel=_WORKER_STATE["ecomodel"],
+        )
+        return (gridfile, frame.to_dict(orient="records"), None)
+    except Exception as e:
+        return (gridfile, None, "%s\n%s" % (str(e), traceback.format_exc()))
+
+
+def _flush_to_store(store, pending, partfile):
+    # append the rows of a list of (gridfile, rows, error) results to the store, as one partition
+    allrows = []
+    for gridfile, rows, error in pending:
+        allrows += rows
+    store.append(
+        pd.DataFrame(allrows, columns=HEADER_COLS), table=PAGERALL_TABLE, partfile=partfile
+    )
+
+
+def _ends_with_newline(filename):
+    with open(filename, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+
+def read_checkpoint(checkpoint, store=None):
+    """Read the results saved in a batch checkpoint file.
+
+    :param checkpoint:
+      Path to checkpoint file written by run_batch() (JSON, one grid per line).
+    :param store:
+      ResultsStore object the batch saved its rows to, or None.  Grids whose rows were to be
+      saved in a partition that is not in the store (because the batch was interrupted before
+      it was written) are left out.
+    :returns:
+      Dictionary of {gridfile: (list of row dictionaries, error message)}, empty if
+      the checkpoint file does not exist.
+    """
+    results = {}
+    if checkpoint is None or not os.path.isfile(checkpoint):
+        return results
+    with open(checkpoint, "rt") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # a partial line from an interrupted batch
+                continue
+            partition = record.get("partition")
+            if partition is not None and store is not None:
+                partfile = os.path.join(store.getFolder(), PAGERALL_TABLE, partition)
+                if not os.path.isfile(partfile):
+                    results.pop(record["gridfile"], None)
+                    continue
+            results[record["gridfile"]] = (record["rows"], record["error"])
+    return results
+
+
+def run_batch(
+    gridfiles,
+    config,
+    nprocs=4,
+    checkpoint=None,
+    progress=None,
+    store=None,
+    partition_size=STORE_PARTITION_SIZE,
+    retry_failed=True,
+    mp_context=None,
+):
+    """Calculate empirical PAGER exposure and losses for many ShakeMaps in a pool of processes.
+
+    Each worker process loads the loss models once, and takes grid files one at a time
+    from the pool's shared queue, so slow events do not hold up a whole chunk of others.
+    Results are returned to this process as rows, and (optionally) appended to a checkpoint
+    file as each grid finishes, so an interrupted batch can be resumed by calling run_batch()
+    with the same checkpoint file.  If a worker process dies (i.e., is killed for running out of
+    memory), the grids that were not finished are recorded as failed, and the rest of the
+    batch can be resumed from the checkpoint file.
+
+    When a ResultsStore is supplied, rows are appended to its pagerall table every partition_size
+    grids instead of being kept in memory (or in the checkpoint file).
+
+    :param gridfiles:
+      Sequence of paths to ShakeMap grid.xml files.
+    :param config:
+      Dictionary containing configuration parameters.
+    :param nprocs:
+      Number of worker processes.
+    :param checkpoint:
+      Path to checkpoint file, or None.
+    :param progress:
+      Function called with (number of grids done, total number of grids, gridfile, error message)
+      as each grid finishes, or None.
+    :param store:
+      ResultsStore object, or None.
+    :param partition_size:
+      Number of grids whose rows are saved in each partition of the store.
+    :param retry_failed:
+      If True, grids that failed in a previous run (according to the checkpoint file) are
+      processed again, otherwise their previous error is returned.
+    :param mp_context:
+      multiprocessing context used to start the worker processes, or None to use the default
+      start method.
+    :returns:
+      Tuple of (DataFrame with HEADER_COLS columns for all successful grids, in input order (None
+      if a store was supplied), dictionary of {gridfile: error message} for failed grids).
+    """
+    gridfiles = [str(gridfile) for gridfile in gridfiles]
+    results = read_checkpoint(checkpoint, store=store)
+    if retry_failed:
+        results = {
+            gridfile: result for gridfile, result in results.items() if result[1] is None
+        }
+    todo = [gridfile for gridfile in gridfiles if gridfile not in results]
+    ndone = len(gridfiles) - len(todo)
+    ntotal = len(gridfiles)
+    if len(todo):
+        fcheck = None
+        if checkpoint is not None:
+            fcheck = open(checkpoint, "at")
+            if fcheck.tell() > 0 and not _ends_with_newline(checkpoint):
+                # end the partial line left by an interrupted batch
+                fcheck.write("\n")
+
+        def save_results(batch_results, partition=None):
+            # grids saved to the store are recorded with the name of their partition
+            for gridfile, rows, error in batch_results:
+                results[gridfile] = (rows, error)
+                if fcheck is not None:
+                    record = {"gridfile": gridfile, "rows": rows, "error": error}
+                    if partition is not None:
+                        record["partition"] = partition
+                    fcheck.write(json.dumps(record) + "\n")
+            if fcheck is not None:
+                fcheck.flush()
+
+        def flush_pending(pending):
+            # record the grids in the checkpoint before writing their partition, so a batch
+            # interrupted in between redoes them (the partition does not exist), instead of
+            # appending their rows to the store a second time.
+            partfile = store.newPartition(PAGERALL_TABLE)
+            save_results(
+                [(grid, None, None) for grid, _, _ in pending],
+                partition=os.path.basename(partfile),
+            )
+            _flush_to_store(store, pending, partfile)
+
+        pending = []
+        try:
+            with ProcessPoolExecutor(
+                max_workers=nprocs,
+                mp_context=mp_context,
+                initializer=_init_worker,
+                initargs=(config,),
+            ) as executor:
+                futures = {
+                    executor.submit(_process_grid, gridfile): gridfile for gridfile in todo
+                }
+                for future in as_completed(futures):
+                    try:
+                        gridfile, rows, error = future.result()
+                    except BrokenProcessPool as e:
+                        # a worker died, so this grid (and all others still in the pool)
+                        # are recorded as failed, and can be retried from the checkpoint
+                        gridfile = futures[future]
+                        rows = None
+                        error = "Worker process died: %s" % str(e)
+                    if rows is None:
+                        save_results([(gridfile, rows, error)])
+                    elif store is not None:
+                        pending.append((gridfile, rows, error))
+                        if len(pending) >= partition_size:
+                            flush_pending(pending)
+                            pending = []
+                    else:
+                        # round trip through JSON, so results are the same whether or not they
+                        # were read back from a checkpoint
+                        rows = json.loads(
+                            pd.DataFrame(rows).to_json(orient="records", date_format="iso")
+                        )
+                        save_results([(gridfile, rows, error)])
+                    ndone += 1
+                    if progress is not None:
+                        progress(ndone, ntotal, gridfile, error)
+        finally:
+            # save whatever has been calculated, even if the batch was interrupted
+            if len(pending):
+                flush_pending(pending)
+            if fcheck is not None:
+                fcheck.close()
+
+    allrows = []
+    errors = {}
+    for gridfile in gridfiles:
+        rows, error = results[gridfile]
+        if error is not None:
+            errors[gridfile] = error
+            continue
+        if rows is not None:
+            allrows += rows
+    if store is not None:
+        return (None, errors)
+    dataframe = pd.DataFrame(allrows, columns=HEADER_COLS)
+    dataframe["Time"] = pd.to_datetime(dataframe["Time"])
+    return (dataframe, errors)
@@ -0,0 +1,475 @@
+#!/usr/bin/env python
+
+# stdlib imports
+import os.path
+import shutil
+import socket
+import tempfile
+from collections import OrderedDict
+from datetime import datetime
+from importlib import metadata
+
+# third party imports
+import numpy as np
+import pandas as pd
+from mapio.city import Cities
+from mapio.geodict import GeoDict
+from mapio.grid2d import Grid2D
+from mapio.shake import ShakeGrid
+from mapio.writer import write
+
+# local imports
+from losspager.io.pagerdata import PagerData
+from losspager.models.econexposure import EconExposure
+from losspager.models.emploss import EmpiricalLoss
+from losspager.models.exposure import Exposure, calc_exposure
+from losspager.models.semimodel import SemiEmpiricalFatality
+from losspager.onepager.pagercity import PagerCities
+from losspager.utils.country import Country
+from losspager.utils.expocat import ExpoCat
+from losspager.utils.timing import StageTimings
+
+# sizes (number of cells on each side) of the synthetic ShakeMaps.  A 5000x5000 ShakeMap
+# is a grid.xml file of about 1 GB, and takes several minutes to generate.
+BENCHMARK_SIZES = (100, 1000, 5000)
+DEFAULT_SIZES = (100, 1000)
+
+# numbers of countries covered by the synthetic grids
+DEFAULT_COUNTRIES = (1, 10)
+
+# resolution of the synthetic grids (30 arc seconds, the resolution of LandScan)
+GRID_RESOLUTION = 1.0 / 120.0
+
+# number of cells added around the ShakeMap on each side of the population, country and
+# urban/rural grids, so they have to be cut to the ShakeMap as global grids are
+GRID_MARGIN = 10
+
+# epicenter of the synthetic events
+EVENT_LAT = 20.0
+EVENT_LON = 100.0
+EVENT_YEAR = 2016
+
+# name of the table of benchmark results in the history store
+BENCHMARK_TABLE = "benchmarks"
+
+# columns (in order) of benchmark results
+BENCHMARK_COLUMNS = [
+    "Time",
+    "Host",
+    "Version",
+    "Benchmark",
+    "Size",
+    "Countries",
+    "WallTime",
+    "CPUTime",
+    "PeakRSS",
+]
+
+# a benchmark has regressed if it is this fraction slower than its recent median
+DEFAULT_TOLERANCE = 0.25
+
+# number of previous runs used to calculate the recent median time of a benchmark
+DEFAULT_WINDOW = 5
+
+# minimum slowdown (seconds) reported as a regression, to ignore noise in very fast benchmarks
+MIN_REGRESSION_TIME = 0.01
+
+
+def get_benchmark_countries(ncountries):
+    """Return the numeric codes of countries that have empirical fatality models.
+
+    :param ncountries:
+      Number of countries.
+    :returns:
+      List of ncountries ISO 3166-1 numeric country codes, always the same for a given
+      ncountries.
+    :raises:
+      ValueError when there are fewer than ncountries countries with fatality models.
+    """
+    fatmodel = EmpiricalLoss.fromDefaultFatality()
+    country = Country()
+    ccodes = []
+    for iso2 in sorted(fatmodel._model_dict.keys()):
+        cdict = country.getCountry(iso2)
+        if cdict is not None:
+            ccodes.append(int(cdict["ISON"]))
+        if len(ccodes) == ncountries:
+            return ccodes
+    raise ValueError("There are only %i countries with fatality models." % len(ccodes))
+
+
+def make_benchmark_grids(folder, size, ncountries, seed=0):
+    """Write a synthetic ShakeMap, and matching population, country and urban/rural grids.
+
+    The ShakeMap has MMI decreasing with distance from an epicenter in the center of the grid,
+    and the country grid is divided into ncountries vertical bands.  Grids that already exist
+    in folder are not written again.
+
+    :param folder:
+      Folder where grids are written (created if it does not exist).
+    :param size:
+      Number of ShakeMap cells on each side.
+    :param ncountries:
+      Number of countries covered by the grids.
+    :param seed:
+      Seed of the random population and urban/rural values.
+    :returns:
+      Tuple of paths to (ShakeMap grid.xml, population, country, urban/rural) files.
+    """
+    base = os.path.join(folder, "%i_%i" % (size, ncountries))
+    gridfile = base + "_grid.xml"
+    popfile = base + "_pop.grd"
+    isofile = base + "_iso.grd"
+    urbanfile = base + "_urban.grd"
+    gridfiles = (gridfile, popfile, isofile, urbanfile)
+    if all(os.path.isfile(fname) for fname in gridfiles):
+        return gridfiles
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+
+    dx = GRID_RESOLUTION
+    half = (size - 1) / 2.0
+    shakedict = GeoDict(
+        {
+            "xmin": EVENT_LON - half * dx,
+            "xmax": EVENT_LON + half * dx,
+            "ymin": EVENT_LAT - half * dx,
+            "ymax": EVENT_LAT + half * dx,
+            "dx": dx,
+            "dy": dx,
+            "nx": size,
+            "ny": size,
+        }
+    )
+    # MMI 9.5 at the epicenter, down to MMI 3.5 at the edges of the grid
+    y, x = np.ogrid[0:size, 0:size]
+    dist = np.sqrt((x - half) ** 2 + (y - half) ** 2) / max(half, 1.0)
+    mmidata = np.clip(9.5 - 6.0 * dist, 1.0, 10.0).astype(np.float32)
+    event_dict = {
+        "event_id": "bm%i_%i" % (size, ncountries),
+        "magnitude": 7.5,
+        "depth": 10.0,
+        "lat": EVENT_LAT,
+        "lon": EVENT_LON,
+        "event_timestamp": datetime(EVENT_YEAR, 1, 1, 12, 0, 0),
+        "event_description": "Benchmark",
+        "event_network": "us",
+    }
+    shake_dict = {
+        "event_id": event_dict["event_id"],
+        "shakemap_id": event_dict["event_id"],
+        "shakemap_version": 1,
+        "code_version": "4.5",
+        "process_timestamp": datetime(EVENT_YEAR, 1, 1, 13, 0, 0),
+        "shakemap_originator": "us",
+        "map_status": "RELEASED",
+        "shakemap_event_type": "ACTUAL",
+    }
+    layers = OrderedDict([("mmi", mmidata)])
+    shakegrid = ShakeGrid(layers, shakedict, event_dict, shake_dict, {"mmi": (1, 1)})
+
+    nglobal = size + 2 * GRID_MARGIN
+    halfglobal = (nglobal - 1) / 2.0
+    geodict = GeoDict(
+        {
+            "xmin": EVENT_LON - halfglobal * dx,
+            "xmax": EVENT_LON + halfglobal * dx,
+            "ymin": EVENT_LAT - halfglobal * dx,
+            "ymax": EVENT_LAT + halfglobal * dx,
+            "dx": dx,
+            "dy": dx,
+            "nx": nglobal,
+            "ny": nglobal,
+        }
+    )
+    rng = np.random.RandomState(seed)
+    popdata = np.floor(rng.lognormal(3.0, 2.0, (nglobal, nglobal))).astype(np.float32)
+    ccodes = np.array(get_benchmark_countries(ncountries), dtype=np.int32)
+    bands = (np.arange(nglobal) * ncountries) // nglobal
+    isodata = np.tile(ccodes[bands], (nglobal, 1))
+    urbdata = rng.randint(1, 3, (nglobal, nglobal)).astype(np.int32)
+    write(Grid2D(popdata, geodict.copy()), popfile, "netcdf")
+    write(Grid2D(isodata, geodict.copy()), isofile, "netcdf")
+    write(Grid2D(urbdata, geodict.copy()), urbanfile, "netcdf")
+    # the ShakeMap is written last (and renamed into place), so an interrupted run never
+    # leaves a complete looking set of grids
+    shakegrid.save(gridfile + ".tmp")
+    os.replace(gridfile + ".tmp", gridfile)
+    return gridfiles
+
+
+def make_benchmark_cities(shakegrid, seed=0):
+    """Create a set of synthetic cities inside a ShakeMap.
+
+    :param shakegrid:
+      ShakeGrid object.
+    :param seed:
+      Seed of the random city locations and populations.
+    :returns:
+      Cities object containing about one city per thousand ShakeMap cells (at least 50).
+    """
+    geodict = shakegrid.getGeoDict()
+    ncities = int(np.clip(geodict.nx * geodict.ny // 1000, 50, 20000))
+    rng = np.random.RandomState(seed)
+    dataframe = pd.DataFrame(
+        {
+            "name": ["City %i" % i for i in range(ncities)],
+            "ccode": ["XX"] * ncities,
+            "lat": rng.uniform(geodict.ymin, geodict.ymax, ncities),
+            "lon": rng.uniform(geodict.xmin, geodict.xmax, ncities),
+            "iscap": rng.uniform(size=ncities) < 0.01,
+            "pop": np.floor(rng.lognormal(9.0, 1.5, ncities)).astype(np.int64),
+        }
+    )
+    return Cities(dataframe)
+
+
+def _get_version():
+    try:
+        return metadata.version("losspager")
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+
+def _time_benchmark(name, func, repeat):
+    # run a benchmark repeat times, returning the timing of the fastest run (and the
+    # peak memory use of all of them)
+    timings = StageTimings()
+    best = None
+    peak_rss = None
+    for i in range(repeat):
+        with timings.stage(name) as record:
+            func()
+        if best is None or record["wall_time"] < best["wall_time"]:
+            best = record
+        if record["peak_rss"] is not None:
+            peak_rss = max(peak_rss or 0, record["peak_rss"])
+    return (best["wall_time"], best["cpu_time"], peak_rss)
+
+
+def run_benchmarks(
+    folder,
+    sizes=DEFAULT_SIZES,
+    countries=DEFAULT_COUNTRIES,
+    repeat=3,
+    timezone_file=None,
+    city_file=None,
+    progress=None,
+    host=None,
+):
+    """Time the PAGER models and outputs on synthetic grids of different sizes.
+
+    The benchmarks are:
+      - calc_exposure: Exposure calculation from in-memory grids.
+      - Exposure.calcExposure: Exposure calculation from the ShakeMap and global grid files.
+      - EconExposure.calcEconExposure: Economic exposure calculation.
+      - EmpiricalLoss.getLosses: Empirical fatality model.
+      - EmpiricalLoss.getLossGrid: Gridded empirical fatalities.
+      - SemiEmpiricalFatality.getLosses: Semi-empirical fatality model.
+      - PagerCities: Selection of the onePAGER table of (synthetic) cities.
+      - ExpoCat: Selection of historical earthquakes near the epicenter.
+      - PagerData.validate, PagerData.saveToJSON, PagerData.loadFromJSON: Assembly and
+        serialization of PAGER results (only if timezone_file and city_file are given).
+
+    :param folder:
+      Folder where synthetic grids are written (see make_benchmark_grids()).
+    :param sizes:
+      Sequence of ShakeMap sizes (number of cells on each side).
+    :param countries:
+      Sequence of numbers of countries covered by the grids.
+    :param repeat:
+      Number of times each benchmark is run.  The fastest run is reported.
+    :param timezone_file:
+      Time zone shapefile used by PagerData, or None.
+    :param city_file:
+      GeoNames cities file used by PagerData, or None.
+    :param progress:
+      Function called with the name, size and number of countries of each benchmark before
+      it is run, or None.
+    :param host:
+      Name of the machine recorded with the results, or None to use the host name.  Results
+      are only compared with previous results from the same machine, so machines whose host
+      name changes (i.e., CI workers) should be given a fixed name.
+    :returns:
+      DataFrame of benchmark results with BENCHMARK_COLUMNS:
+        - Time: Time (UTC) the benchmarks were started.
+        - Host: Name of the machine the benchmarks were run on.
+        - Version: losspager version.
+        - Benchmark: Benchmark name.
+        - Size: ShakeMap size (number of cells on each side).
+        - Countries: Number of countries.
+        - WallTime: Elapsed time (seconds) of the fastest run.
+        - CPUTime: CPU time (seconds) of the fastest run.
+        - PeakRSS: Peak resident set size (MB) of the benchmark process, or None.
+    """
+    start_time = datetime.utcnow()
+    if host is None:
+        host = socket.gethostname()
+    version = _get_version()
+    fatmodel = EmpiricalLoss.fromDefaultFatality()
+    ecomodel = EmpiricalLoss.fromDefaultEconomic()
+    expocat = ExpoCat.fromDefault()
+    rows = []
+    for size in sizes:
+        for ncountries in countries:
+            gridfile, popfile, isofile, urbanfile = make_benchmark_grids(
+                folder, size, ncountries
+            )
+            expomodel = Exposure(popfile, EVENT_YEAR, isofile)
+            exposure = expomodel.calcExposure(gridfile)
+            econexpmodel = EconExposure.fromExposure(expomodel)
+            econexposure = econexpmodel.calcEconExposure(exposure)
+            fatdict = fatmodel.getLosses(exposure)
+            ecodict = ecomodel.getLosses(econexposure)
+            shakegrid = expomodel.getShakeGrid()
+            mmigrid = shakegrid.getLayer("mmi")
+            mmidata = mmigrid.getData()
+            popdata = expomodel.getPopulationGrid().getData()
+            isodata = expomodel._isogrid.getData()
+            semi = SemiEmpiricalFatality.fromDefault()
+            semi.setGlobalFiles(popfile, EVENT_YEAR, urbanfile, isofile)
+            cities = make_benchmark_cities(shakegrid)
+            mapcities = Cities(cities.getDataFrame().iloc[0:10].copy())
+            maxmmi = int(np.max(np.round(mmidata)))
+            nmmi = exposure["TotalExposure"][maxmmi - 1]
+            ndeaths = fatdict["TotalFatalities"]
+
+            benchmarks = [
+                ("calc_exposure", lambda: calc_exposure(mmidata, popdata, isodata)),
+                (
+                    "Exposure.calcExposure",
+                    lambda: Exposure(popfile, EVENT_YEAR, isofile).calcExposure(
+                        gridfile
+                    ),
+                ),
+                (
+                    "EconExposure.calcEconExposure",
+                    lambda: econexpmodel.calcEconExposure(exposure),
+                ),
+                ("EmpiricalLoss.getLosses", lambda: fatmodel.getLosses(exposure)),
+                (
+                    "EmpiricalLoss.getLossGrid",
+                    lambda: fatmodel.getLossGrid(mmidata, popdata, isodata),
+                ),
+                ("SemiEmpiricalFatality.getLosses", lambda: semi.getLosses(gridfile)),
+                (
+                    "PagerCities",
+                    lambda: PagerCities(cities, mmigrid).getCityTable(mapcities),
+                ),
+                (
+                    "ExpoCat",
+                    lambda: expocat.selectByRadius(
+                        EVENT_LAT, EVENT_LON, 400
+                    ).getHistoricalEvents(maxmmi, nmmi, ndeaths, EVENT_LAT, EVENT_LON),
+                ),
+            ]
+
+            tmpfolder = tempfile.mkdtemp()
+            try:
+                if timezone_file is not None and city_file is not None:
+                    semiloss, resfat, nonresfat = semi.getLosses(gridfile)
+                    event_dict = shakegrid.getEventDict()
+                    jsonfolder = os.path.join(tmpfolder, "json")
+                    os.makedirs(jsonfolder)
+                    doc = PagerData()
+
+                    def validate():
+                        doc.setInputs(
+                            shakegrid,
+                            timezone_file,
+                            1,
+                            event_dict["event_id"],
+                            event_dict["event_id"],
+                            0,
+                            "Benchmark",
+                            True,
+                        )
+                        doc.setExposure(exposure, econexposure)
+                        doc.setModelResults(
+                            fatmodel,
+                            ecomodel,
+                            fatdict,
+                            ecodict,
+                            semiloss,
+                            resfat,
+                            nonresfat,
+                        )
+                        doc.setComments("", "", "", "", "")
+                        doc.setMapInfo(city_file, mapcities)
+                        doc.validate()
+
+                    benchmarks += [
+                        ("PagerData.validate", validate),
+                        ("PagerData.saveToJSON", lambda: doc.saveToJSON(jsonfolder)),
+                        (
+                            "PagerData.loadFromJSON",
+                            lambda: PagerData().loadFromJSON(jsonfolder),
+                        ),
+                    ]
+
+                for name, func in benchmarks:
+                    if progress is not None:
+                        progress(name, size, ncountries)
+                    wall_time, cpu_time, peak_rss = _time_benchmark(name, func, repeat)
+                    rows.append(
+                        [
+                            start_time,
+                            host,
+                            version,
+                            name,
+                            size,
+                            ncountries,
+                            wall_time,
+                            cpu_time,
+                            peak_rss,
+                        ]
+                    )
+            finally:
+                shutil.rmtree(tmpfolder)
+    return pd.DataFrame(rows, columns=BENCHMARK_COLUMNS)
+
+
+def check_regressions(
+    history,
+    results,
+    tolerance=DEFAULT_TOLERANCE,
+    window=DEFAULT_WINDOW,
+    metric="WallTime",
+):
+    """Find benchmarks that are slower than their recent history.
+
+    Each benchmark is compared with the median time of the last window runs of the same
+    benchmark (and size, and number of countries) on the same machine.
+
+    :param history:
+      DataFrame of previous benchmark results (BENCHMARK_COLUMNS).
+    :param results:
+      DataFrame of new benchmark results (BENCHMARK_COLUMNS).
+    :param tolerance:
+      Fraction by which a benchmark can be slower than its recent median time.
+    :param window:
+      Number of previous runs used to calculate the median time.
+    :param metric:
+      Time compared, one of WallTime or CPUTime.  CPU time is less affected by other
+      processes on the same machine (i.e., on shared CI workers).
+    :returns:
+      DataFrame of the rows of results that have regressed, with additional columns:
+        - Baseline: Median time (seconds) of the previous runs.
+        - Ratio: Time (metric) / Baseline.
+    """
+    keys = ["Host", "Benchmark", "Size", "Countries"]
+    regressions = []
+    history = history.sort_values("Time")
+    groups = dict(list(history.groupby(keys)))
+    for _, row in results.iterrows():
+        key = tuple(row[keys])
+        if key not in groups:
+            continue
+        baseline = np.median(groups[key][metric].values[-window:])
+        slowdown = row[metric] - baseline
+        if row[metric] > baseline * (1 + tolerance) and slowdown > MIN_REGRESSION_TIME:
+            regression = row.to_dict()
+            regression["Baseline"] = baseline
+            regression["Ratio"] = row[metric] / baseline
+            regressions.append(regression)
+    return pd.DataFrame(regressions, columns=BENCHMARK_COLUMNS + ["Baseline", "Ratio"])
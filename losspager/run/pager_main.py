@@ -3,9 +3,10 @@
 # local imports
 from impactutils.transfer.emailsender import EmailSender
 from impactutils.comcat.query import ComCatInfo
-from mapio.shake import getHeaderData
-from losspager.models.exposure import Exposure
+from mapio.shake import ShakeGrid, getHeaderData
+from losspager.models.exposure import Exposure, EXPOSURE_STATE
 from losspager.models.econexposure import EconExposure
+from losspager.models.gridcontext import GridContext
 from losspager.models.emploss import EmpiricalLoss
 from losspager.models.semimodel import SemiEmpiricalFatality
 from losspager.utils.country import Country
@@ -19,9 +20,12 @@ from losspager.onepager.comment import get_secondary_comment
 from losspager.onepager.comment import get_historical_comment
 from losspager.onepager.onepager import create_onepager
 from losspager.io.pagerdata import PagerData
+from losspager.run.resultcache import ResultCache, get_model_files, get_result_key
+from losspager.run.scheduler import StageScheduler
 from losspager.vis.impactscale import drawImpactScale
 from losspager.vis.contourmap import draw_contour
 from losspager.utils.config import read_config
+from losspager.utils.timing import TIMINGS_FILE, get_timings
 from losspager.mail.formatter import format_exposure
 
 # stdlib imports
@@ -39,6 +43,7 @@ from urllib import request
 import tempfile
 import socket
 import logging
+from collections import OrderedDict
 
 # third party imports
 import matplotlib
@@ -186,8 +191,7 @@ def _get_pop_year(event_year, popyears):
         popyear = popdict["population_year"]
         popgrid = popdict["population_grid"]
         if not os.path.isfile(popgrid):
-            logging.warning("Population grid file %s does not exist." % popgrid)
-            sys.exit(1)
+            raise PagerException("Population grid file %s does not exist." % popgrid)
         if abs(popyear - event_year) < tmin:
             tmin = abs(popyear - event_year)
             pop_year = popyear
@@ -295,6 +299,262 @@ def _cancel(eventid, config):
     return msg
 
 
+def _get_data_files(config, popfile):
+    # the configured data files PAGER results depend on
+    modeldict = config["model_data"]
+    datafiles = [popfile]
+    for key in [
+        "country_grid",
+        "urban_rural_grid",
+        "ocean_vectors",
+        "ocean_grid",
+        "city_file",
+        "border_vectors",
+    ]:
+        if key in modeldict:
+            datafiles.append(modeldict[key])
+    return datafiles
+
+
+def _set_shake_header(shakegrid, shake_tuple):
+    # return a copy of a ShakeGrid with the header data of another ShakeMap
+    layers = OrderedDict()
+    for layername in shakegrid.getLayerNames():
+        layers[layername] = shakegrid.getLayer(layername).getData()
+    return ShakeGrid(
+        layers, shakegrid.getGeoDict(), shake_tuple[1], shake_tuple[0], shake_tuple[4]
+    )
+
+
+def _load_context(gridfile, popfile, isofile, urbanfile):
+    # load and resample the ShakeMap and global grids once, for use by all of the models
+    logging.info("Loading ShakeMap and population grids.")
+    if not os.path.isfile(urbanfile):
+        raise PagerException("Urban-rural grid file %s does not exist." % urbanfile)
+    return GridContext(gridfile, popfile, isofile, urbanfile=urbanfile)
+
+
+def _calc_exposure(
+    context, gridfile, popfile, pop_year, isofile, version_folder, previous_folder
+):
+    logging.info("Calculating population exposure.")
+    expomodel = Exposure(popfile, pop_year, isofile)
+    # update the exposure of the previous version from the cells that have changed, if possible
+    statefile = None
+    if previous_folder is not None:
+        statefile = os.path.join(previous_folder, EXPOSURE_STATE)
+    exposure = expomodel.calcExposure(gridfile, context=context, statefile=statefile)
+    nchanged = expomodel.getChangedCells()
+    if nchanged is not None:
+        fmt = "Updated exposure from %i changed cells in %s."
+        logging.info(fmt % (nchanged, previous_folder))
+    if context.intersects():
+        expomodel.saveState(os.path.join(version_folder, EXPOSURE_STATE))
+    return (expomodel, exposure)
+
+
+def _get_epicenter_country(expo, elat, elon):
+    # incidentally grab the country code of the epicenter
+    expomodel, exposure = expo
+    numcode = expomodel._isogrid.getValue(elat, elon)
+    if np.isnan(numcode):
+        cdict = None
+    else:
+        cdict = Country().getCountry(int(numcode))
+    if cdict is None:
+        ccode = "UK"
+    else:
+        ccode = cdict["ISO2"]
+    logging.info("Country code at epicenter is %s" % ccode)
+    return ccode
+
+
+def _calc_fatalities(expo, fatmodel):
+    logging.info("Calculating empirical fatalities.")
+    expomodel, exposure = expo
+    return fatmodel.getLosses(exposure)
+
+
+def _calc_econ_losses(expo, ecomodel):
+    logging.info("Calculating economic exposure.")
+    expomodel, exposure = expo
+    econexpmodel = EconExposure.fromExposure(expomodel)
+    econexposure = econexpmodel.calcEconExposure(exposure)
+    ecodict = ecomodel.getLosses(econexposure)
+    return (econexposure, ecodict)
+
+
+def _calc_semi_losses(context, gridfile, popfile, pop_year, urbanfile, isofile):
+    logging.info("Calculating semi-empirical fatalities.")
+    semi = SemiEmpiricalFatality.fromDefault()
+    semi.setGlobalFiles(popfile, pop_year, urbanfile, isofile)
+    semiloss, resfat, nonresfat = semi.getLosses(gridfile, context=context)
+    return (semiloss, resfat, nonresfat, semi)
+
+
+def _get_impact_comments(fatdict, econ, ccode, event_year):
+    # get the fatality and economic comments
+    logging.info("Getting impact comments.")
+    econexposure, ecodict = econ
+    return get_impact_comments(fatdict, ecodict, econexposure, event_year, ccode)
+
+
+def _get_structure_comment(semiresults):
+    # get comment describing vulnerable structures in the region.
+    semiloss, resfat, nonresfat, semi = semiresults
+    return get_structure_comment(resfat, nonresfat, semi)
+
+
+def _get_historical_comment(expo, fatdict, elat, elon, emag):
+    # get the comment describing historical comments in the region
+    expomodel, exposure = expo
+    return get_historical_comment(elat, elon, emag, exposure, fatdict)
+
+
+def _draw_probs_stage(fatdict, econ, fatmodel, ecomodel, version_folder):
+    # generate the probability plots
+    logging.info("Drawing probability plots.")
+    econexposure, ecodict = econ
+    return _draw_probs(fatmodel, fatdict, ecomodel, ecodict, version_folder)
+
+
+def _get_map_grids(context, expo):
+    # the grids drawn on the exposure map
+    expomodel, exposure = expo
+    return (context.getShakeGrid(), expomodel.getPopulationGrid())
+
+
+def _draw_map(grids, config, version_folder, is_scenario):
+    # generate the exposure map
+    shake_grid, pop_grid = grids
+    exposure_base = os.path.join(version_folder, "exposure")
+    logging.info("Generating exposure map...")
+    oceanfile = config["model_data"]["ocean_vectors"]
+    oceangrid = config["model_data"]["ocean_grid"]
+    cityfile = config["model_data"]["city_file"]
+    borderfile = config["model_data"]["border_vectors"]
+    pdf_file, png_file, mapcities = draw_contour(
+        shake_grid,
+        pop_grid,
+        oceanfile,
+        oceangrid,
+        cityfile,
+        exposure_base,
+        borderfile,
+        is_scenario=is_scenario,
+    )
+    logging.info("Generated exposure map %s" % pdf_file)
+    return mapcities
+
+
+def _calc_results(
+    gridfile,
+    config,
+    popfile,
+    pop_year,
+    shake_tuple,
+    is_scenario,
+    fatmodel,
+    ecomodel,
+    version_folder,
+    previous_folder,
+    logger,
+):
+    # run the models, make the comments and render the maps and plots for a ShakeMap,
+    # returning a dictionary of everything needed to make the PagerData object.
+    # Stages that do not depend on each other run concurrently, and the (pyplot) drawing
+    # stages run in separate processes.
+    elat = shake_tuple[1]["lat"]
+    elon = shake_tuple[1]["lon"]
+    emag = shake_tuple[1]["magnitude"]
+    event_year = shake_tuple[1]["event_timestamp"].year
+    isofile = config["model_data"]["country_grid"]
+    urbanfile = config["model_data"]["urban_rural_grid"]
+
+    scheduler = StageScheduler.fromConfig(config)
+    scheduler.addStage(
+        "context", _load_context, args=(gridfile, popfile, isofile, urbanfile)
+    )
+    scheduler.addStage(
+        "exposure",
+        _calc_exposure,
+        depends=["context"],
+        args=(gridfile, popfile, pop_year, isofile, version_folder, previous_folder),
+    )
+    scheduler.addStage(
+        "ccode", _get_epicenter_country, depends=["exposure"], args=(elat, elon)
+    )
+    scheduler.addStage(
+        "fatalities", _calc_fatalities, depends=["exposure"], args=(fatmodel,)
+    )
+    scheduler.addStage(
+        "econ", _calc_econ_losses, depends=["exposure"], args=(ecomodel,)
+    )
+    scheduler.addStage(
+        "semi",
+        _calc_semi_losses,
+        depends=["context"],
+        args=(gridfile, popfile, pop_year, urbanfile, isofile),
+    )
+    scheduler.addStage(
+        "impact_comments",
+        _get_impact_comments,
+        depends=["fatalities", "econ", "ccode"],
+        args=(event_year,),
+    )
+    scheduler.addStage("struct_comment", _get_structure_comment, depends=["semi"])
+    scheduler.addStage(
+        "secondary_comment", get_secondary_comment, args=(elat, elon, emag)
+    )
+    scheduler.addStage(
+        "historical_comment",
+        _get_historical_comment,
+        depends=["exposure", "fatalities"],
+        args=(elat, elon, emag),
+    )
+    scheduler.addStage(
+        "probs",
+        _draw_probs_stage,
+        depends=["fatalities", "econ"],
+        args=(fatmodel, ecomodel, version_folder),
+        process=True,
+    )
+    scheduler.addStage("map_grids", _get_map_grids, depends=["context", "exposure"])
+    scheduler.addStage(
+        "map",
+        _draw_map,
+        depends=["map_grids"],
+        args=(config, version_folder, is_scenario),
+        process=True,
+    )
+    stages = scheduler.run()
+    path = [
+        "%s (%.1f s)" % (name, elapsed)
+        for name, elapsed in scheduler.getCriticalPath()
+    ]
+    logger.info("Critical path: %s" % " -> ".join(path))
+
+    expomodel, exposure = stages["exposure"]
+    econexposure, ecodict = stages["econ"]
+    semiloss, resfat, nonresfat, semi = stages["semi"]
+    results = {
+        "exposure": exposure,
+        "econexposure": econexposure,
+        "fatdict": stages["fatalities"],
+        "ecodict": ecodict,
+        "semiloss": semiloss,
+        "resfat": resfat,
+        "nonresfat": nonresfat,
+        "impact_comments": stages["impact_comments"],
+        "struct_comment": stages["struct_comment"],
+        "secondary_comment": stages["secondary_comment"],
+        "historical_comment": stages["historical_comment"],
+        "mapcities": stages["map"],
+        "shakegrid": stages["context"].getShakeGrid(),
+    }
+    return results
+
+
 def main(pargs, config):
     # get the users home directory
     homedir = os.path.expanduser("~")
@@ -333,6 +593,11 @@ def main(pargs, config):
     plog = PagerLogger(logfile, developers, mail_from, mail_host, debug=pargs.debug)
     logger = plog.getLogger()
 
+    # record the wall time, CPU time and memory use of each stage of the run
+    timings = get_timings()
+    timings.start()
+
+    version_folder = None
     try:
         eid = None
         pager_version = None
@@ -403,6 +668,9 @@ def main(pargs, config):
             return True
 
         pager_version = get_pager_version(event_folder)
+        previous_folder = None
+        if pager_version > 1:
+            previous_folder = admin.getLastVersion(event_folder)
         version_folder = os.path.join(event_folder, "version.%03d" % pager_version)
         os.makedirs(version_folder)
         event_logfile = os.path.join(version_folder, "event.log")
@@ -437,88 +705,72 @@ def main(pargs, config):
         )
         logger.info("Population year: %i Population file: %s\n" % (pop_year, popfile))
 
-        # Get exposure results
-        logger.info("Calculating population exposure.")
-        isofile = config["model_data"]["country_grid"]
-        expomodel = Exposure(popfile, pop_year, isofile)
-        exposure = None
-        exposure = expomodel.calcExposure(gridfile)
-
-        # incidentally grab the country code of the epicenter
-        numcode = expomodel._isogrid.getValue(elat, elon)
-        if np.isnan(numcode):
-            cdict = None
-        else:
-            cdict = Country().getCountry(int(numcode))
-        if cdict is None:
-            ccode = "UK"
-        else:
-            ccode = cdict["ISO2"]
-
-        logger.info("Country code at epicenter is %s" % ccode)
-
-        # get fatality results, if requested
-        logger.info("Calculating empirical fatalities.")
         fatmodel = EmpiricalLoss.fromDefaultFatality()
-        fatdict = fatmodel.getLosses(exposure)
-
-        # get economic results, if requested
-        logger.info("Calculating economic exposure.")
-        econexpmodel = EconExposure(popfile, pop_year, isofile)
         ecomodel = EmpiricalLoss.fromDefaultEconomic()
-        econexposure = econexpmodel.calcExposure(gridfile)
-        ecodict = ecomodel.getLosses(econexposure)
-        shakegrid = econexpmodel.getShakeGrid()
-
-        # Get semi-empirical losses
-        logger.info("Calculating semi-empirical fatalities.")
-        urbanfile = config["model_data"]["urban_rural_grid"]
-        if not os.path.isfile(urbanfile):
-            raise PagerException("Urban-rural grid file %s does not exist." % urbanfile)
-
-        semi = SemiEmpiricalFatality.fromDefault()
-        semi.setGlobalFiles(popfile, pop_year, urbanfile, isofile)
-        semiloss, resfat, nonresfat = semi.getLosses(gridfile)
-
-        # get all of the other components of PAGER
-        logger.info("Getting all comments.")
-        # get the fatality and economic comments
-        impact1, impact2 = get_impact_comments(
-            fatdict, ecodict, econexposure, event_year, ccode
-        )
-        # get comment describing vulnerable structures in the region.
-        struct_comment = get_structure_comment(resfat, nonresfat, semi)
-        # get the comment describing historic secondary hazards
-        secondary_comment = get_secondary_comment(elat, elon, emag)
-        # get the comment describing historical comments in the region
-        historical_comment = get_historical_comment(elat, elon, emag, exposure, fatdict)
-
-        # generate the probability plots
-        logger.info("Drawing probability plots.")
-        fat_probs_file, eco_probs_file = _draw_probs(
-            fatmodel, fatdict, ecomodel, ecodict, version_folder
-        )
 
-        # generate the exposure map
-        exposure_base = os.path.join(version_folder, "exposure")
-        logger.info("Generating exposure map...")
-        oceanfile = config["model_data"]["ocean_vectors"]
-        oceangrid = config["model_data"]["ocean_grid"]
+        # re-use the results of a previous run on the same ShakeMap grid, if there was one
+        cache = None
+        if not getattr(pargs, "no_cache", False):
+            cache = ResultCache.fromConfig(config)
+        results = None
+        if cache is not None:
+            event = {
+                "lat": elat,
+                "lon": elon,
+                "depth": shake_tuple[1]["depth"],
+                "magnitude": emag,
+                "event_timestamp": etime.isoformat(),
+                "is_scenario": is_scenario,
+            }
+            cache_key = get_result_key(
+                gridfile, event, _get_data_files(config, popfile) + get_model_files()
+            )
+            with timings.stage("cache_load"):
+                results = cache.load(cache_key, version_folder)
+            if results is not None:
+                logger.info("Using cached results %s for identical ShakeMap." % cache_key)
+                # the cached grid has the header of the ShakeMap it was calculated from
+                results["shakegrid"] = _set_shake_header(results["shakegrid"], shake_tuple)
+        if results is None:
+            existing = set(os.listdir(version_folder))
+            results = _calc_results(
+                gridfile,
+                config,
+                popfile,
+                pop_year,
+                shake_tuple,
+                is_scenario,
+                fatmodel,
+                ecomodel,
+                version_folder,
+                previous_folder,
+                logger,
+            )
+            if cache is not None:
+                # the exposure state holds a copy of the whole population grid, so it is not
+                # cached - the version after a cached run is calculated in full.
+                rendered = [
+                    os.path.join(version_folder, fname)
+                    for fname in os.listdir(version_folder)
+                    if fname not in existing and fname != EXPOSURE_STATE
+                ]
+                with timings.stage("cache_save"):
+                    cache.save(cache_key, results, rendered)
+
+        exposure = results["exposure"]
+        econexposure = results["econexposure"]
+        fatdict = results["fatdict"]
+        ecodict = results["ecodict"]
+        semiloss = results["semiloss"]
+        resfat = results["resfat"]
+        nonresfat = results["nonresfat"]
+        impact1, impact2 = results["impact_comments"]
+        struct_comment = results["struct_comment"]
+        secondary_comment = results["secondary_comment"]
+        historical_comment = results["historical_comment"]
+        mapcities = results["mapcities"]
+        shakegrid = results["shakegrid"]
         cityfile = config["model_data"]["city_file"]
-        borderfile = config["model_data"]["border_vectors"]
-        shake_grid = expomodel.getShakeGrid()
-        pop_grid = expomodel.getPopulationGrid()
-        pdf_file, png_file, mapcities = draw_contour(
-            shake_grid,
-            pop_grid,
-            oceanfile,
-            oceangrid,
-            cityfile,
-            exposure_base,
-            borderfile,
-            is_scenario=is_scenario,
-        )
-        logger.info("Generated exposure map %s" % pdf_file)
 
         # figure out whether this event has been "released".
         is_released = _get_release_status(
@@ -573,6 +825,7 @@ def main(pargs, config):
         json_folder = os.path.join(version_folder, "json")
         os.makedirs(json_folder)
         logger.info("Saving output to JSON.")
+        doc.setTimings(timings.getStages())
         doc.saveToJSON(json_folder)
         logger.info("Saving output to XML.")
         doc.saveToLegacyXML(version_folder)
@@ -600,14 +853,15 @@ def main(pargs, config):
         # than an NEIC origin being made authoritative over a regional one.
         eventsource = network
         eventsourcecode = eid
-        res, msg = transfer(
-            config,
-            doc,
-            eventsourcecode,
-            eventsource,
-            version_folder,
-            is_scenario=is_scenario,
-        )
+        with timings.stage("transfer"):
+            res, msg = transfer(
+                config,
+                doc,
+                eventsourcecode,
+                eventsource,
+                version_folder,
+                is_scenario=is_scenario,
+            )
         logger.info(msg)
         if not res:
             logger.critical('Error transferring PAGER content. "%s"' % msg)
@@ -634,3 +888,12 @@ def main(pargs, config):
         logger.critical(msg)
         logger.info("Sent error to email")
         return False
+    finally:
+        # stop recording stages, and save the timings of failed runs as well
+        timings.stop()
+        if version_folder is not None and os.path.isdir(version_folder):
+            timingsfile = os.path.join(version_folder, TIMINGS_FILE)
+            try:
+                timings.save(timingsfile)
+            except Exception as e:
+                logger.warning('Could not save timings to %s: "%s".' % (timingsfile, str(e)))
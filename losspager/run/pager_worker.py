@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+
+# stdlib imports
+import os.path
+import argparse
+import logging
+import multiprocessing
+import time
+import traceback
+from multiprocessing.connection import Listener, wait
+
+# local imports
+from losspager.run.pager_main import main
+from losspager.run.worker_client import get_worker_address, send_command
+from losspager.models.semimodel import SemiEmpiricalFatality
+from losspager.models.growth import PopulationGrowth
+from losspager.utils.country import Country
+from losspager.utils.expocat import ExpoCat
+from losspager.utils.gridstore import get_grid_store
+from losspager.utils.config import read_config, get_config_file
+from losspager.utils.exception import PagerException
+
+# default values of the pager command line arguments, for jobs that do not set them
+JOB_DEFAULTS = {
+    "debug": False,
+    "release": False,
+    "cancel": False,
+    "tsunami": "auto",
+    "elapsed": None,
+    "no_cache": False,
+}
+
+# default number of jobs run at the same time, if not set in the config file
+MAX_JOBS = 4
+
+def warm_up(config):
+    """Load the reference data and global grid handles shared by all PAGER runs in this process.
+
+    :param config:
+      Dictionary containing configuration parameters.
+    """
+    Country()
+    PopulationGrowth.fromDefault()
+    SemiEmpiricalFatality.fromDefault()
+    expocat = ExpoCat.fromDefault()
+    expocat.getSpatialIndex()
+    for popdict in config["model_data"]["population_data"]:
+        popfile = popdict["population_grid"]
+        if os.path.isfile(popfile):
+            get_grid_store(popfile)
+
+
+class PagerWorker(object):
+    def __init__(self, config, runner=None):
+        """Create a long-running PAGER worker.
+
+        The worker keeps models, reference data and global grid handles loaded in memory,
+        and runs ShakeMap jobs (received over a local socket) through the same code path
+        as the pager program.  Each job is run in its own process, forked from the worker
+        once it has loaded the reference data, so several ShakeMaps can be processed at
+        the same time, and a job that dies (i.e., is killed for running out of memory) does
+        not affect the others.  The number of jobs run at the same time can be set in the
+        config file with:
+          worker:
+            jobs: 4
+
+        :param config:
+          Dictionary containing configuration parameters.
+        :param runner:
+          Function taking (pargs, config) and returning True or False.  If None, pager_main.main
+          is used, and the reference data is loaded before the first job is accepted.
+        """
+        self._config = config
+        self._warm_up = runner is None
+        self._runner = runner if runner is not None else main
+        self._address, self._authkey = get_worker_address(config)
+        self._max_jobs = int(config.get("worker", {}).get("jobs", MAX_JOBS))
+        self._njobs = 0
+        self._started = None
+        self._running = {}
+
+    def runJob(self, job):
+        """Run a single PAGER job.
+
+        :param job:
+          Dictionary with gridfile and (optionally) any of the pager command line options.
+        :returns:
+          Dictionary with result, elapsed and (if the job failed outright) error fields.
+        """
+        if not isinstance(job, dict):
+            return {"result": False, "elapsed": 0.0, "error": "Job is not a dictionary."}
+        args = JOB_DEFAULTS.copy()
+        args.update({key: value for key, value in job.items() if key != "command"})
+        if "gridfile" not in args:
+            return {"result": False, "elapsed": 0.0, "error": "Job has no gridfile."}
+        pargs = argparse.Namespace(**args)
+        # main() adds log handlers to the root logger, remove them after each job
+        rootlogger = logging.getLogger()
+        handlers = list(rootlogger.handlers)
+        t1 = time.time()
+        response = {}
+        try:
+            # the config file may have changed (i.e., primary/secondary status) since the last job
+            config = self._config
+            if get_config_file() is not None:
+                config = read_config()
+            response["result"] = bool(self._runner(pargs, config))
+        except (Exception, SystemExit) as e:
+            # a job that calls sys.exit() must not stop the worker
+            response["result"] = False
+            response["error"] = "%s\n%s" % (str(e), traceback.format_exc())
+        finally:
+            for handler in list(rootlogger.handlers):
+                if handler not in handlers:
+                    rootlogger.removeHandler(handler)
+                    handler.close()
+        response["elapsed"] = time.time() - t1
+        return response
+
+    def _runChild(self, conn, job, accepted):
+        """Run a job in a forked process, and send the result back to the client."""
+        waited = time.time() - accepted
+        response = self.runJob(job)
+        response["waited"] = waited
+        fmt = "PAGER job %s waited %.1f seconds, and ran for %.1f seconds."
+        logging.info(fmt % (job.get("gridfile"), waited, response["elapsed"]))
+        try:
+            conn.send(response)
+        except Exception as e:
+            fmt = "Could not return result of PAGER job %s: %s"
+            logging.warning(fmt % (job.get("gridfile"), str(e)))
+        finally:
+            conn.close()
+
+    def _reapJobs(self, block=False):
+        """Remove finished job processes, optionally waiting for at least one to finish."""
+        if block and len(self._running):
+            wait([process.sentinel for process in self._running])
+        for process in list(self._running):
+            if process.is_alive():
+                continue
+            process.join()
+            gridfile = self._running.pop(process)
+            if process.exitcode != 0:
+                fmt = "PAGER job %s stopped with exit code %s."
+                logging.warning(fmt % (gridfile, process.exitcode))
+
+    def _startJob(self, conn, job, accepted):
+        """Fork a process to run a job, once fewer than the maximum number of jobs are running."""
+        self._reapJobs()
+        while len(self._running) >= self._max_jobs:
+            self._reapJobs(block=True)
+        context = multiprocessing.get_context("fork")
+        process = context.Process(target=self._runChild, args=(conn, job, accepted))
+        process.start()
+        # only the job process keeps the connection open, so the client sees the end of
+        # the connection if that process dies
+        conn.close()
+        self._running[process] = job.get("gridfile")
+        self._njobs += 1
+
+    def serve(self):
+        """Warm up, then accept and run jobs until a stop command is received."""
+        if self._warm_up:
+            warm_up(self._config)
+        if os.path.exists(self._address):
+            try:
+                send_command(self._config, "ping")
+                raise PagerException(
+                    "A PAGER worker is already listening on %s." % self._address
+                )
+            except OSError:
+                # stale socket file left by a worker that did not shut down cleanly
+                os.remove(self._address)
+        if self._authkey is None:
+            logging.warning(
+                "No worker authkey configured, only the socket file permissions "
+                "restrict which jobs are accepted."
+            )
+        self._started = time.time()
+        # create the socket file readable and writable only by this user, so other users
+        # cannot send (pickled) jobs to the worker
+        umask = os.umask(0o177)
+        try:
+            listener = Listener(self._address, family="AF_UNIX", authkey=self._authkey)
+        finally:
+            os.umask(umask)
+        try:
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception as e:
+                    logging.warning("Could not accept PAGER worker connection: %s" % str(e))
+                    continue
+                try:
+                    job = conn.recv()
+                except EOFError:
+                    conn.close()
+                    continue
+                except Exception as e:
+                    logging.warning("Could not read PAGER worker job: %s" % str(e))
+                    conn.close()
+                    continue
+                if not isinstance(job, dict):
+                    conn.send({"result": False, "error": "Job is not a dictionary."})
+                    conn.close()
+                    continue
+                command = job.get("command", "run")
+                if command == "run":
+                    # the job process sends the result back when the job finishes
+                    self._startJob(conn, job, time.time())
+                    continue
+                with conn:
+                    if command == "stop":
+                        conn.send({"result": True, "jobs": self._njobs})
+                        break
+                    elif command == "ping":
+                        uptime = time.time() - self._started
+                        conn.send({"result": True, "jobs": self._njobs, "uptime": uptime})
+                    else:
+                        conn.send({"result": False, "error": "Unknown command %s." % command})
+        finally:
+            # let running jobs finish and return their results
+            while len(self._running):
+                self._reapJobs(block=True)
+            listener.close()
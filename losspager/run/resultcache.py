@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+
+# stdlib imports
+import hashlib
+import logging
+import os.path
+import shutil
+import tempfile
+from importlib import metadata
+
+# third party imports
+import pandas as pd
+
+# local imports
+from losspager.utils.datacache import get_cache_folder
+from losspager.utils.datapath import get_data_path
+from losspager.utils.exception import PagerException
+from losspager.utils.gridstore import get_file_key
+
+# version of the cached results - change this whenever the contents of the cache change
+RESULT_CACHE_VERSION = 1
+
+# name of the folder (inside the cache folder) where PAGER results are kept
+RESULT_FOLDER = "results"
+
+# name of the file (in each cache entry) containing the pickled results
+RESULTS_FILE = "results.pkl"
+
+# default maximum number of cache entries - the least recently used entries are removed
+MAX_ENTRIES = 200
+
+# size of the chunks read when hashing grid files
+BLOCKSIZE = 1024 * 1024
+
+# start of the grid values in a ShakeMap grid.xml file (everything before it is metadata)
+GRID_START = b"<grid_specification"
+
+
+def get_grid_hash(gridfile):
+    """Return a hash of the grid values in a ShakeMap grid.xml file.
+
+    Only the grid specification (geodict), field definitions and grid data are hashed, so
+    ShakeMaps that differ only in their metadata (version, process time, event description,
+    etc.) have the same hash.
+
+    :param gridfile:
+      Path to ShakeMap grid.xml file.
+    :returns:
+      SHA256 hex digest of the grid values.
+    :raises:
+      PagerException when the file does not contain a grid specification.
+    """
+    sha = hashlib.sha256()
+    with open(gridfile, "rb") as f:
+        header = b""
+        for block in iter(lambda: f.read(BLOCKSIZE), b""):
+            if header is not None:
+                header += block
+                start = header.find(GRID_START)
+                if start < 0:
+                    continue
+                block = header[start:]
+                header = None
+            sha.update(block)
+    if header is not None:
+        raise PagerException("%s is not a ShakeMap grid file." % gridfile)
+    return sha.hexdigest()
+
+
+def get_model_files():
+    """Return the model and reference data files included with this code.
+
+    :returns:
+      Sorted list of paths to files in the losspager data folder.
+    """
+    datafolder = get_data_path("")
+    datafiles = []
+    for fname in os.listdir(datafolder):
+        datafile = os.path.join(datafolder, fname)
+        if os.path.isfile(datafile):
+            datafiles.append(datafile)
+    return sorted(datafiles)
+
+
+def get_result_key(gridfile, event, datafiles):
+    """Return the key identifying PAGER results for a ShakeMap.
+
+    :param gridfile:
+      Path to ShakeMap grid.xml file.
+    :param event:
+      Dictionary of the other event properties the results depend on (epicenter, magnitude,
+      origin time, etc.)  Values must have a stable repr().
+    :param datafiles:
+      List of model and data files (or folders) the results depend on.  Files are identified
+      by name, size and modification time, so they are not read.
+    :returns:
+      SHA256 hex digest of the grid values, event properties, data files and code version.
+    """
+    try:
+        code_version = metadata.version("losspager")
+    except metadata.PackageNotFoundError:
+        code_version = "unknown"
+    sha = hashlib.sha256()
+    sha.update(("%i:%s" % (RESULT_CACHE_VERSION, code_version)).encode("utf-8"))
+    sha.update(get_grid_hash(gridfile).encode("utf-8"))
+    sha.update(repr(sorted(event.items())).encode("utf-8"))
+    for datafile in sorted(set(datafiles)):
+        if os.path.exists(datafile):
+            datakey = get_file_key(datafile)
+        else:
+            datakey = "missing"
+        sha.update(("%s:%s" % (datafile, datakey)).encode("utf-8"))
+    return sha.hexdigest()
+
+
+class ResultCache(object):
+    def __init__(self, folder, max_entries=MAX_ENTRIES):
+        """Create a cache of PAGER results, keyed on the contents of the input ShakeMap.
+
+        Each entry is a folder containing a pickle file of model results, and copies of the
+        files (maps, plots) rendered from those results.
+
+        :param folder:
+          Folder containing the cache entries (created if it does not exist).
+        :param max_entries:
+          Maximum number of entries to keep.
+        """
+        self._folder = folder
+        self._max_entries = max_entries
+
+    @classmethod
+    def fromConfig(cls, config):
+        """Create the result cache described in the config file.
+
+        The cache is configured with an optional section:
+          result_cache:
+            enabled: True
+            folder: /path/to/cache/folder
+            max_entries: 200
+        By default, results are cached in the results folder of the losspager cache folder.
+
+        :param config:
+          Dictionary containing configuration parameters.
+        :returns:
+          ResultCache instance, or None if the cache has been disabled.
+        """
+        cachedict = config.get("result_cache", {})
+        if not cachedict.get("enabled", True):
+            return None
+        folder = cachedict.get(
+            "folder", os.path.join(get_cache_folder(), RESULT_FOLDER)
+        )
+        max_entries = cachedict.get("max_entries", MAX_ENTRIES)
+        return cls(folder, max_entries=max_entries)
+
+    def getFolder(self):
+        """Return the folder containing the cache entries.
+
+        :returns:
+          Path to cache folder.
+        """
+        return self._folder
+
+    def getEntries(self):
+        """Return the keys of all entries in the cache.
+
+        :returns:
+          List of keys, from least to most recently used.
+        """
+        if not os.path.isdir(self._folder):
+            return []
+        entries = []
+        for key in os.listdir(self._folder):
+            resultsfile = os.path.join(self._folder, key, RESULTS_FILE)
+            if os.path.isfile(resultsfile):
+                entries.append((os.path.getmtime(resultsfile), key))
+        return [key for mtime, key in sorted(entries)]
+
+    def load(self, key, output_folder):
+        """Load cached results, and copy the cached files into an output folder.
+
+        :param key:
+          Key returned by get_result_key().
+        :param output_folder:
+          Folder where cached files should be copied.
+        :returns:
+          Dictionary of results passed to save(), or None if there is no entry for key
+          (or it could not be read).
+        """
+        entry = os.path.join(self._folder, key)
+        resultsfile = os.path.join(entry, RESULTS_FILE)
+        if not os.path.isfile(resultsfile):
+            return None
+        try:
+            results = pd.read_pickle(resultsfile)
+            for fname in os.listdir(entry):
+                if fname != RESULTS_FILE:
+                    shutil.copy(os.path.join(entry, fname), output_folder)
+            # mark the entry as recently used
+            os.utime(resultsfile)
+        except Exception as e:
+            logging.warning('Could not read cached results %s: "%s".' % (entry, str(e)))
+            return None
+        return results
+
+    def save(self, key, results, files):
+        """Save results, and copies of the files rendered from them, to the cache.
+
+        If the cache folder cannot be written, nothing is saved.
+
+        :param key:
+          Key returned by get_result_key().
+        :param results:
+          Dictionary of (picklable) results.
+        :param files:
+          List of paths to files to be copied into the cache entry.
+        """
+        tmpfolder = None
+        try:
+            if not os.path.isdir(self._folder):
+                os.makedirs(self._folder)
+            # build the entry in a temporary folder and rename it, so other processes
+            # never see a partial entry
+            tmpfolder = tempfile.mkdtemp(dir=self._folder, prefix=".tmp")
+            for fname in files:
+                shutil.copy(fname, tmpfolder)
+            pd.to_pickle(results, os.path.join(tmpfolder, RESULTS_FILE))
+            entry = os.path.join(self._folder, key)
+            if os.path.isdir(entry):
+                shutil.rmtree(entry)
+            os.rename(tmpfolder, entry)
+            tmpfolder = None
+        except Exception as e:
+            logging.warning('Could not save results to cache %s: "%s".' % (self._folder, str(e)))
+        finally:
+            if tmpfolder is not None and os.path.isdir(tmpfolder):
+                shutil.rmtree(tmpfolder)
+        self._prune()
+
+    def _prune(self):
+        # remove the least recently used entries beyond the maximum number of entries
+        entries = self.getEntries()
+        for key in entries[: max(len(entries) - self._max_entries, 0)]:
+            shutil.rmtree(os.path.join(self._folder, key), ignore_errors=True)
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+
+# stdlib imports
+import threading
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+
+# local imports
+from losspager.utils.exception import PagerException
+from losspager.utils.timing import get_timings
+
+# default number of threads and processes used to run stages
+MAX_THREADS = 4
+MAX_PROCESSES = 2
+
+
+def _timed_call(name, func, args, kwargs):
+    # call a stage function, returning its result and timing (recorded in the process-wide
+    # timings, if they have been started)
+    with get_timings().stage(name) as record:
+        result = func(*args, **kwargs)
+    return (result, record, [])
+
+
+def _process_call(name, func, args, kwargs, record_timings):
+    # call a stage function in a worker process, returning its result and timing, along with
+    # all of the timings recorded in the worker process while it ran
+    timings = get_timings()
+    timings.start()
+    result, record, _ = _timed_call(name, func, args, kwargs)
+    stages = timings.stop()
+    if not record_timings:
+        stages = []
+    return (result, record, stages)
+
+
+def _no_op():
+    return None
+
+
+class StageScheduler(object):
+    def __init__(self, max_threads=MAX_THREADS, max_processes=MAX_PROCESSES):
+        """Create a scheduler that runs a dependency graph of stages concurrently.
+
+        Stages run in a pool of threads as soon as all of the stages they depend on have
+        finished.  Stages that are not thread-safe (i.e., anything drawing with pyplot) can be
+        run in a pool of processes instead.  The timing of each stage (and anything timed
+        inside it, in either threads or processes) is recorded in the process-wide timings, if
+        they have been started.
+
+        :param max_threads:
+          Maximum number of stages run at the same time in threads.
+        :param max_processes:
+          Maximum number of stages run at the same time in processes.  If 0, process stages
+          are run in threads, one at a time.
+        """
+        self._max_threads = max_threads
+        self._max_processes = max_processes
+        self._stages = {}
+        self._order = []
+        self._times = {}
+
+    @classmethod
+    def fromConfig(cls, config):
+        """Create a scheduler configured in the (optional) scheduler section of the config file:
+          scheduler:
+            threads: 4
+            processes: 2
+
+        :param config:
+          Dictionary containing configuration parameters.
+        :returns:
+          StageScheduler instance.
+        """
+        scheddict = config.get("scheduler", {})
+        return cls(
+            max_threads=scheddict.get("threads", MAX_THREADS),
+            max_processes=scheddict.get("processes", MAX_PROCESSES),
+        )
+
+    def addStage(self, name, func, depends=(), args=(), kwargs=None, process=False):
+        """Add a stage to the scheduler.
+
+        The stage function is called with the results of the stages it depends on (in order),
+        followed by args and kwargs.
+
+        :param name:
+          Unique stage name.
+        :param func:
+          Stage function.  Must be picklable (a module level function) if process is True.
+        :param depends:
+          Sequence of names of stages (already added) that must finish before this one starts.
+        :param args:
+          Sequence of additional positional arguments to func.
+        :param kwargs:
+          Dictionary of keyword arguments to func, or None.
+        :param process:
+          True if the stage should be run in a separate process.
+        :raises:
+          PagerException when the stage name is already in use, or a dependency has not been added.
+        """
+        if name in self._stages:
+            raise PagerException("Stage %s has already been added." % name)
+        for depend in depends:
+            if depend not in self._stages:
+                raise PagerException(
+                    "Stage %s depends on unknown stage %s." % (name, depend)
+                )
+        self._stages[name] = {
+            "func": func,
+            "depends": list(depends),
+            "args": tuple(args),
+            "kwargs": kwargs if kwargs is not None else {},
+            "process": process,
+        }
+        self._order.append(name)
+
+    def run(self):
+        """Run all of the stages.
+
+        If any stage fails, no further stages are started, and the first exception raised is
+        re-raised once the running stages have finished.
+
+        :returns:
+          Dictionary of stage results, keyed on stage name.
+        """
+        results = {}
+        self._times = {}
+        use_processes = self._max_processes > 0 and any(
+            stage["process"] for stage in self._stages.values()
+        )
+        process_lock = threading.Lock()
+        threads = ThreadPoolExecutor(max_workers=self._max_threads)
+        processes = None
+        try:
+            if use_processes:
+                # start the worker processes before any threads are running
+                processes = ProcessPoolExecutor(max_workers=self._max_processes)
+                processes.submit(_no_op).result()
+            timings = get_timings()
+            pending = list(self._order)
+            running = {}
+            error = None
+            while pending or running:
+                if error is None:
+                    for name in list(pending):
+                        stage = self._stages[name]
+                        if not all(depend in results for depend in stage["depends"]):
+                            continue
+                        pending.remove(name)
+                        args = [results[depend] for depend in stage["depends"]]
+                        args += list(stage["args"])
+                        if stage["process"] and processes is not None:
+                            future = processes.submit(
+                                _process_call,
+                                name,
+                                stage["func"],
+                                args,
+                                stage["kwargs"],
+                                timings.isEnabled(),
+                            )
+                        elif stage["process"]:
+                            future = threads.submit(
+                                self._lockedCall, process_lock, name, stage, args
+                            )
+                        else:
+                            future = threads.submit(
+                                _timed_call, name, stage["func"], args, stage["kwargs"]
+                            )
+                        running[future] = name
+                if not running:
+                    break
+                done, _ = wait(list(running.keys()), return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        result, record, worker_stages = future.result()
+                    except Exception as e:
+                        if error is None:
+                            error = e
+                        continue
+                    results[name] = result
+                    timings.addStages(worker_stages)
+                    start = record["start"]
+                    self._times[name] = (start, start + record["wall_time"])
+            if error is not None:
+                raise error
+        finally:
+            threads.shutdown()
+            if processes is not None:
+                processes.shutdown()
+        return results
+
+    def _lockedCall(self, lock, name, stage, args):
+        # run a process stage in a thread, when processes are disabled
+        with lock:
+            return _timed_call(name, stage["func"], args, stage["kwargs"])
+
+    def getTimes(self):
+        """Return the start and end times of the stages run by the last call to run().
+
+        :returns:
+          Dictionary of (start, end) tuples of wall clock times (seconds since the epoch), keyed
+          on stage name.
+        """
+        return dict(self._times)
+
+    def getCriticalPath(self):
+        """Return the chain of stages that determined the total run time of the last call to run().
+
+        The path starts with the stage that finished last, and works back through the dependency
+        of each stage that finished last (the one it was waiting for).
+
+        :returns:
+          List of (stage name, elapsed seconds) tuples, in the order the stages ran.
+        """
+        if not self._times:
+            return []
+        name = max(self._times, key=lambda stage: self._times[stage][1])
+        path = []
+        while name is not None:
+            start, end = self._times[name]
+            path.insert(0, (name, end - start))
+            depends = [d for d in self._stages[name]["depends"] if d in self._times]
+            name = None
+            if depends:
+                name = max(depends, key=lambda stage: self._times[stage][1])
+        return path
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+# stdlib imports
+import os.path
+from multiprocessing.connection import Client
+
+# name of the socket file (in the PAGER output folder) used when none is configured
+SOCKET_FILE = "pager_worker.sock"
+
+
+def get_worker_address(config):
+    """Return the address of the PAGER worker socket.
+
+    The socket can be set in the config file with:
+      worker:
+        socket: /path/to/pager_worker.sock
+        authkey: secret
+    otherwise it is a file in the PAGER output folder.
+
+    :param config:
+      Dictionary containing configuration parameters.
+    :returns:
+      Tuple of (path to socket file, authkey bytes or None).
+    """
+    workerdict = config.get("worker", {})
+    if "socket" in workerdict:
+        address = workerdict["socket"]
+    else:
+        homedir = os.path.expanduser("~")
+        address = os.path.join(homedir, config["output_folder"], SOCKET_FILE)
+    authkey = workerdict.get("authkey")
+    if authkey is not None:
+        authkey = authkey.encode("utf-8")
+    return (address, authkey)
+
+
+def submit_job(config, gridfile, **kwargs):
+    """Send a ShakeMap to a running PAGER worker, and wait for the result.
+
+    :param config:
+      Dictionary containing configuration parameters.
+    :param gridfile:
+      Path to ShakeMap grid.xml file (or event ID or url, see the pager program).
+    :param kwargs:
+      Any of the pager command line options (debug, release, cancel, tsunami, elapsed).
+    :returns:
+      Dictionary with fields:
+        - result True if the PAGER run succeeded, False otherwise.
+        - elapsed Run time in seconds.
+        - error Error message, if the worker could not run PAGER.
+    :raises:
+      FileNotFoundError or ConnectionRefusedError when no worker is listening (the job was
+      not sent), EOFError or other OSErrors when the worker stops before returning a result.
+    """
+    address, authkey = get_worker_address(config)
+    job = {"command": "run", "gridfile": gridfile}
+    job.update(kwargs)
+    with Client(address, family="AF_UNIX", authkey=authkey) as conn:
+        conn.send(job)
+        return conn.recv()
+
+
+def send_command(config, command):
+    """Send a control command ("ping" or "stop") to a running PAGER worker.
+
+    :param config:
+      Dictionary containing configuration parameters.
+    :param command:
+      One of "ping" or "stop".
+    :returns:
+      Dictionary returned by the worker.
+    :raises:
+      OSError when no worker is listening.
+    """
+    address, authkey = get_worker_address(config)
+    with Client(address, family="AF_UNIX", authkey=authkey) as conn:
+        conn.send({"command": command})
+        return conn.recv()
@@ -17,6 +17,7 @@ import pandas as pd
 from impactutils.comcat.query import ComCatInfo
 from impactutils.io.cmd import get_command_output
 from impactutils.transfer.factory import get_sender_class
+from losspager.io.pagerdata import DATETIMEFMT as PAGER_DATETIMEFMT
 from losspager.io.pagerdata import PagerData
 from losspager.utils.config import (
     get_config_file,
@@ -27,6 +28,7 @@ from losspager.utils.config import (
 
 # local imports
 from losspager.utils.exception import PagerException
+from losspager.utils.timing import TIMINGS_FILE, StageTimings
 
 DATETIMEFMT = "%Y%m%d%H%M%S"
 EIGHT_HOURS = 8 * 3600
@@ -43,6 +45,17 @@ SHAKEMAP_SOURCES = ["us", "ci", "nc", "nn", "hv", "uw", "nn", "uu", "ak"]
 
 STATUSDICT = {True: "reviewed", False: "automatic"}
 
+TIMING_COLUMNS = [
+    "EventID",
+    "Version",
+    "SoftwareVersion",
+    "ProcessTime",
+    "Stage",
+    "WallTime",
+    "CPUTime",
+    "PeakRSS",
+]
+
 
 def unset_pending(version_folder):
     """Modify pending alert level to match true alert level.
@@ -826,3 +839,78 @@ class PagerAdmin(object):
         df = df.sort_values("EventTime")
         df = df.set_index("EventID")
         return (df, broken)
+
+    def queryTimings(
+        self, start_time=None, end_time=None, version="last", min_wall_time=0.0
+    ):
+        """Query the processing stage timings (timings.json) of PAGER runs.
+
+        :param start_time:
+          Datetime indicating the minimum processing date/time for the search, or None.
+        :param end_time:
+          Datetime indicating the maximum processing date/time for the search, or None.
+        :param version:
+          Which version(s) to select from events:
+            - 'first' Get first version.
+            - 'last' Get last version.
+            - 'all' Get all versions.
+        :param min_wall_time:
+          Only return stages that took at least this many seconds.
+        :returns:
+          Pandas dataframe containing one row per stage, with columns:
+            - 'EventID' - event ID
+            - 'Version' - Version number
+            - 'SoftwareVersion' - PAGER software version that ran the version.
+            - 'ProcessTime' - Datetime (UTC) when version was processed by PAGER.
+            - 'Stage' - Stage name.
+            - 'WallTime' - Elapsed time of stage (seconds).
+            - 'CPUTime' - CPU time of stage (seconds).
+            - 'PeakRSS' - Peak memory use (MB) of the process that ran the stage.
+        :raises:
+          PagerException when the version option is not supported.
+        """
+        if version not in ("first", "last", "all"):
+            raise PagerException('version option "%s" not supported.' % version)
+        rows = []
+        for event_folder in self.getAllEventFolders():
+            vnums = self.getVersionNumbers(event_folder)
+            if not len(vnums):
+                continue
+            if version == "first":
+                vnums = vnums[:1]
+            elif version == "last":
+                vnums = vnums[-1:]
+            for vnum in vnums:
+                version_folder = os.path.join(event_folder, "version.%03d" % vnum)
+                timingsfile = os.path.join(version_folder, TIMINGS_FILE)
+                eventfile = os.path.join(version_folder, "json", "event.json")
+                # versions run before timings were recorded (or that failed) are skipped
+                if not os.path.isfile(timingsfile) or not os.path.isfile(eventfile):
+                    continue
+                with open(eventfile, "rt") as f:
+                    pager = json.load(f)["pager"]
+                process_time = datetime.datetime.strptime(
+                    pager["processing_time"], PAGER_DATETIMEFMT
+                )
+                if start_time is not None and process_time < start_time:
+                    continue
+                if end_time is not None and process_time > end_time:
+                    continue
+                for stage in StageTimings.load(timingsfile):
+                    if stage["wall_time"] < min_wall_time:
+                        continue
+                    rows.append(
+                        [
+                            pager["eventcode"],
+                            pager["version_number"],
+                            pager["software_version"],
+                            process_time,
+                            stage["name"],
+                            stage["wall_time"],
+                            stage["cpu_time"],
+                            stage["peak_rss"],
+                        ]
+                    )
+        df = pd.DataFrame(rows, columns=TIMING_COLUMNS)
+        df = df.sort_values(["ProcessTime", "Stage"]).reset_index(drop=True)
+        return df
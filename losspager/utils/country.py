@@ -2,17 +2,214 @@
 
 # stdlib imports
 import os.path
+import threading
+from bisect import bisect_right
 
 # third party imports
 import pandas as pd
 import numpy as np
 
+# local imports
+from losspager.utils.exception import PagerException
+from losspager.utils.datacache import read_excel_cached
+
+# process-wide CountryIndex built from the default countries spreadsheet (see get_country_index())
+_DEFAULT_INDEX = None
+_DEFAULT_INDEX_LOCK = threading.Lock()
+
+# character separating the country names searched by CountryIndex.findName()
+NAME_SEPARATOR = '\n'
+
+EMPTY_ROW = {'Name': 'Unknown',
+             'LongName': 'Unknown',
+             'ISO2': 'UK',
+             'ISO3': 'UKN',
+             'ISON': 0,
+             'Population': 0}
+
+
+def get_country_index():
+    """Return the process-wide CountryIndex built from the countries.xlsx file included with this code.
+
+    The spreadsheet is only read the first time this function is called.
+
+    :returns:
+      CountryIndex object.
+    """
+    global _DEFAULT_INDEX
+    with _DEFAULT_INDEX_LOCK:
+        if _DEFAULT_INDEX is None:
+            homedir = os.path.dirname(os.path.abspath(__file__))  # where is this script?
+            excelfile = os.path.abspath(os.path.join(homedir, '..', 'data', 'countries.xlsx'))
+            dataframe = read_excel_cached(excelfile)
+            idx = pd.isnull(dataframe['Name'])
+            dataframe.loc[idx, 'Name'] = dataframe['LongName'][idx]
+            _DEFAULT_INDEX = CountryIndex(dataframe)
+    return _DEFAULT_INDEX
+
+
+class CountryIndex(object):
+    def __init__(self, dataframe):
+        """Build immutable lookup tables from a dataframe of country data.
+
+        :param dataframe:
+          Pandas dataframe containing (at least) the columns LongName, ISO2, ISO3, ISON and Name.
+        """
+        self._dataframe = dataframe
+        self._rows = tuple([row.to_dict() for _, row in dataframe.iterrows()])
+        self._columns = {}
+        for column in dataframe.columns:
+            values = np.array([row[column] for row in self._rows], dtype=object)
+            values.flags.writeable = False
+            self._columns[column] = values
+
+        # dictionaries of the (first) row index matching each code
+        self._iso2 = {}
+        self._iso3 = {}
+        self._ison = {}
+        for i, row in enumerate(self._rows):
+            if isinstance(row['ISO2'], str):
+                self._iso2.setdefault(row['ISO2'], i)
+            if isinstance(row['ISO3'], str):
+                self._iso3.setdefault(row['ISO3'], i)
+            if not pd.isnull(row['ISON']):
+                self._ison.setdefault(int(row['ISON']), i)
+
+        # lower case names, in row order, joined into one string for name fragment searches,
+        # with the offset of the start of each name.
+        names = [str(row['Name']).lower() for row in self._rows]
+        self._names = NAME_SEPARATOR.join(names)
+        offsets = []
+        offset = 0
+        for name in names:
+            offsets.append(offset)
+            offset += len(name) + len(NAME_SEPARATOR)
+        self._name_offsets = tuple(offsets)
+
+        # array mapping ISON values to row indices (-1 where there is no country)
+        maxison = max(list(self._ison.keys()) + [0])
+        ison_rows = np.full(maxison + 1, -1, dtype=np.int64)
+        for ison, i in self._ison.items():
+            if ison >= 0:
+                ison_rows[ison] = i
+        ison_rows.flags.writeable = False
+        self._ison_rows = ison_rows
+
+    @property
+    def dataframe(self):
+        """Return the dataframe the index was built from.
+
+        :returns:
+          Pandas dataframe of country data.
+        """
+        return self._dataframe
+
+    def __len__(self):
+        return len(self._rows)
+
+    def getRow(self, rowidx):
+        """Return a copy of the dictionary of country data at a given row.
+
+        :param rowidx:
+          Row index (as returned by the find*() or getRowIndices() methods).
+        :returns:
+          Dictionary of country data.
+        """
+        return dict(self._rows[rowidx])
+
+    def findNumeric(self, value):
+        """Return the row index of the first country matching a numeric code.
+
+        :param value:
+          Numeric ISO 3166 country code (int, float or numpy number).
+        :returns:
+          Row index, or None if no country matches.
+        """
+        if np.isnan(value) or value != int(value):
+            return None
+        return self._ison.get(int(value))
+
+    def findCode(self, value):
+        """Return the row index of the first country matching a two or three letter code.
+
+        :param value:
+          Two or three letter ISO 3166 country code (JP, JPN, etc.)
+        :returns:
+          Row index, or None if no country matches.
+        """
+        if len(value) == 2:
+            return self._iso2.get(value)
+        return self._iso3.get(value)
+
+    def findName(self, fragment):
+        """Return the row index of the first country whose name contains the input fragment (case insensitive).
+
+        :param fragment:
+          Name or name fragment (Japan, united states of america, etc.)
+        :returns:
+          Row index, or None if no country matches.
+        """
+        fragment = fragment.lower()
+        if NAME_SEPARATOR in fragment:
+            return None
+        # the first match in the joined names is in the first row whose name contains the fragment
+        start = self._names.find(fragment)
+        if start < 0:
+            return None
+        return bisect_right(self._name_offsets, start) - 1
+
+    def getRowIndices(self, isodata):
+        """Translate an array of numeric country codes into row indices.
+
+        :param isodata:
+          Array of numeric ISO 3166 country codes (NaN allowed).
+        :returns:
+          Integer array of the same shape, containing row indices, or -1 where no country matches.
+        """
+        isodata = np.asarray(isodata)
+        if isodata.dtype.kind == 'f':
+            valid = np.isfinite(isodata)
+            valid[valid] = isodata[valid] == np.floor(isodata[valid])
+        else:
+            valid = np.ones(isodata.shape, dtype=bool)
+        codes = np.where(valid, isodata, -1).astype(np.int64)
+        valid &= (codes >= 0) & (codes < len(self._ison_rows))
+        rows = np.full(isodata.shape, -1, dtype=np.int64)
+        rows[valid] = self._ison_rows[codes[valid]]
+        return rows
+
+    def translate(self, isodata, column):
+        """Translate an array of numeric country codes into the values of another column.
+
+        :param isodata:
+          Array of numeric ISO 3166 country codes (NaN allowed).
+        :param column:
+          Column name (ISO2, ISO3, Name, etc.)
+        :returns:
+          Numpy object array of the same shape, containing column values, or the value for
+          an unknown country (i.e., 'UK' for ISO2) where no country matches, as getCountry() does.
+        """
+        rows = self.getRowIndices(isodata)
+        values = self._columns[column][np.where(rows >= 0, rows, 0)]
+        values[rows < 0] = EMPTY_ROW[column]
+        return values
+
+    def getColumn(self, column):
+        """Return the (read-only) array of values of a column, in row order.
+
+        :param column:
+          Column name (ISO2, ISO3, ISON, Name, etc.)
+        :returns:
+          Numpy object array of column values.
+        """
+        return self._columns[column]
+
+
 class Country(object):
     def __init__(self):
-        homedir = os.path.dirname(os.path.abspath(__file__))  # where is this script?
-        excelfile = os.path.abspath(os.path.join(homedir, '..', 'data', 'countries.xlsx'))
-        self._loadFromExcel(excelfile)        
-    
+        self._index = get_country_index()
+        self._dataframe = self._index.dataframe
+
     def getUSCode(self, code):
         """Handle US-region specific codes for California, Eastern US, and Western US.
 
@@ -27,20 +224,21 @@ class Country(object):
             return code
 
     def _loadFromExcel(self, excelfile):
-        self._dataframe = pd.read_excel(excelfile)
+        self._dataframe = read_excel_cached(excelfile)
         idx = pd.isnull(self._dataframe['Name'])
         self._dataframe.loc[idx, 'Name'] = self._dataframe['LongName'][idx]
-        
+        self._index = CountryIndex(self._dataframe)
+
     def _loadFromCSV(self, csvfile):
         """Load from a CSV file containing five columns: LongName,ISO2,ISO3,ISON,Name.
 
-        NB: 
+        NB:
 
           There are three PAGER-specific country codes in the PAGER countries.csv file.
           - 902: California
           - 903: Eastern US
           - 904: Western US
-        
+
         :param csvfile:
           CSV file containing country information with the following columns:
            - LongName: Long country name.
@@ -49,7 +247,7 @@ class Country(object):
            - ISON: Numeric country code.
            - Name: Short country name.
            - Source: https://en.wikipedia.org/wiki/ISO_3166-1
-        
+
         """
         self._dataframe = pd.read_csv(csvfile)
         cols = ['LongName', 'ISO2', 'ISO3', 'ISON', 'Name']
@@ -59,23 +257,32 @@ class Country(object):
 
         idx = pd.isnull(self._dataframe['Name'])
         self._dataframe.loc[idx, 'Name'] = self._dataframe['LongName'][idx]
+        self._index = CountryIndex(self._dataframe)
+
+    def getIndex(self):
+        """Return the CountryIndex used by this object, for vectorized lookups.
+
+        :returns:
+          CountryIndex object.
+        """
+        return self._index
 
     def getCountry(self, value):
         """Return a dictionary containing the country name/codes for the first country that matches the input value.
 
-        N.B. 
+        N.B.
 
           This method matches the first country it can, which means that in the case of an input "guinea", for
-          example, you would get back the data for "Equatorial Guinea", as opposed to "Guinea", "Guinea-Bissau", or 
+          example, you would get back the data for "Equatorial Guinea", as opposed to "Guinea", "Guinea-Bissau", or
           "Papua New Guinea".  Also be aware that there is a country code for "United States Minor Outlying Islands".
-        
+
         :param value:
-          One of: 
+          One of:
            - Two letter ISO 3166 country code (JP,US, etc.)
            - Three letter ISO 3166 country code (JPN,USA, etc.)
            - Numerical ISO 3166 country code (392,840, etc.)
            - Name or name fragment (Japan,united states of america, etc.)
-           
+
         :returns:
           Dictionary containing the following:
             - Name: Short name (i.e., Bolivia)
@@ -85,33 +292,18 @@ class Country(object):
             - ISON: Numeric ISO country code (68)
             - Population Number of people inside the country.
           or None if the input value does not match any known country data.
-        
+
         """
-        emptyrow = {'Name': 'Unknown',
-               'LongName': 'Unknown',
-               'ISO2': 'UK',
-               'ISO3': 'UKN',
-               'ISON': 0,
-               'Population': 0}
-        row = None
-        if isinstance(value, (int, float,np.number)):
-            row = self._dataframe[self._dataframe['ISON'] == value]
+        rowidx = None
+        if isinstance(value, (int, float, np.number)):
+            rowidx = self._index.findNumeric(value)
         elif isinstance(value, str):
             if len(value) == 0:
-                return emptyrow
-            if len(value) == 2:
-                row = self._dataframe[self._dataframe['ISO2'] == value]
-            elif len(value) == 3:
-                row = self._dataframe[self._dataframe['ISO3'] == value]
-            else:
-                row = self._dataframe[self._dataframe.Name.str.lower().str.contains(value.lower())]
-        if row is None:
-            return emptyrow
-        else:
-            if len(row) > 0:
-                return row.iloc[0].to_dict()
-            elif not len(row):
-                return emptyrow
+                return dict(EMPTY_ROW)
+            if len(value) in (2, 3):
+                rowidx = self._index.findCode(value)
             else:
-                return row.to_dict()
-                
+                rowidx = self._index.findName(value)
+        if rowidx is None:
+            return dict(EMPTY_ROW)
+        return self._index.getRow(rowidx)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+# stdlib imports
+import os.path
+import hashlib
+import tempfile
+import logging
+
+# third party imports
+import pandas as pd
+
+# default folder for cached reference data, can be overridden with this environment variable
+CACHE_ENV = 'LOSSPAGER_CACHE'
+CACHE_FOLDER = os.path.join(os.path.expanduser('~'), '.losspager', 'cache')
+
+# size of the chunks read when hashing files
+BLOCKSIZE = 1024 * 1024
+
+
+def get_cache_folder():
+    """Return the folder where converted reference data files are stored.
+
+    :returns:
+      Path to cache folder (value of the LOSSPAGER_CACHE environment variable, if set,
+      otherwise ~/.losspager/cache).  The folder may not exist yet.
+    """
+    return os.environ.get(CACHE_ENV, CACHE_FOLDER)
+
+
+def get_file_hash(filename):
+    """Return a hash of the contents of a file.
+
+    :param filename:
+      Path to any file.
+    :returns:
+      SHA1 hex digest of the file contents.
+    """
+    sha = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(BLOCKSIZE), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def get_cache_file(datafile, *args, **kwargs):
+    """Return the name of the cache file for a data file and the options used to read it.
+
+    :param datafile:
+      Path to the source data file.
+    :param args:
+      Positional options used to read the file (part of the cache key).
+    :param kwargs:
+      Keyword options used to read the file (part of the cache key).
+    :returns:
+      Path to cache file (which may not exist), named after the source file and a hash
+      of its contents and read options.
+    """
+    sha = hashlib.sha1()
+    sha.update(get_file_hash(datafile).encode('utf-8'))
+    sha.update(repr(args).encode('utf-8'))
+    sha.update(repr(sorted(kwargs.items())).encode('utf-8'))
+    fbase, fext = os.path.splitext(os.path.basename(datafile))
+    cachename = '%s_%s.pkl' % (fbase, sha.hexdigest())
+    return os.path.join(get_cache_folder(), cachename)
+
+
+def load_cached(cachefile, loader):
+    """Return an object from a pickle cache file, creating the file with a loader function if necessary.
+
+    If the cache folder cannot be written, the loader is simply called every time.
+
+    :param cachefile:
+      Path to cache file, as returned by get_cache_file().
+    :param loader:
+      Function (without arguments) returning the object to be cached.
+    :returns:
+      Object returned by loader (or a copy read from the cache file).
+    """
+    if os.path.isfile(cachefile):
+        try:
+            return pd.read_pickle(cachefile)
+        except Exception as e:
+            logging.warning('Could not read cache file %s: "%s".' % (cachefile, str(e)))
+
+    data = loader()
+    tmpfile = None
+    try:
+        cachefolder = os.path.dirname(cachefile)
+        if not os.path.isdir(cachefolder):
+            os.makedirs(cachefolder)
+        # write to a temporary file and rename it, so other processes never see a partial file
+        handle, tmpfile = tempfile.mkstemp(dir=cachefolder, suffix='.tmp')
+        os.close(handle)
+        pd.to_pickle(data, tmpfile)
+        os.replace(tmpfile, cachefile)
+    except Exception as e:
+        logging.warning('Could not write cache file %s: "%s".' % (cachefile, str(e)))
+        if tmpfile is not None and os.path.isfile(tmpfile):
+            os.remove(tmpfile)
+    return data
+
+
+def read_excel_cached(excelfile, **kwargs):
+    """Read an Excel file into a DataFrame, using a binary cache of previous reads of the same file.
+
+    The first time a given file (by content) is read with a given set of options, the resulting
+    DataFrame is written to a pickle file in the cache folder.  Subsequent calls load that
+    file instead of parsing the spreadsheet.  If the cache folder cannot be written, the
+    spreadsheet is simply read every time.
+
+    :param excelfile:
+      Path to Excel file.
+    :param kwargs:
+      Keyword arguments to pandas.read_excel().
+    :returns:
+      Pandas DataFrame (or dictionary of DataFrames, if sheet_name=None).
+    """
+    cachefile = get_cache_file(excelfile, **kwargs)
+    return load_cached(cachefile, lambda: pd.read_excel(excelfile, **kwargs))
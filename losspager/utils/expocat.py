@@ -2,6 +2,7 @@
 
 # stdlib imports
 import os.path
+import threading
 from collections import OrderedDict
 
 # third party imports
@@ -10,10 +11,25 @@ import numpy as np
 from impactutils.colors.cpalette import ColorPalette
 from impactutils.extern.openquake.geodetic import geodetic_distance
 
+# local imports
+from losspager.utils.datacache import read_excel_cached
+from losspager.utils.exception import PagerException
+
 # number of seconds to compare one event with another when searching for similar events.
 TIME_WINDOW = 15
 MIN_MMI = 1000
 
+# mean earth radius (km) used by geodetic_distance()
+EARTH_RADIUS = 6371.0
+
+# extra distance (degrees) added to search windows, so they always contain every event within the radius
+INDEX_MARGIN = 0.01
+
+# process-wide dataframe loaded from the default expocat spreadsheet, and its spatial index
+_DEFAULT_DATAFRAME = None
+_DEFAULT_INDEX = None
+_DEFAULT_DATAFRAME_LOCK = threading.Lock()
+
 
 def to_ordered_dict(series):
     keys = series.index
@@ -61,8 +77,399 @@ def _select_by_max_mmi(df, mmi, minimum=1000):
     return None
 
 
+class SpatialIndex(object):
+    def __init__(self, lats, lons):
+        """Create a spatial index of event coordinates, for fast radius and bounds searches.
+
+        Events are sorted by latitude, so the candidates for a search are found with a binary
+        search on latitude and then filtered by longitude and distance.
+
+        :param lats:
+          Array of event latitudes.
+        :param lons:
+          Array of event longitudes.
+        """
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        self._order = np.argsort(lats, kind='mergesort')
+        self._lats = lats[self._order]
+        self._lons = lons[self._order]
+
+    def __len__(self):
+        """Return the number of events in the index.
+
+        :returns:
+          Number of events in the index.
+        """
+        return len(self._order)
+
+    def _getLatitudeBand(self, minlat, maxlat):
+        # slice of sorted events where minlat < lat <= maxlat
+        i1 = np.searchsorted(self._lats, minlat, side='right')
+        i2 = np.searchsorted(self._lats, maxlat, side='right')
+        return slice(i1, i2)
+
+    def getRadiusPositions(self, clat, clon, radius):
+        """Find the events within a search radius around a set of coordinates.
+
+        :param clat:
+          Latitude of search center.
+        :param clon:
+          Longitude of search center.
+        :param radius:
+          Search radius (km).
+        :returns:
+          Tuple of (sorted) array of positions of events closer than radius, and array of their distances (km).
+        """
+        angle = np.degrees(radius / EARTH_RADIUS) + INDEX_MARGIN
+        band = self._getLatitudeBand(clat - angle, clat + angle)
+        lats = self._lats[band]
+        lons = self._lons[band]
+        order = self._order[band]
+        if abs(clat) + angle < 90.0:
+            # widest longitude range of a circle around the center
+            sinlon = np.sin(np.radians(angle)) / np.cos(np.radians(clat))
+            if sinlon < 1.0:
+                maxlon = np.degrees(np.arcsin(sinlon)) + INDEX_MARGIN
+                dlon = np.abs((lons - clon + 180.0) % 360.0 - 180.0)
+                inlon = dlon <= maxlon
+                lats = lats[inlon]
+                lons = lons[inlon]
+                order = order[inlon]
+        distances = geodetic_distance(clon, clat, lons, lats)
+        iclose = distances < radius
+        positions = order[iclose]
+        distances = distances[iclose]
+        isort = np.argsort(positions)
+        return (positions[isort], distances[isort])
+
+    def getBoundsPositions(self, xmin, xmax, ymin, ymax):
+        """Find the events inside a bounding box.
+
+        :param xmin:
+          Minimum longitude.
+        :param xmax:
+          Maximum longitude.
+        :param ymin:
+          Minimum latitude.
+        :param ymax:
+          Maximum latitude.
+        :returns:
+          Sorted array of positions of events where xmin < lon <= xmax and ymin < lat <= ymax.
+        """
+        band = self._getLatitudeBand(ymin, ymax)
+        lons = self._lons[band]
+        positions = self._order[band][(lons > xmin) & (lons <= xmax)]
+        return np.sort(positions)
+
+
+class AnalogueIndex(object):
+    def __init__(self, deaths, maxmmi, nmaxmmi):
+        """Create an index of events for finding historical analogues of target events.
+
+        Events are ranked from worst to least bad (by shaking deaths, MaxMMI and number of people
+        exposed at MaxMMI), and within each MaxMMI level they are sorted by shaking deaths, so the
+        event with the fewest deaths above a given number is found with a binary search.
+
+        :param deaths:
+          Array of shaking deaths of events (NaN where unknown).
+        :param maxmmi:
+          Array of MaxMMI values of events.
+        :param nmaxmmi:
+          Array of number of people exposed at MaxMMI.
+        """
+        deaths = np.asarray(deaths, dtype=np.float64)
+        maxmmi = np.asarray(maxmmi)
+        nmaxmmi = np.asarray(nmaxmmi, dtype=np.float64)
+        # same order as sorting a dataframe by these columns, with NaN deaths last
+        self._worst = np.lexsort((-nmaxmmi, -maxmmi, -deaths))
+        self._least = np.lexsort((nmaxmmi, maxmmi, deaths))
+        rank = np.empty(len(deaths), dtype=np.int64)
+        rank[self._worst] = np.arange(len(deaths))
+        self._buckets = {}
+        for mmi in np.unique(maxmmi):
+            members = np.nonzero(maxmmi == mmi)[0]
+            members = members[np.lexsort((rank[members], deaths[members]))]
+            self._buckets[mmi] = (members, deaths[members])
+
+    def __len__(self):
+        """Return the number of events in the index.
+
+        :returns:
+          Number of events in the index.
+        """
+        return len(self._worst)
+
+    def _findSimilar(self, maxmmi, ndeaths, starts, go_down, excluded):
+        # events at each MaxMMI level (going down then up, or up then down) with more than ndeaths,
+        # preferring the fewest deaths
+        if go_down:
+            levels = list(range(maxmmi, 0, -1)) + list(range(maxmmi, 10))
+            fallback = self._least
+        else:
+            levels = list(range(maxmmi, 10)) + list(range(maxmmi, 0, -1))
+            fallback = self._worst
+        for mmi in levels:
+            if mmi not in self._buckets:
+                continue
+            members, deaths = self._buckets[mmi]
+            i = starts[mmi]
+            while i < len(members) and deaths[i] > ndeaths:
+                if members[i] not in excluded:
+                    return members[i]
+                i += 1
+        for position in fallback:
+            if position not in excluded:
+                return position
+        return -1
+
+    def getAnalogues(self, maxmmi, ndeaths):
+        """Find the historical analogues of one or more target events.
+
+        :param maxmmi:
+          Integer, or array of integers, MMI level of maximum exposure of target events.
+        :param ndeaths:
+          Number, or array of numbers, of estimated people killed from shaking in target events.
+        :returns:
+          Integer array (one row per target event) of positions of the similar but less bad event,
+          the similar but worse event and the worst event (see ExpoCat.getHistoricalEvents()), -1 where
+          there is no such event.
+        """
+        maxmmi = np.atleast_1d(maxmmi)
+        ndeaths = np.atleast_1d(np.asarray(ndeaths, dtype=np.float64))
+        nevents = len(self)
+        analogues = np.full((len(maxmmi), 3), -1, dtype=np.int64)
+        if not nevents:
+            return analogues
+        worst = self._worst[0]
+        analogues[:, 2] = worst
+        # first event in each MaxMMI level with more deaths than each target
+        starts = {}
+        for mmi, (members, deaths) in self._buckets.items():
+            starts[mmi] = np.searchsorted(deaths, ndeaths, side="right")
+        for i in range(len(maxmmi)):
+            tstarts = {mmi: mstarts[i] for mmi, mstarts in starts.items()}
+            excluded = [worst]
+            if nevents > 1:
+                analogues[i, 0] = self._findSimilar(maxmmi[i], ndeaths[i], tstarts, True, excluded)
+                excluded.append(analogues[i, 0])
+            if nevents > 2:
+                analogues[i, 1] = self._findSimilar(maxmmi[i], ndeaths[i], tstarts, False, excluded)
+        return analogues
+
+
+class ExpoCatQuery(object):
+    def __init__(self, expocat, predicates=None, circles=None):
+        """Create a query selecting events from an ExpoCat object.
+
+        The by*() methods return a new query with an added predicate, without touching the
+        catalog data.  All predicates are evaluated together, as one boolean mask over the
+        catalog columns, the first time the results are requested, and the selected events
+        are only copied out of the catalog by getExpoCat() and getDataFrame().
+
+        :param expocat:
+          ExpoCat object.
+        :param predicates:
+          List of functions taking an ExpoCat object and returning a boolean array with one value per event.
+        :param circles:
+          List of (clat, clon, radius) search circles.
+        """
+        self._expocat = expocat
+        self._predicates = predicates if predicates is not None else []
+        self._circles = circles if circles is not None else []
+        self._positions = None
+        self._distances = None
+
+    def _addPredicate(self, predicate):
+        return ExpoCatQuery(self._expocat, self._predicates + [predicate], self._circles)
+
+    def byHazard(self, hazard):
+        """Restrict to events with input hazard.
+
+        :param hazard:
+          String, one of 'fire','liquefaction','landslide', or 'tsunami'.
+        :raises:
+           PagerException when input hazard does not match one of the four accepted types.
+        :returns:
+          New ExpoCatQuery object.
+        """
+        haztypes = ["fire", "liquefaction", "landslide", "tsunami"]
+        if hazard not in haztypes:
+            raise PagerException(
+                "Input hazard %s not one of accepted hazard types: %s"
+                % (hazard, str(haztypes))
+            )
+        colname = hazard.capitalize()
+        return self._addPredicate(lambda expocat: expocat._getColumn(colname) == 1)
+
+    def byTime(self, mintime, maxtime):
+        """Restrict to events between two input times.
+
+        :param mintime:
+          Pandas Timestamp object OR Python datetime object.
+        :param maxtime:
+          Pandas Timestamp object OR Python datetime object.
+        :raises:
+           PagerException when mintime is not less than maxtime.
+        :returns:
+          New ExpoCatQuery object.
+        """
+        if mintime >= maxtime:
+            raise PagerException("Input mintime must be less than maxtime.")
+        mintime = pd.Timestamp(mintime).to_datetime64()
+        maxtime = pd.Timestamp(maxtime).to_datetime64()
+
+        def predicate(expocat):
+            times = expocat._getColumn("Time")
+            return (times > mintime) & (times <= maxtime)
+
+        return self._addPredicate(predicate)
+
+    def byMagnitude(self, minmag, maxmag=None):
+        """Restrict to events between two input magnitudes.
+
+        :param minmag:
+          Float earthquake minimum magnitude.
+        :param maxmag:
+          Float earthquake maximum magnitude.
+        :returns:
+          New ExpoCatQuery object.
+        """
+
+        def predicate(expocat):
+            mags = expocat._getColumn("Magnitude")
+            if maxmag is not None:
+                return (mags > minmag) & (mags <= maxmag)
+            return mags > minmag
+
+        return self._addPredicate(predicate)
+
+    def byBounds(self, xmin, xmax, ymin, ymax):
+        """Restrict to events inside bounding box.
+
+        :param xmin:
+          Minimum longitude.
+        :param xmax:
+          Maximum longitude.
+        :param ymin:
+          Minimum latitude.
+        :param ymax:
+          Maximum latitude.
+        :returns:
+          New ExpoCatQuery object.
+        """
+
+        def predicate(expocat):
+            positions = expocat.getSpatialIndex().getBoundsPositions(xmin, xmax, ymin, ymax)
+            inbounds = np.zeros(len(expocat), dtype=bool)
+            inbounds[positions] = True
+            return inbounds
+
+        return self._addPredicate(predicate)
+
+    def byShakingDeaths(self, mindeaths):
+        """Restrict to events with at least mindeaths shaking fatalities.
+
+        :param mindeaths:
+          Minimum shaking fatality threshold.
+        :returns:
+          New ExpoCatQuery object.
+        """
+        return self._addPredicate(
+            lambda expocat: expocat._getColumn("ShakingDeaths") >= mindeaths
+        )
+
+    def byRadius(self, clat, clon, radius):
+        """Restrict to events within a search radius around a set of coordinates.
+
+        The results will include a Distance column, with the distance (km) of each event
+        from the center of the last search circle.
+
+        :param clat:
+          Latitude of search center.
+        :param clon:
+          Longitude of search center.
+        :param radius:
+          Search radius (km).
+        :returns:
+          New ExpoCatQuery object.
+        """
+        return ExpoCatQuery(
+            self._expocat, self._predicates, self._circles + [(clat, clon, radius)]
+        )
+
+    def _evaluate(self):
+        if self._positions is not None:
+            return
+        nevents = len(self._expocat)
+        mask = np.ones(nevents, dtype=bool)
+        for predicate in self._predicates:
+            mask &= predicate(self._expocat)
+        distances = None
+        for clat, clon, radius in self._circles:
+            index = self._expocat.getSpatialIndex()
+            positions, pdistances = index.getRadiusPositions(clat, clon, radius)
+            inradius = np.zeros(nevents, dtype=bool)
+            inradius[positions] = True
+            mask &= inradius
+            distances = np.full(nevents, np.nan)
+            distances[positions] = pdistances
+        self._positions = np.nonzero(mask)[0]
+        if distances is not None:
+            self._distances = distances[self._positions]
+
+    def __len__(self):
+        """Return the number of events selected by this query.
+
+        :returns:
+          Number of selected events.
+        """
+        self._evaluate()
+        return len(self._positions)
+
+    def getPositions(self):
+        """Return the positions (row numbers) of the selected events in the catalog.
+
+        :returns:
+          Sorted array of integer positions.
+        """
+        self._evaluate()
+        return self._positions
+
+    def getDistances(self):
+        """Return the distances of the selected events from the search center.
+
+        :returns:
+          Array of distances (km), one per selected event, or None if the query has no search radius.
+        """
+        self._evaluate()
+        return self._distances
+
+    def getDataFrame(self):
+        """Return a dataframe containing the selected events.
+
+        :returns:
+          Dataframe with the catalog columns (and Distance, if the query has a search radius).
+        """
+        self._evaluate()
+        newdf = self._expocat._dataframe.iloc[self._positions]
+        if self._distances is not None:
+            newdf = newdf.assign(Distance=self._distances)
+        else:
+            newdf = newdf.copy()
+        return newdf
+
+    def getExpoCat(self):
+        """Return a new ExpoCat object containing the selected events.
+
+        :returns:
+          ExpoCat object.
+        """
+        return ExpoCat(self.getDataFrame(), copy=False)
+
+
 class ExpoCat(object):
-    def __init__(self, dataframe):
+    def __init__(self, dataframe, spatial_index=None, copy=True):
         """Create an ExpoCat object from a dataframe input.
 
         :param dataframe:
@@ -93,19 +500,38 @@ class ExpoCat(object):
             - MMI9+ Number of people exposed to Mercalli intensity 9 and above.
             - MaxMMI  Highest intensity level with at least 1000 people exposed.
             - NumMaxMMI Number of people exposed at MaxMMI.
+        :param spatial_index:
+          SpatialIndex object built from the Lat/Lon columns of dataframe, or None (the index
+          will be built when first needed).
+        :param copy:
+          If False, use dataframe without copying it (it must not be modified afterwards).
         """
-        self._dataframe = dataframe.copy()
+        if copy:
+            dataframe = dataframe.copy()
+        self._dataframe = dataframe
+        self._spatial_index = spatial_index
+        self._analogue_index = None
+        self._columns = {}
 
     @classmethod
     def fromDefault(cls):
         """Read in data from Excel file included in the distribution of this code.
 
+        The spreadsheet (and the spatial index of its events) is only loaded once per process,
+        and is shared by the ExpoCat objects returned by each call.
+
         :returns:
           ExpoCat object.
         """
-        homedir = os.path.dirname(os.path.abspath(__file__))  # where is this module?
-        excelfile = os.path.join(homedir, "..", "data", "expocat.xlsx")
-        return cls.fromExcel(excelfile)
+        global _DEFAULT_DATAFRAME, _DEFAULT_INDEX
+        with _DEFAULT_DATAFRAME_LOCK:
+            if _DEFAULT_DATAFRAME is None:
+                homedir = os.path.dirname(os.path.abspath(__file__))  # where is this module?
+                excelfile = os.path.join(homedir, "..", "data", "expocat.xlsx")
+                expocat = cls.fromExcel(excelfile)
+                _DEFAULT_INDEX = expocat.getSpatialIndex()
+                _DEFAULT_DATAFRAME = expocat._dataframe
+        return cls(_DEFAULT_DATAFRAME, spatial_index=_DEFAULT_INDEX, copy=False)
 
     @classmethod
     def fromExcel(cls, excelfile):
@@ -116,7 +542,7 @@ class ExpoCat(object):
         :returns:
           ExpoCat object.
         """
-        df = pd.read_excel(excelfile, converters={"EventID": str})
+        df = read_excel_cached(excelfile, converters={"EventID": str})
 
         # df = df.drop('Unnamed: 0',1)
 
@@ -237,7 +663,7 @@ class ExpoCat(object):
           An ExpoCat object consisting of events from this ExpoCat object and those from other.
         """
         newdf = pd.concat([self._dataframe, other._dataframe]).drop_duplicates()
-        return ExpoCat(newdf)
+        return ExpoCat(newdf, copy=False)
 
     def excludeFutureEvents(self, event_time):
         """Exclude events after given event_time from further searches.
@@ -248,6 +674,41 @@ class ExpoCat(object):
           datetime object representing most recent time desired for searches from within this object.
         """
         self._dataframe = self._dataframe[(self._dataframe["Time"] < event_time)]
+        self._spatial_index = None
+        self._analogue_index = None
+        self._columns = {}
+
+    def _getColumn(self, name):
+        # numpy array of a dataframe column, for evaluating queries
+        if name not in self._columns:
+            self._columns[name] = self._dataframe[name].values
+        return self._columns[name]
+
+    def getSpatialIndex(self):
+        """Return the spatial index of the events in this ExpoCat object, building it if necessary.
+
+        :returns:
+          SpatialIndex object.
+        """
+        if self._spatial_index is None:
+            self._spatial_index = SpatialIndex(
+                self._dataframe["Lat"].values, self._dataframe["Lon"].values
+            )
+        return self._spatial_index
+
+    def getAnalogueIndex(self):
+        """Return the index used to find historical analogues of events, building it if necessary.
+
+        :returns:
+          AnalogueIndex object.
+        """
+        if self._analogue_index is None:
+            self._analogue_index = AnalogueIndex(
+                self._dataframe["ShakingDeaths"].values,
+                self._dataframe["MaxMMI"].values,
+                self._dataframe["NumMaxMMI"].values,
+            )
+        return self._analogue_index
 
     def getDataFrame(self):
         """Return a copy of the dataframe contained in this ExpoCat object.
@@ -257,27 +718,25 @@ class ExpoCat(object):
         """
         return self._dataframe.copy()
 
+    def query(self):
+        """Start a query on the events in this ExpoCat object.
+
+        :returns:
+          ExpoCatQuery object selecting all events, to be refined with its by*() methods.
+        """
+        return ExpoCatQuery(self)
+
     def selectByHazard(self, hazard):
         """Select down the events in the ExpoCat by restricting to events with input hazard.
 
         :param hazard:
           String, one of 'fire','liquefaction','landslide', or 'tsunami'.
-        :returns:
-          List consisting of zero or more of the above hazard strings.
         :raises:
            PagerException when input hazard does not match one of the four accepted types.
         :returns:
           New instance of ExpoCat.
         """
-        haztypes = ["fire", "liquefaction", "landslide", "tsunami"]
-        if hazard not in haztypes:
-            raise PagerException(
-                "Input hazard %s not one of accepted hazard types: %s"
-                % (hazard, str(haztypes))
-            )
-        colname = hazard.capitalize()
-        newdf = self._dataframe[self._dataframe[colname] == 1]
-        return ExpoCat(newdf)
+        return self.query().byHazard(hazard).getExpoCat()
 
     def selectByTime(self, mintime, maxtime):
         """Select down the events in the ExpoCat by restricting to events between two input times.
@@ -289,13 +748,7 @@ class ExpoCat(object):
         :returns:
           Reduced ExpoCat set of events to those inside the input time bounds.
         """
-        if mintime >= maxtime:
-            raise PagerException("Input mintime must be less than maxtime.")
-
-        newdf = self._dataframe[
-            (self._dataframe["Time"] > mintime) & (self._dataframe["Time"] <= maxtime)
-        ]
-        return ExpoCat(newdf)
+        return self.query().byTime(mintime, maxtime).getExpoCat()
 
     def selectByMagnitude(self, minmag, maxmag=None):
         """Select down the events in the ExpoCat by restricting to events between two input magnitudes.
@@ -307,14 +760,7 @@ class ExpoCat(object):
         :returns:
           Reduced ExpoCat set of events to those inside the input magnitude bounds.
         """
-        if maxmag is not None:
-            newdf = self._dataframe[
-                (self._dataframe["Magnitude"] > minmag)
-                & (self._dataframe["Magnitude"] <= maxmag)
-            ]
-        else:
-            newdf = self._dataframe[(self._dataframe["Magnitude"] > minmag)]
-        return ExpoCat(newdf)
+        return self.query().byMagnitude(minmag, maxmag=maxmag).getExpoCat()
 
     def selectByBounds(self, xmin, xmax, ymin, ymax):
         """Select down the events in the ExpoCat by restricting to events inside bounding box.
@@ -330,12 +776,7 @@ class ExpoCat(object):
         :returns:
           Reduced ExpoCat set of events to those inside bounding box.
         """
-        idx1 = self._dataframe["Lat"] > ymin
-        idx2 = self._dataframe["Lat"] <= ymax
-        idx3 = self._dataframe["Lon"] > xmin
-        idx4 = self._dataframe["Lon"] <= xmax
-        newdf = self._dataframe[idx1 & idx2 & idx3 & idx4]
-        return ExpoCat(newdf)
+        return self.query().byBounds(xmin, xmax, ymin, ymax).getExpoCat()
 
     def selectByShakingDeaths(self, mindeaths):
         """Select down the events in the ExpoCat by restricting to events with shaking deaths greater than input.
@@ -345,19 +786,21 @@ class ExpoCat(object):
         :returns:
           Reduced ExpoCat set of events to those with shaking fatalities greater than mindeaths.
         """
-        newdf = self._dataframe[self._dataframe["ShakingDeaths"] >= mindeaths]
-        return ExpoCat(newdf)
+        return self.query().byShakingDeaths(mindeaths).getExpoCat()
 
     def selectByRadius(self, clat, clon, radius):
-        """Select events by restricting to those within a search radius around a set of coordinates."""
-        lons = self._dataframe["Lon"]
-        lats = self._dataframe["Lat"]
-        distances = geodetic_distance(clon, clat, lons, lats)
-        iclose = pd.Series(distances < radius)
-        newdf = self._dataframe[iclose]
-        d1 = distances[distances < radius]
-        newdf = newdf.assign(Distance=d1)
-        return ExpoCat(newdf)
+        """Select events by restricting to those within a search radius around a set of coordinates.
+
+        :param clat:
+          Latitude of search center.
+        :param clon:
+          Longitude of search center.
+        :param radius:
+          Search radius (km).
+        :returns:
+          Reduced ExpoCat set of events to those within radius, with an added Distance (km) column.
+        """
+        return self.query().byRadius(clat, clon, radius).getExpoCat()
 
     def getHistoricalEvents(self, maxmmi, nmmi, ndeaths, clat, clon):
         """Select three earthquakes from internal list that are "representative" and similar to input event.
@@ -406,52 +849,38 @@ class ExpoCat(object):
             - Distance Distance of this event from input event, in km.
             - Color The hex color that should be used for row color in historical events table.
         """
-        # get the worst event first
-        newdf = self._dataframe.sort_values(
-            ["ShakingDeaths", "MaxMMI", "NumMaxMMI"], ascending=False
-        )
-        if not len(newdf):
-            return [None, None, None]
-        worst = newdf.iloc[0]
-        # get rid of that first row, so we don't re-include the same event
-        newdf = newdf.drop(newdf.index[[0]])
-        if not len(newdf):
-            less_bad = None
-        else:  # get the similar but less bad event
-            less_bad, newdf = self.getSimilarEvent(
-                newdf, maxmmi, nmmi, ndeaths, go_down=True
-            )
+        return self.getHistoricalEventsBatch([maxmmi], [ndeaths])[0]
 
-        if not len(newdf):
-            more_bad = None
-        else:  # get the similar but worse event
-            more_bad, newdf = self.getSimilarEvent(
-                newdf, maxmmi, nmmi, ndeaths, go_down=False
-            )
+    def getHistoricalEventsBatch(self, maxmmi, ndeaths):
+        """Select the "representative" historical earthquakes (see getHistoricalEvents) for many target events.
 
-        events = []
+        :param maxmmi:
+          Sequence of MMI levels of maximum exposure of target events.
+        :param ndeaths:
+          Sequence of estimated number of people killed from shaking in target events.
+        :returns:
+          List (one per target event) of lists of dictionaries, as returned by getHistoricalEvents().
+        """
+        if not len(self._dataframe):
+            return [[None, None, None] for mmi in maxmmi]
+        analogues = self.getAnalogueIndex().getAnalogues(maxmmi, ndeaths)
         colormap = ColorPalette.fromPreset("mmi")
-        if less_bad is not None:
-            lessdict = to_ordered_dict(less_bad)
-            rgbval = colormap.getDataColor(lessdict["MaxMMI"])
-            rgb255 = tuple([int(c * 255) for c in rgbval])[0:3]
-            lessdict["Color"] = "#%02x%02x%02x" % rgb255
-            events.append(lessdict)
-
-        if more_bad is not None:
-            moredict = to_ordered_dict(more_bad)
-            rgbval = colormap.getDataColor(moredict["MaxMMI"])
-            rgb255 = tuple([int(c * 255) for c in rgbval])[0:3]
-            moredict["Color"] = "#%02x%02x%02x" % rgb255
-            events.append(moredict)
-
-        worstdict = to_ordered_dict(worst)
-        rgbval = colormap.getDataColor(worstdict["MaxMMI"])
-        rgb255 = tuple([int(c * 255) for c in rgbval])[0:3]
-        worstdict["Color"] = "#%02x%02x%02x" % rgb255
-        events.append(worstdict)
-
-        return events
+        eventdicts = {}
+        eventlists = []
+        for row in analogues:
+            events = []
+            for position in row:
+                if position < 0:
+                    continue
+                if position not in eventdicts:
+                    eventdict = to_ordered_dict(self._dataframe.iloc[position])
+                    rgbval = colormap.getDataColor(eventdict["MaxMMI"])
+                    rgb255 = tuple([int(c * 255) for c in rgbval])[0:3]
+                    eventdict["Color"] = "#%02x%02x%02x" % rgb255
+                    eventdicts[position] = eventdict
+                events.append(eventdicts[position].copy())
+            eventlists.append(events)
+        return eventlists
 
     def getSimilarEvent(self, df, maxmmi, nmmi, ndeaths, go_down=True):
         # Algorithm description: if go_down == True
@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+
+# stdlib imports
+import os.path
+import json
+import hashlib
+import shutil
+import tempfile
+import threading
+
+# third party imports
+import numpy as np
+from mapio.grid2d import Grid2D
+from mapio.geodict import GeoDict
+from mapio.reader import read, get_file_geodict
+
+# local imports
+from losspager.utils.datacache import get_cache_folder
+
+# name of the folder (inside the cache folder) where grid stores are kept
+STORE_FOLDER = 'gridstore'
+
+# name of the sidecar file containing the geodict of a grid store
+GEODICT_FILE = 'geodict.json'
+
+# process-wide dictionary of open GridStore objects, keyed on population file name
+_STORES = {}
+_STORES_LOCK = threading.Lock()
+
+
+def get_file_key(filename):
+    """Return a key identifying a particular version of a (possibly very large) file.
+
+    Unlike get_file_hash(), this does not read the file, it only uses its name, size and
+    modification time.
+
+    :param filename:
+      Path to any file.
+    :returns:
+      SHA1 hex digest of the absolute file name, size and modification time.
+    """
+    stat = os.stat(filename)
+    key = '%s:%i:%i' % (os.path.abspath(filename), stat.st_size, stat.st_mtime_ns)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def get_store_folder(popfile):
+    """Return the folder where the grid store for a population grid is kept.
+
+    :param popfile:
+      Any GMT or ESRI style grid file supported by MapIO, containing population data.
+    :returns:
+      Path to grid store folder (which may not exist).
+    """
+    fbase, fext = os.path.splitext(os.path.basename(popfile))
+    foldername = '%s_%s' % (fbase, get_file_key(popfile))
+    return os.path.join(get_cache_folder(), STORE_FOLDER, foldername)
+
+
+def get_grid_store(popfile):
+    """Return the process-wide GridStore for a population grid, if one has been created.
+
+    :param popfile:
+      Any GMT or ESRI style grid file supported by MapIO, containing population data.
+    :returns:
+      GridStore object, or None if no store exists for the current version of popfile.
+    """
+    store_folder = get_store_folder(popfile)
+    with _STORES_LOCK:
+        store = _STORES.get(popfile)
+        if store is None or store.getFolder() != store_folder:
+            store = None
+            if os.path.isfile(os.path.join(store_folder, GEODICT_FILE)):
+                store = GridStore(store_folder)
+                _STORES[popfile] = store
+    return store
+
+
+def _save_array(data, filename):
+    # write to a temporary file and rename it, so other processes never see a partial file
+    folder = os.path.dirname(filename)
+    handle, tmpfile = tempfile.mkstemp(dir=folder, suffix='.npy')
+    os.close(handle)
+    try:
+        np.save(tmpfile, data)
+        os.replace(tmpfile, filename)
+    finally:
+        if os.path.isfile(tmpfile):
+            os.remove(tmpfile)
+
+
+class GridStore(object):
+    def __init__(self, folder):
+        """Open a grid store, containing a global population grid and other grids aligned with it.
+
+        Grids are stored as uncompressed numpy (.npy) files, which are memory mapped rather than
+        read, so extracting the window covering a ShakeMap is a slice of the mapped array.
+
+        :param folder:
+          Grid store folder, as created by GridStore.create().
+        """
+        self._folder = folder
+        with open(os.path.join(folder, GEODICT_FILE), 'rt') as f:
+            self._geodict = GeoDict(json.load(f))
+        self._grids = {}
+
+    @classmethod
+    def create(cls, popfile, isofile=None, urbanfile=None):
+        """Create (or add to) the grid store for a population grid.
+
+        The country code and urban/rural grids are resampled (nearest neighbor) onto the
+        population grid before being stored, so windows from all grids in the store are
+        aligned with each other.
+
+        NB: This reads entire global grids into memory, and is intended to be run once
+        whenever the global data files change, not while processing events.
+
+        :param popfile:
+          Any GMT or ESRI style grid file supported by MapIO, containing population data.
+        :param isofile:
+          Optional grid file containing country code data (ISO 3166-1 numeric).
+        :param urbanfile:
+          Optional grid file containing urban/rural data (rural cells indicated with a 1, urban cells with a 2).
+        :returns:
+          GridStore object.
+        """
+        folder = get_store_folder(popfile)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        popgrid = read(popfile)
+        popdict = popgrid.getGeoDict()
+        _save_array(popgrid.getData(), os.path.join(folder, cls._getGridName(popfile)))
+        del popgrid
+        for gridfile, padvalue in [(isofile, 0), (urbanfile, 1)]:
+            if gridfile is None:
+                continue
+            if get_file_geodict(gridfile) == popdict:
+                grid = read(gridfile)
+            else:
+                grid = read(gridfile, samplegeodict=popdict, resample=True,
+                            method='nearest', doPadding=True, padValue=padvalue)
+            _save_array(grid.getData(), os.path.join(folder, cls._getGridName(gridfile)))
+            del grid
+
+        # the geodict file is written last, and marks the store as complete
+        handle, tmpfile = tempfile.mkstemp(dir=folder, suffix='.json')
+        with os.fdopen(handle, 'wt') as f:
+            json.dump(popdict.asDict(), f)
+        os.replace(tmpfile, os.path.join(folder, GEODICT_FILE))
+        with _STORES_LOCK:
+            _STORES.pop(popfile, None)
+        return cls(folder)
+
+    @classmethod
+    def delete(cls, popfile):
+        """Delete the grid store for a population grid.
+
+        :param popfile:
+          Any GMT or ESRI style grid file supported by MapIO, containing population data.
+        """
+        with _STORES_LOCK:
+            _STORES.pop(popfile, None)
+        folder = get_store_folder(popfile)
+        if os.path.isdir(folder):
+            shutil.rmtree(folder)
+
+    @staticmethod
+    def _getGridName(gridfile):
+        fbase, fext = os.path.splitext(os.path.basename(gridfile))
+        return '%s_%s.npy' % (fbase, get_file_key(gridfile))
+
+    def getFolder(self):
+        """Return the folder containing the store files.
+
+        :returns:
+          Path to grid store folder.
+        """
+        return self._folder
+
+    def getGeoDict(self):
+        """Return the geodict of the (global) grids in the store.
+
+        :returns:
+          GeoDict object.
+        """
+        return self._geodict.copy()
+
+    def hasGrid(self, gridfile):
+        """Indicate whether the current version of a grid file is in the store.
+
+        :param gridfile:
+          Grid file name, as passed to create().
+        :returns:
+          True if the grid is in the store, False otherwise.
+        """
+        if not os.path.isfile(gridfile):
+            return False
+        return os.path.isfile(os.path.join(self._folder, self._getGridName(gridfile)))
+
+    def _getArray(self, gridfile):
+        gridname = self._getGridName(gridfile)
+        if gridname not in self._grids:
+            self._grids[gridname] = np.load(os.path.join(self._folder, gridname), mmap_mode='r')
+        return self._grids[gridname]
+
+    def getGrid(self, gridfile, sampledict):
+        """Return the window of a stored grid matching a geodict aligned with the store grids.
+
+        :param gridfile:
+          Grid file name, as passed to create().
+        :param sampledict:
+          GeoDict aligned with the store grids (i.e., the result of getBoundsWithin() on the population geodict).
+        :returns:
+          Grid2D object whose (read-only) data is a view into the memory mapped grid, or None if the grid is
+          not in the store or the window is not aligned with or contained by the store grids.
+        """
+        if not self.hasGrid(gridfile):
+            return None
+        gd = self._geodict
+        fcol = (sampledict.xmin - gd.xmin) / gd.dx
+        frow = (gd.ymax - sampledict.ymax) / gd.dy
+        row0 = int(round(frow))
+        col0 = int(round(fcol))
+        is_global = abs(gd.nx * gd.dx - 360.0) < gd.dx / 2.0
+        if col0 < 0 and is_global:
+            col0 += gd.nx
+        aligned = abs(frow - round(frow)) < 0.01 and abs(fcol - round(fcol)) < 0.01
+        aligned = aligned and abs(sampledict.dx - gd.dx) < gd.dx / 100.0
+        aligned = aligned and abs(sampledict.dy - gd.dy) < gd.dy / 100.0
+        if not aligned:
+            return None
+        row1 = row0 + sampledict.ny
+        col1 = col0 + sampledict.nx
+        if row0 < 0 or row1 > gd.ny or col0 < 0 or sampledict.nx > gd.nx:
+            return None
+
+        data = self._getArray(gridfile)
+        if col1 <= gd.nx:
+            window = data[row0:row1, col0:col1]
+        elif is_global:
+            # window crosses the edge of a global grid, so the columns have to be gathered
+            cols = np.arange(col0, col1) % gd.nx
+            window = data[row0:row1, :][:, cols]
+        else:
+            return None
+
+        # Grid2D copies data passed to its constructor, so set the window directly
+        grid = Grid2D()
+        grid._data = window
+        grid._geodict = sampledict.copy()
+        return grid
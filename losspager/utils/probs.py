@@ -1,5 +1,4 @@
 import numpy as np
-import math
 from scipy.special import erfc, erfcinv
 
 def phi(input):
@@ -24,6 +23,8 @@ def invphi(input):
 
 def calcEmpiricalProbFromValue(G, e, value):
     """Calculate the empirical probability of a given value of loss (fatalities, dollars).
+
+    All inputs may be scalars or arrays, and are broadcast against each other.
     
     :param G: 
       Input G statistic.
@@ -34,13 +35,15 @@ def calcEmpiricalProbFromValue(G, e, value):
     :returns: 
       Probability that value will not be exceeded.
     """
-    e = e + 0.00001
-    value = value + 0.00001
-    p = phi((math.log(value) - math.log(e))/G)
+    e = np.asarray(e) + 0.00001
+    value = np.asarray(value) + 0.00001
+    p = phi((np.log(value) - np.log(e))/G)
     return p
 
 def calcEmpiricalValueFromProb(G, e, p):
     """ Calculate the loss value given an input probability.
+
+    All inputs may be scalars or arrays, and are broadcast against each other.
     
     :param G: 
       Input G statistic.
@@ -51,12 +54,43 @@ def calcEmpiricalValueFromProb(G, e, p):
     :returns: 
       Number of losses.
     """
-    e = e + 0.00001
-    value = math.exp(G * invphi(p) + math.log(e))
+    e = np.asarray(e) + 0.00001
+    value = np.exp(G * invphi(p) + np.log(e))
     return value
 
+def _adjust_inputs(G, e):
+    """Apply the small expected loss adjustments to G and e (e must already be offset).
+    """
+    G = np.where((e < 1) & (G > 1.7), 1.7613, G)
+    return G
+
+def calcEmpiricalProbsFromBins(G, e, edges):
+    """Calculate the empirical probabilities of losses falling in each of a set of loss bins.
+
+    G and e may be scalars or arrays, and are broadcast against each other.  Each bin is treated
+    as the two-element range passed to calcEmpiricalProbFromRange().
+
+    :param G: 
+      Input G statistic(s).
+    :param e: 
+      Expected number(s) of losses.
+    :param edges: 
+      Sequence of N+1 increasing loss values, defining N bins.
+    :returns: 
+      Array of probabilities, with shape of broadcast G and e plus a last dimension of length N.
+    """
+    G = np.asarray(G, dtype=np.float64)[..., np.newaxis]
+    e = np.asarray(e, dtype=np.float64)[..., np.newaxis] + 0.00001
+    G = _adjust_inputs(G, e)
+    e = np.where(e < 0.001, 0.5, e)
+    edges = np.asarray(edges, dtype=np.float64) + 0.00001
+    cdf = phi((np.log(edges) - np.log(e))/G)
+    return np.diff(cdf, axis=-1)
+
 def calcEmpiricalProbFromRange(G, e, drange):
     """Calculate the empirical probability of a given loss range.
+
+    G and e may be scalars or arrays, and are broadcast against each other.
     
     :param G: 
       Input G statistic.
@@ -67,30 +101,13 @@ def calcEmpiricalProbFromRange(G, e, drange):
     :returns: 
       Probability that losses will occur in input range.
     """    
-    e = e + 0.00001
-    if e < 1:
-        #e = 0.1
-        if G > 1.7:
-            G = 1.7613
     if len(drange) == 2:
-        if (e-0) < 0.001:
-            e = 0.5
-        fmin = drange[0] + 0.00001
-        fmax = drange[1] + 0.00001
-        p1 = phi((math.log(fmax) - math.log(e))/G)
-        p2 = phi((math.log(fmin) - math.log(e))/G)
-        p = p1-p2
-        return p
+        p = calcEmpiricalProbsFromBins(G, e, drange)[..., 0]
+        return p[()]
     else:
-        psum = 0
-        for i in range(0, len(drange)-1):
-            fmax = drange[i+1] + 0.00001
-            fmin = drange[i] + 0.00001
-            p1 = phi((math.log(fmax) - math.log(e))/G)
-            p2 = phi((math.log(fmin) - math.log(e))/G)
-            psum += (p1-p2)
-        return psum
-
-
-    
-    
+        e = np.asarray(e, dtype=np.float64) + 0.00001
+        G = _adjust_inputs(G, e)
+        drange = np.asarray(drange, dtype=np.float64) + 0.00001
+        cdf = phi((np.log(drange) - np.log(e[..., np.newaxis]))/G[..., np.newaxis])
+        psum = np.sum(np.diff(cdf, axis=-1), axis=-1)
+        return psum[()]
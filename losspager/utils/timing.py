@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+
+# stdlib imports
+import functools
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+# name of the file (in each version folder) containing the stage timings of a PAGER run
+TIMINGS_FILE = 'timings.json'
+
+# process-wide StageTimings object
+_TIMINGS = None
+_TIMINGS_LOCK = threading.Lock()
+
+
+def get_peak_rss():
+    """Return the peak resident set size (high water mark of memory use) of this process.
+
+    :returns:
+      Peak resident set size in megabytes, or None if it cannot be determined on this platform.
+    """
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on MacOS, kilobytes everywhere else
+    if sys.platform == 'darwin':
+        return maxrss / 1024.0 / 1024.0
+    return maxrss / 1024.0
+
+
+def get_timings():
+    """Return the process-wide StageTimings object, used by the timed() decorator.
+
+    :returns:
+      StageTimings object.
+    """
+    global _TIMINGS
+    with _TIMINGS_LOCK:
+        if _TIMINGS is None:
+            _TIMINGS = StageTimings()
+    return _TIMINGS
+
+
+def timed(name):
+    """Decorator recording the timing of every call to a function in the process-wide timings.
+
+    Nothing is recorded unless the process-wide timings have been started (i.e., by pager),
+    so decorated functions can be called in loops (i.e., by batchpager) without any build up
+    of timing records.
+
+    :param name:
+      Stage name to record for the function (i.e., 'Exposure.calcExposure').
+    :returns:
+      Decorator function.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with get_timings().stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class StageTimings(object):
+    def __init__(self):
+        """Create a registry of the wall time, CPU time and peak memory use of processing stages.
+
+        Stages can be recorded from multiple threads.  CPU time is that used by the thread
+        running the stage, so concurrent stages do not count each other's CPU time.  Peak
+        memory use is the peak resident set size of the whole process at the end of the stage.
+        """
+        self._stages = []
+        self._enabled = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Remove all recorded stages, and start recording new ones."""
+        with self._lock:
+            self._stages = []
+            self._enabled = True
+
+    def stop(self):
+        """Stop recording stages.
+
+        :returns:
+          List of stage dictionaries recorded since start() was called (see getStages()).
+        """
+        with self._lock:
+            self._enabled = False
+            return list(self._stages)
+
+    def isEnabled(self):
+        """Return True if stages are being recorded.
+
+        :returns:
+          True if start() has been called (and stop() has not since).
+        """
+        return self._enabled
+
+    @contextmanager
+    def stage(self, name):
+        """Context manager measuring a processing stage.
+
+        The stage is always measured, but only recorded if start() has been called.
+
+        :param name:
+          Stage name.
+        :returns:
+          Stage dictionary (see getStages()), which is filled in when the context exits.
+        """
+        record = {'name': name,
+                  'start': time.time()}
+        cpu_start = time.thread_time()
+        wall_start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['wall_time'] = time.perf_counter() - wall_start
+            record['cpu_time'] = time.thread_time() - cpu_start
+            record['peak_rss'] = get_peak_rss()
+            if self._enabled:
+                self.addStages([record])
+
+    def addStages(self, stages):
+        """Record stages measured elsewhere (i.e., in another process).
+
+        :param stages:
+          List of stage dictionaries (see getStages()).
+        """
+        with self._lock:
+            if self._enabled:
+                self._stages.extend(stages)
+
+    def getStages(self):
+        """Return the recorded stages.
+
+        :returns:
+          List of stage dictionaries, in the order the stages finished, containing:
+            - name: Stage name.
+            - start: Start time of the stage (seconds since the epoch).
+            - wall_time: Elapsed (wall clock) time in seconds.
+            - cpu_time: CPU time in seconds used by the thread that ran the stage.
+            - peak_rss: Peak resident set size (MB) of the process that ran the stage,
+              or None if not available.
+        """
+        with self._lock:
+            return list(self._stages)
+
+    def save(self, filename):
+        """Save the recorded stages to a JSON file.
+
+        :param filename:
+          Path to output JSON file (i.e., timings.json in a version folder).
+        """
+        with open(filename, 'wt') as f:
+            json.dump(self.getStages(), f, indent=2)
+
+    @staticmethod
+    def load(filename):
+        """Load stages saved to a JSON file.
+
+        :param filename:
+          Path to JSON file written by save().
+        :returns:
+          List of stage dictionaries (see getStages()).
+        """
+        with open(filename, 'rt') as f:
+            return json.load(f)
@@ -24,6 +24,9 @@ from shapely.geometry import GeometryCollection
 from shapely.geometry import Polygon as sPolygon
 from shapely.geometry import shape as sShape
 
+# local imports
+from losspager.utils.timing import timed
+
 # define some constants
 WATERCOLOR = "#7AA1DA"
 FIGWIDTH = 7.0
@@ -269,6 +272,7 @@ def _get_open_corner(popgrid, ax, filled_corner=None, need_bottom=True):
         return urbounds, "ur"
 
 
+@timed("draw_contour")
 def draw_contour(
     shakegrid,
     popgrid,
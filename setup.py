@@ -39,5 +39,7 @@ setup(
         "bin/twopager",
         "bin/pagerall",
         "bin/batchpager",
+        "bin/pagerworker",
+        "bin/benchpager",
     ],
 )
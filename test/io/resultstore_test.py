@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+# stdlib imports
+import os.path
+import tempfile
+import shutil
+
+# third party imports
+import numpy as np
+import pandas as pd
+
+# local imports
+from losspager.io.resultstore import ResultsStore, PAGERALL_TABLE
+
+
+def test_results_store():
+    tdir = tempfile.mkdtemp()
+    try:
+        print('Testing appending and reading results store partitions...')
+        folder = os.path.join(tdir, 'store')
+        store = ResultsStore(folder, fmt='pickle')
+        frame1 = pd.DataFrame({'EventID': ['us1', 'us1', 'us2'],
+                               'CountryCode': ['US', 'Total', 'Total'],
+                               'Fatalities': [1, 1, 10]})
+        frame2 = pd.DataFrame({'EventID': ['us3'],
+                               'CountryCode': ['Total'],
+                               'Fatalities': [100]})
+        store.append(frame1)
+        store.append(frame2)
+        assert store.getTables() == [PAGERALL_TABLE]
+        assert len(store.getPartitions(PAGERALL_TABLE)) == 2
+        assert store.getRowCount() == 4
+        assert [len(frame) for frame in store.iterFrames()] == [3, 1]
+
+        dataframe = store.read()
+        assert list(dataframe.columns) == ['EventID', 'CountryCode', 'Fatalities']
+        np.testing.assert_equal(dataframe['Fatalities'].values, [1, 1, 10, 100])
+        dataframe = store.read(columns=['EventID'],
+                               where=lambda frame: frame['EventID'] != 'us1')
+        assert list(dataframe.columns) == ['EventID']
+        assert dataframe['EventID'].tolist() == ['us2', 'us3']
+        assert len(store.read(table='other')) == 0
+        print('Passed appending and reading results store partitions.')
+
+        print('Testing re-opening a results store...')
+        store = ResultsStore(folder)
+        assert store.getFormat() == 'pickle'
+        assert store.getRowCount() == 4
+        try:
+            ResultsStore(folder, fmt='parquet')
+            assert 1 == 2
+        except ValueError:
+            pass
+        try:
+            ResultsStore(os.path.join(tdir, 'other'), fmt='csv')
+            assert 1 == 2
+        except ValueError:
+            pass
+        print('Passed re-opening a results store.')
+
+        print('Testing clearing a results store table...')
+        store.append(frame2, table='other')
+        store.clear()
+        assert store.getRowCount() == 0
+        assert len(store.read()) == 0
+        assert store.getRowCount(table='other') == 1
+        store.append(frame2)
+        assert store.read()['EventID'].tolist() == ['us3']
+        print('Passed clearing a results store table.')
+    finally:
+        shutil.rmtree(tdir)
+
+
+if __name__ == '__main__':
+    test_results_store()
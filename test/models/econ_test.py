@@ -2,14 +2,28 @@
 
 # stdlib imports
 import os.path
+import tempfile
+from datetime import datetime
+from collections import OrderedDict
 
 # third party imports
 import numpy as np
 import fiona
+from mapio.geodict import GeoDict
+from mapio.writer import write
+from mapio.grid2d import Grid2D
+from mapio.shake import ShakeGrid
 
 # local imports
 from losspager.models.emploss import EmpiricalLoss, LognormalModel
 from losspager.models.econexposure import EconExposure
+from losspager.models.exposure import Exposure
+
+
+def get_temp_file_name():
+    foo, tmpfile = tempfile.mkstemp()
+    os.close(foo)
+    return tmpfile
 
 
 def test():
@@ -109,5 +123,72 @@ def test():
     print('Passed assigning economic losses to polygons...')
 
 
+def test_econ_from_exposure():
+    print('Testing economic exposure from existing exposure results...')
+    mmidata = np.linspace(5.0, 10.0, 25, dtype=np.float32).reshape((5, 5))
+    popdata = np.arange(1, 26, dtype=np.float32).reshape((5, 5)) * 1e4
+    isodata = np.array([[4, 4, 4, 4, 4],
+                        [4, 4, 4, 4, 4],
+                        [4, 4, 156, 156, 156],
+                        [156, 156, 156, 156, 156],
+                        [156, 156, 156, 156, 156]], dtype=np.int32)
+    geodict = GeoDict({'xmin': 0.5, 'xmax': 4.5, 'ymin': 0.5,
+                       'ymax': 4.5, 'dx': 1.0, 'dy': 1.0, 'nx': 5, 'ny': 5})
+    layers = OrderedDict([('mmi', mmidata), ])
+    event_dict = {'event_id': 'us12345678', 'magnitude': 7.8,
+                  'depth': 10.0, 'lat': 2.5, 'lon': 2.5,
+                  'event_timestamp': datetime(2016, 1, 1, 12, 0, 0),
+                  'event_description': 'foo',
+                  'event_network': 'us'}
+    shake_dict = {'event_id': 'us12345678', 'shakemap_id': 'us12345678', 'shakemap_version': 1,
+                  'code_version': '4.5', 'process_timestamp': datetime.utcnow(),
+                  'shakemap_originator': 'us', 'map_status': 'RELEASED', 'shakemap_event_type': 'ACTUAL'}
+    unc_dict = {'mmi': (1, 1)}
+    shakefile = get_temp_file_name()
+    popfile = get_temp_file_name()
+    isofile = get_temp_file_name()
+    try:
+        ShakeGrid(layers, geodict.copy(), event_dict, shake_dict, unc_dict).save(shakefile)
+        write(Grid2D(popdata, geodict.copy()), popfile, 'netcdf')
+        write(Grid2D(isodata, geodict.copy()), isofile, 'netcdf')
+
+        econexp = EconExposure(popfile, 2012, isofile)
+        econdict = econexp.calcExposure(shakefile)
+        expomodel = Exposure(popfile, 2012, isofile)
+        exposure = expomodel.calcExposure(shakefile)
+        fromexp = EconExposure.fromExposure(expomodel)
+        fromdict = fromexp.calcEconExposure(exposure)
+        assert sorted(fromdict.keys()) == ['AF', 'CN', 'TotalEconomicExposure']
+        for key, value in econdict.items():
+            np.testing.assert_equal(fromdict[key], value)
+        np.testing.assert_equal(fromexp.getEconPopulationGrid().getData(),
+                                econexp.getEconPopulationGrid().getData())
+
+        # same grid as multiplying the cells of each country in turn
+        eventyear = event_dict['event_timestamp'].year
+        cmpdata = fromexp.getPopulationGrid().getData().copy()
+        for ccode, isocode in [('AF', 4), ('CN', 156)]:
+            gdp, outccode = fromexp._gdp.getGDP(ccode, eventyear)
+            alpha = fromexp._emploss.getModel(ccode).alpha
+            cidx = isodata == isocode
+            cmpdata[cidx] = cmpdata[cidx] * gdp * alpha
+        np.testing.assert_equal(fromexp.getEconPopulationGrid().getData(), cmpdata)
+
+        # population is multiplied by GDP and alpha in each country
+        popgrid = fromexp.getPopulationGrid().getData()
+        econgrid = fromexp.getEconPopulationGrid().getData()
+        ratios = econgrid / popgrid
+        for ccode, isocode in [('AF', 4), ('CN', 156)]:
+            cratios = ratios[isodata == isocode]
+            np.testing.assert_allclose(cratios, cratios[0], rtol=1e-6)
+            factor = np.nansum(fromdict[ccode]) / np.nansum(exposure[ccode])
+            np.testing.assert_allclose(cratios[0], factor, rtol=1e-6)
+    finally:
+        for tfile in [shakefile, popfile, isofile]:
+            os.remove(tfile)
+    print('Passed economic exposure from existing exposure results.')
+
+
 if __name__ == '__main__':
     test()
+    test_econ_from_exposure()
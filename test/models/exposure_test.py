@@ -4,13 +4,21 @@
 import urllib.request as request
 import tempfile
 import os.path
+import shutil
 import sys
+from collections import OrderedDict
+from datetime import datetime
 
 # third party imports
 import numpy as np
+from mapio.geodict import GeoDict
+from mapio.grid2d import Grid2D
+from mapio.shake import ShakeGrid
+from mapio.writer import write
 
 # local imports
-from losspager.models.exposure import Exposure, calc_exposure
+from losspager.models.exposure import (Exposure, calc_exposure, calc_exposure_matrix,
+                                       get_mmi_bins, update_exposure_matrix)
 from losspager.models.growth import PopulationGrowth
 
 
@@ -38,6 +46,128 @@ def basic_test():
     print('Passed very basic exposure calculation...')
 
 
+def test_calc_exposure_matrix():
+    print('Testing single-pass exposure matrix calculation...')
+    # values on the bin edges belong to the upper bin, values outside 0.5-10.5 are ignored
+    mmidata = np.array([[0.4, 0.5, 1.49, 1.5],
+                        [5.5, 6.0, 10.49, 10.5]])
+    popdata = np.array([[1, 2, 4, 8],
+                        [16, 32, 64, np.nan]])
+    isodata = np.array([[4, 4, 4, 4],
+                        [156, 156, 156, np.nan]])
+    ccodes, expmatrix = calc_exposure_matrix(mmidata, popdata, isodata)
+    np.testing.assert_equal(ccodes, [4, 156])
+    np.testing.assert_almost_equal(expmatrix[0], [6, 8, 0, 0, 0, 0, 0, 0, 0, 0])
+    np.testing.assert_almost_equal(expmatrix[1], [0, 0, 0, 0, 0, 48, 0, 0, 0, 64])
+    expdict = calc_exposure(mmidata, popdata, isodata)
+    assert sorted(expdict.keys()) == [4, 156]
+    np.testing.assert_almost_equal(expdict[156], expmatrix[1])
+    print('Passed single-pass exposure matrix calculation.')
+
+
+def test_update_exposure_matrix():
+    print('Testing updating exposure from changed cells...')
+    np.random.seed(1234)
+    shape = (50, 60)
+    popdata = np.round(np.random.uniform(0, 1e4, size=shape))
+    isodata = np.random.choice([4, 156, 356], size=shape).astype(np.float64)
+    isodata[0, :5] = np.nan
+    oldmmi = np.random.uniform(0, 11, size=shape)
+    newmmi = oldmmi.copy()
+    newmmi[10:20, 10:30] += 1.3
+    ccodes, oldmatrix = calc_exposure_matrix(oldmmi, popdata, isodata)
+    newmatrix, nchanged = update_exposure_matrix(ccodes, oldmatrix, get_mmi_bins(oldmmi),
+                                                 get_mmi_bins(newmmi), popdata, isodata)
+    assert nchanged > 0 and nchanged <= 200
+    testcodes, testmatrix = calc_exposure_matrix(newmmi, popdata, isodata)
+    np.testing.assert_equal(ccodes, testcodes)
+    np.testing.assert_equal(newmatrix, testmatrix)
+    print('Passed updating exposure from changed cells.')
+
+
+def make_shakefile(shakefile, mmidata, geodict):
+    # write a ShakeMap grid.xml file with MMI data on the given grid
+    event_dict = {'event_id': 'us12345678', 'magnitude': 7.8,
+                  'depth': 10.0, 'lat': 2.5, 'lon': 2.5,
+                  'event_timestamp': datetime(2016, 1, 1, 12, 0, 0),
+                  'event_description': 'foo',
+                  'event_network': 'us'}
+    shake_dict = {'event_id': 'us12345678', 'shakemap_id': 'us12345678', 'shakemap_version': 1,
+                  'code_version': '4.5', 'process_timestamp': datetime.utcnow(),
+                  'shakemap_originator': 'us', 'map_status': 'RELEASED', 'shakemap_event_type': 'ACTUAL'}
+    layers = OrderedDict([('mmi', mmidata.astype(np.float32)), ])
+    shakegrid = ShakeGrid(layers, geodict, event_dict, shake_dict, {'mmi': (1, 1)})
+    shakegrid.save(shakefile)
+
+
+def test_incremental_exposure():
+    print('Testing updating exposure from a previous ShakeMap version...')
+    tdir = tempfile.mkdtemp()
+    try:
+        geodict = GeoDict({'xmin': 0.5, 'xmax': 9.5, 'ymin': 0.5,
+                           'ymax': 9.5, 'dx': 1.0, 'dy': 1.0, 'nx': 10, 'ny': 10})
+        np.random.seed(1234)
+        popdata = np.round(np.random.uniform(0, 1e5, size=(10, 10))).astype(np.float32)
+        isodata = np.random.choice([4, 156, 356], size=(10, 10)).astype(np.int32)
+        popfile = os.path.join(tdir, 'pop.grd')
+        isofile = os.path.join(tdir, 'iso.grd')
+        write(Grid2D(popdata, geodict.copy()), popfile, 'netcdf')
+        write(Grid2D(isodata, geodict.copy()), isofile, 'netcdf')
+
+        mmidata = np.random.uniform(4.0, 9.0, size=(10, 10))
+        shakefile1 = os.path.join(tdir, 'grid1.xml')
+        make_shakefile(shakefile1, mmidata, geodict)
+        statefile = os.path.join(tdir, 'exposure_state.npz')
+        expomodel = Exposure(popfile, 2012, isofile)
+        expomodel.calcExposure(shakefile1)
+        assert expomodel.getChangedCells() is None
+        expomodel.saveState(statefile)
+
+        # the next version of the ShakeMap has higher MMI in part of the map
+        newmmi = mmidata.copy()
+        newmmi[2:5, 3:8] += 1.2
+        shakefile2 = os.path.join(tdir, 'grid2.xml')
+        make_shakefile(shakefile2, newmmi, geodict)
+        expomodel = Exposure(popfile, 2012, isofile)
+        exposure = expomodel.calcExposure(shakefile2, statefile=statefile)
+        nchanged = expomodel.getChangedCells()
+        assert nchanged > 0 and nchanged <= 15
+        testexposure = Exposure(popfile, 2012, isofile).calcExposure(shakefile2)
+        assert sorted(exposure.keys()) == sorted(testexposure.keys())
+        for key, value in testexposure.items():
+            np.testing.assert_almost_equal(exposure[key], value)
+        print('Passed updating exposure from a previous ShakeMap version.')
+
+        print('Testing that mismatched exposure states are not used...')
+        # a ShakeMap covering a different area
+        subdict = GeoDict({'xmin': 1.5, 'xmax': 8.5, 'ymin': 1.5,
+                           'ymax': 8.5, 'dx': 1.0, 'dy': 1.0, 'nx': 8, 'ny': 8})
+        shakefile3 = os.path.join(tdir, 'grid3.xml')
+        make_shakefile(shakefile3, newmmi[1:9, 1:9], subdict)
+        expomodel = Exposure(popfile, 2012, isofile)
+        exposure = expomodel.calcExposure(shakefile3, statefile=statefile)
+        assert expomodel.getChangedCells() is None
+        testexposure = Exposure(popfile, 2012, isofile).calcExposure(shakefile3)
+        np.testing.assert_almost_equal(exposure['TotalExposure'],
+                                       testexposure['TotalExposure'])
+
+        # a different population year
+        expomodel = Exposure(popfile, 2010, isofile)
+        exposure = expomodel.calcExposure(shakefile2, statefile=statefile)
+        assert expomodel.getChangedCells() is None
+        testexposure = Exposure(popfile, 2010, isofile).calcExposure(shakefile2)
+        np.testing.assert_almost_equal(exposure['TotalExposure'],
+                                       testexposure['TotalExposure'])
+
+        # a missing state file
+        expomodel = Exposure(popfile, 2012, isofile)
+        expomodel.calcExposure(shakefile2, statefile=os.path.join(tdir, 'missing.npz'))
+        assert expomodel.getChangedCells() is None
+        print('Passed that mismatched exposure states are not used.')
+    finally:
+        shutil.rmtree(tdir)
+
+
 def test():
     print('Testing Northridge exposure check (with GPW data).')
     events = ['northridge']
@@ -64,4 +194,7 @@ def test():
 
 if __name__ == '__main__':
     basic_test()
+    test_calc_exposure_matrix()
+    test_update_exposure_matrix()
+    test_incremental_exposure()
     test()
@@ -13,9 +13,11 @@ from mapio.writer import write
 from mapio.grid2d import Grid2D
 from mapio.shake import ShakeGrid
 import fiona
+from scipy.special import erfc
 
 # local imports
-from losspager.models.emploss import EmpiricalLoss, LognormalModel
+from losspager.models.emploss import (EmpiricalLoss, LognormalModel, LoglinearModel,
+                                      stack_exposures)
 from losspager.models.exposure import Exposure
 from losspager.models.growth import PopulationGrowth
 
@@ -163,6 +165,107 @@ def basic_test():
     print('Chile model x2 fatalities: %f' % chile_double_deaths)
 
 
+def test_rate_table():
+    print('Testing precomputed loss rate tables...')
+    model = LognormalModel('IR', 10.986839, 0.128601, 0.0)
+    # values on the 0.1 MMI grid come from the table, others are calculated
+    for mmirange in [np.arange(5, 10), np.arange(5, 9.6, 0.5), np.array([6.25, 7.13])]:
+        xx = np.log(mmirange / 10.986839) / 0.128601
+        testrates = 0.5 * erfc(-xx / np.sqrt(2))
+        np.testing.assert_almost_equal(model.getLossRates(mmirange), testrates)
+    loglinear = LoglinearModel('XX', 5.0, 1.0, 1.0)
+    np.testing.assert_almost_equal(loglinear.getLossRates(np.array([5, 5.5])),
+                                   [1.0, np.power(10, -0.5)])
+
+    fatmodel = EmpiricalLoss([model])
+    assert fatmodel.getModel('ZZ') is fatmodel.getModel('YY')
+    print('Passed precomputed loss rate tables.')
+
+
+def test_batch_losses():
+    print('Testing batch loss calculations for multiple events...')
+    fatmodel = EmpiricalLoss.fromDefaultFatality()
+    events = [{'XF': np.array([0, 0, 1506.0, 1946880.0, 6509154.0, 6690236.0,
+                               3405381.0, 1892446.0, 5182.0, 0]),
+               'TotalExposure': np.zeros(10)},
+              {'CL': np.array([0, 0, 0, 1047000, 7314000, 1789000, 699000, 158000, 0, 0]),
+               'AR': np.array([0, 0, 0, 1e6, 1e6, 1e5, 0, 0, 0, 0]),
+               'TotalExposure': np.zeros(10)}]
+    exposures, ccodes = stack_exposures(events)
+    assert ccodes == ['AR', 'CL', 'XF']
+    results = fatmodel.getBatchLosses(exposures, ccodes)
+    for i, expdict in enumerate(events):
+        fatdict = fatmodel.getLosses(dict([(k, v.copy()) for k, v in expdict.items()]))
+        for ccode, value in fatdict.items():
+            if ccode == 'TotalFatalities':
+                assert results['total'][i] == value
+            else:
+                assert results['losses'][i, ccodes.index(ccode)] == value
+        assert results['alert'][i] == fatmodel.getAlertLevel(fatdict)
+        G = fatmodel.getCombinedG(fatdict)
+        np.testing.assert_almost_equal(results['G'][i], G)
+        probs = fatmodel.getProbabilities(fatdict, G)
+        np.testing.assert_almost_equal(results['probabilities'][i], list(probs.values()))
+    print('Passed batch loss calculations for multiple events.')
+
+
+def test_loss_grid():
+    print('Testing that grid losses use the right rates and do not modify inputs...')
+    fatmodel = EmpiricalLoss([LognormalModel('AF', 11.613073, 0.180683, 1.0)])
+    fatmodel.overrideModel('AF', np.array(
+        [0, 0, 0, 0, 1e-6, 1e-5, 1e-4, 1e-3, 1e-2, 0]))
+    mmidata = np.array([[4.0, 5.0, 6.4, 7.5],
+                        [8.0, 9.0, 10.0, 6.0]])
+    popdata = np.ones_like(mmidata) * 1e6
+    isodata = np.array([[4, 4, 4, 4],
+                        [4, 4, 4, 156]])
+    mmicopy = mmidata.copy()
+    fatgrid = fatmodel.getLossGrid(mmidata, popdata, isodata)
+    np.testing.assert_equal(mmidata, mmicopy)
+    np.testing.assert_almost_equal(fatgrid[0], [0, 1, 10, 1000])
+    np.testing.assert_almost_equal(fatgrid[1, 0:3], [1000, 10000, 10000])
+    cnrate = fatmodel.getLossRates('CN', np.array([6]))[0]
+    np.testing.assert_almost_equal(fatgrid[1, 3], 1e6 * cnrate)
+    print('Passed testing that grid losses use the right rates and do not modify inputs.')
+
+
+def test_loss_by_overlapping_shapes():
+    print('Testing assigning losses to overlapping polygons...')
+    fatmodel = EmpiricalLoss([LognormalModel('AF', 11.613073, 0.180683, 1.0)])
+    fatmodel.overrideModel('AF', np.array(
+        [0, 0, 0, 0, 1e-6, 1e-5, 1e-4, 1e-3, 1e-2, 0]))
+    geodict = GeoDict({'xmin': 0.0, 'xmax': 9.0, 'ymin': 0.0, 'ymax': 9.0,
+                       'dx': 1.0, 'dy': 1.0, 'nx': 10, 'ny': 10})
+    mmidata = np.tile(np.linspace(5.0, 9.0, 10), (10, 1))
+    popdata = np.arange(100, dtype=np.float64).reshape((10, 10)) * 1e3
+    isodata = np.ones((10, 10), dtype=np.int32) * 4
+
+    def box(x1, y1, x2, y2):
+        coords = [[(x1, y1), (x2, y1), (x2, y2), (x1, y2), (x1, y1)]]
+        return {'geometry': {'type': 'Polygon', 'coordinates': coords},
+                'properties': {}}
+
+    # the first two polygons share a 3x3 block of cells, the third does not touch them
+    shapes = [box(0.1, 0.1, 5.9, 5.9), box(3.1, 3.1, 8.9, 8.9), box(7.1, 0.1, 9.9, 2.9)]
+    fatshapes, totfat = fatmodel.getLossByShapes(mmidata, popdata, isodata,
+                                                 shapes, geodict)
+
+    # cell centers are at whole degrees, with row 0 at the top (y=9)
+    fatgrid = fatmodel.getLossGrid(mmidata, popdata, isodata)
+    lon, lat = np.meshgrid(np.arange(10.0), np.arange(9.0, -1.0, -1.0))
+    testfats = []
+    union = np.zeros((10, 10), dtype=bool)
+    for x1, y1, x2, y2 in [(0, 0, 6, 6), (3, 3, 9, 9), (7, 0, 10, 3)]:
+        inside = (lon > x1) & (lon < x2) & (lat > y1) & (lat < y2)
+        testfats.append(int(np.nansum(fatgrid[inside])))
+        union |= inside
+    assert [shape['properties']['fatalities'] for shape in fatshapes] == testfats
+    assert totfat == sum(testfats)
+    # the shared cells count towards both polygons
+    assert totfat > int(np.nansum(fatgrid[union]))
+    print('Passed assigning losses to overlapping polygons.')
+
+
 def test():
     # where is this script?
     homedir = os.path.dirname(os.path.abspath(__file__))
@@ -264,4 +367,8 @@ def test():
 if __name__ == '__main__':
     lognormal_object_test()
     basic_test()
+    test_rate_table()
+    test_batch_losses()
+    test_loss_grid()
+    test_loss_by_overlapping_shapes()
     test()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+
+# stdlib imports
+import tempfile
+import os.path
+import shutil
+from datetime import datetime
+from collections import OrderedDict
+
+# third party imports
+import numpy as np
+from mapio.geodict import GeoDict
+from mapio.writer import write
+from mapio.grid2d import Grid2D
+from mapio.shake import ShakeGrid
+
+# local imports
+from losspager.models.gridcontext import GridContext
+from losspager.models.exposure import Exposure
+from losspager.utils.exception import PagerException
+from losspager.utils.datacache import CACHE_ENV
+from losspager.utils.gridstore import GridStore
+
+
+def get_temp_file_name():
+    foo, tmpfile = tempfile.mkstemp()
+    os.close(foo)
+    return tmpfile
+
+
+def make_grids():
+    mmidata = np.linspace(5.0, 10.0, 81, dtype=np.float32).reshape((9, 9))
+    popdata = np.arange(1, 26, dtype=np.float32).reshape((5, 5)) * 1e4
+    isodata = np.array([[4, 4, 4, 4, 4],
+                        [4, 4, 4, 4, 4],
+                        [4, 4, 156, 156, 156],
+                        [156, 156, 156, 156, 156],
+                        [156, 156, 156, 156, 156]], dtype=np.int32)
+    urbdata = np.ones((5, 5), dtype=np.int32)
+    urbdata[1:3, 1:3] = 2
+
+    shakefile = get_temp_file_name()
+    popfile = get_temp_file_name()
+    isofile = get_temp_file_name()
+    urbfile = get_temp_file_name()
+    # the ShakeMap is finer than the global grids, so it has to be resampled
+    shakedict = GeoDict({'xmin': 0.5, 'xmax': 4.5, 'ymin': 0.5,
+                         'ymax': 4.5, 'dx': 0.5, 'dy': 0.5, 'nx': 9, 'ny': 9})
+    geodict = GeoDict({'xmin': 0.5, 'xmax': 4.5, 'ymin': 0.5,
+                       'ymax': 4.5, 'dx': 1.0, 'dy': 1.0, 'nx': 5, 'ny': 5})
+    layers = OrderedDict([('mmi', mmidata), ])
+    event_dict = {'event_id': 'us12345678', 'magnitude': 7.8,
+                  'depth': 10.0, 'lat': 2.5, 'lon': 2.5,
+                  'event_timestamp': datetime(2016, 1, 1, 12, 0, 0),
+                  'event_description': 'foo',
+                  'event_network': 'us'}
+    shake_dict = {'event_id': 'us12345678', 'shakemap_id': 'us12345678', 'shakemap_version': 1,
+                  'code_version': '4.5', 'process_timestamp': datetime.utcnow(),
+                  'shakemap_originator': 'us', 'map_status': 'RELEASED', 'shakemap_event_type': 'ACTUAL'}
+    unc_dict = {'mmi': (1, 1)}
+    shakegrid = ShakeGrid(layers, shakedict, event_dict, shake_dict, unc_dict)
+    shakegrid.save(shakefile)
+    write(Grid2D(popdata, geodict.copy()), popfile, 'netcdf')
+    write(Grid2D(isodata, geodict.copy()), isofile, 'netcdf')
+    write(Grid2D(urbdata, geodict.copy()), urbfile, 'netcdf')
+    return (shakefile, popfile, isofile, urbfile)
+
+
+def test_grid_context():
+    print('Testing shared grid context...')
+    shakefile, popfile, isofile, urbfile = make_grids()
+    try:
+        context = GridContext(shakefile, popfile, isofile, urbanfile=urbfile)
+        assert context.intersects()
+        sampledict = context.getSampleDict()
+        assert sampledict.dx == 1.0
+        for grid in [context.getShakeGrid(), context.getPopulationGrid(),
+                     context.getCountryGrid(), context.getUrbanGrid()]:
+            assert grid.getGeoDict() == sampledict
+        popdata = context.getPopulationGrid().getData().copy()
+
+        # exposure from the shared grids matches exposure read from the files
+        expomodel = Exposure(popfile, 2012, isofile)
+        exposure = expomodel.calcExposure(shakefile)
+        ctxmodel = Exposure(popfile, 2012, isofile)
+        ctxexposure = ctxmodel.calcExposure(shakefile, context=context)
+        assert sorted(exposure.keys()) == sorted(ctxexposure.keys())
+        for key, value in exposure.items():
+            np.testing.assert_almost_equal(value, ctxexposure[key])
+
+        # population growth was applied to a copy of the shared population data
+        np.testing.assert_equal(context.getPopulationGrid().getData(), popdata)
+        assert ctxmodel.getPopulationGrid() is not context.getPopulationGrid()
+
+        # models configured with other files can't use the context
+        other = Exposure(urbfile, 2012, isofile)
+        try:
+            other.calcExposure(shakefile, context=context)
+            assert 1 == 2
+        except PagerException:
+            pass
+
+        # the urban grid is only available when requested
+        context = GridContext(shakefile, popfile, isofile)
+        try:
+            context.getUrbanGrid()
+            assert 1 == 2
+        except PagerException:
+            pass
+    finally:
+        for tfile in [shakefile, popfile, isofile, urbfile]:
+            os.remove(tfile)
+    print('Passed shared grid context.')
+
+
+def test_grid_context_store():
+    print('Testing grid context windows from grid store...')
+    shakefile, popfile, isofile, urbfile = make_grids()
+    tdir = tempfile.mkdtemp()
+    oldcache = os.environ.get(CACHE_ENV)
+    os.environ[CACHE_ENV] = tdir
+    try:
+        context = GridContext(shakefile, popfile, isofile, urbanfile=urbfile)
+        GridStore.create(popfile, isofile=isofile, urbanfile=urbfile)
+        storecontext = GridContext(shakefile, popfile, isofile, urbanfile=urbfile)
+        for method in ['getPopulationGrid', 'getCountryGrid', 'getUrbanGrid']:
+            grid = getattr(context, method)()
+            storegrid = getattr(storecontext, method)()
+            assert storegrid.getGeoDict() == grid.getGeoDict()
+            np.testing.assert_equal(storegrid.getData(), grid.getData())
+            # store windows are views of the memory mapped grids
+            assert not storegrid.getData().flags.writeable
+        GridStore.delete(popfile)
+    finally:
+        if oldcache is None:
+            del os.environ[CACHE_ENV]
+        else:
+            os.environ[CACHE_ENV] = oldcache
+        shutil.rmtree(tdir)
+        for tfile in [shakefile, popfile, isofile, urbfile]:
+            os.remove(tfile)
+    print('Passed grid context windows from grid store.')
+
+
+if __name__ == '__main__':
+    test_grid_context()
+    test_grid_context_store()
@@ -90,6 +90,39 @@ def test_pop_growth():
     # newpop = pg.adjustPopulation(pop,ccode,tpop,tevent)
 
 
+def test_adjust_population_grid():
+    print('Testing population growth adjustment of a grid...')
+    ratedict = {4: {'start': [2010, 2012, 2014, 2016],
+                    'end': [2012, 2014, 2016, 2018],
+                    'rate': [0.01, 0.02, 0.03, 0.04]},
+                156: {'start': [2010, 2012, 2014, 2016],
+                      'end': [2012, 2014, 2016, 2018],
+                      'rate': [0.02, 0.03, 0.04, 0.05]}}
+    pg = PopulationGrowth(ratedict)
+    popdata = np.array([[1e6, 2e6, 3e6],
+                        [4e6, 5e6, np.nan],
+                        [7e6, 8e6, 9e6]], dtype=np.float32)
+    isodata = np.array([[4, 4, 156],
+                        [156, 0, 4],
+                        [np.nan, 999, 156]])
+    for tpop, tevent in [(2012, 2016), (2016, 2011), (2014, 2014)]:
+        newpop = pg.adjustPopulationGrid(popdata, isodata, tpop, tevent)
+        assert newpop.dtype == popdata.dtype
+        cmppop = popdata.copy()
+        for ccode in [0, 4, 156, 999]:
+            cidx = isodata == ccode
+            cmppop[cidx] = pg.adjustPopulation(cmppop[cidx], ccode, tpop, tevent)
+        np.testing.assert_equal(newpop, cmppop)
+    # cells without a country are not adjusted, and the input is not modified
+    assert newpop[2, 0] == 7e6
+    assert popdata[0, 0] == 1e6
+    table = pg.getGrowthFactors(2012, 2016)
+    assert table.shape == (158, 4)
+    assert pg.getGrowthFactors(2012, 2016) is table
+    print('Passed population growth adjustment of a grid.')
+
+
 if __name__ == '__main__':
     test_adjust_pop()
     test_pop_growth()
+    test_adjust_population_grid()
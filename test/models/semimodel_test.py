@@ -8,9 +8,12 @@ from datetime import datetime
 import numpy as np
 import pandas as pd
 
+# neic imports
+from impactutils.io.container import HDFContainer
+
 # local imports
-from losspager.models.semimodel import (get_time_of_day, pop_dist,
-                                        SemiEmpiricalFatality, URBAN)
+from losspager.models.semimodel import (get_time_of_day, pop_dist, group_cells,
+                                        SemiEmpiricalFatality, SemiTables, URBAN, RURAL)
 
 
 def test_times():
@@ -52,10 +55,80 @@ def test_work():
     np.testing.assert_almost_equal(nonres, 865)
     np.testing.assert_almost_equal(outdoor, 725)
 
+def test_group_cells():
+    mmidata = np.array([[5.5, 6.0, 6.0],
+                        [6.0, 9.0, np.nan],
+                        [6.0, 6.5, 6.0]])
+    popdata = np.array([[1, 2, 3],
+                        [4, 5, 6],
+                        [7, 8, 9]], dtype=np.float32)
+    isodata = np.array([[4, 4, 4],
+                        [156, 4, 4],
+                        [4, np.nan, 4]])
+    urbdata = np.array([[URBAN, URBAN, URBAN],
+                        [URBAN, RURAL, URBAN],
+                        [RURAL, URBAN, URBAN]])
+    groups = group_cells(mmidata, popdata, isodata, urbdata)
+    assert sorted(groups.keys()) == [(4, 6.0, RURAL), (4, 6.0, URBAN),
+                                     (4, 9.0, RURAL), (156, 6.0, URBAN)]
+    # cells within each group stay in grid order
+    np.testing.assert_equal(groups[(4, 6.0, URBAN)], [2, 3, 9])
+    np.testing.assert_equal(groups[(4, 6.0, RURAL)], [7])
+    np.testing.assert_equal(groups[(4, 9.0, RURAL)], [5])
+    np.testing.assert_equal(groups[(156, 6.0, URBAN)], [4])
+    assert groups[(4, 6.0, URBAN)].dtype == np.float32
+
 # TODO - There is something wrong with the semi-empirical model, this needs to be
 # fixed
 
 
+def test_semi_tables():
+    print('Testing that semi-empirical tables are loaded once...')
+    semi1 = SemiEmpiricalFatality.fromDefault()
+    semi2 = SemiEmpiricalFatality.fromDefault()
+    assert semi1._tables is semi2._tables
+    datadir = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           '..', '..', 'losspager', 'data')
+    invfile = os.path.join(datadir, 'semi_inventory.hdf')
+    colfile = os.path.join(datadir, 'semi_collapse_mmi.hdf')
+    fatfile = os.path.join(datadir, 'semi_casualty.hdf')
+    workfile = os.path.join(datadir, 'semi_workforce.hdf')
+    tables = SemiTables.fromFiles(invfile, colfile, fatfile, workfile)
+    assert tables is semi1._tables
+    print('Passed.')
+
+    print('Testing that semi-empirical lookups match the HDF files...')
+    inventory = HDFContainer.load(invfile).getDataFrame('UrbanResidential')
+    resrow = inventory.set_index('CountryCode').loc['US'].drop('CountryName')
+    resrow = resrow[resrow.notnull()]
+    resrow = resrow[resrow > 0]
+    resinv, nresinv = semi1.getInventories('US', URBAN)
+    assert resinv.index.tolist() == resrow.index.tolist()
+    np.testing.assert_almost_equal(resinv.values.astype(np.float64),
+                                   resrow.values.astype(np.float64))
+
+    btypes = resinv.index.drop('Unnamed: 0')
+    collapse = HDFContainer.load(colfile).getDataFrame('US').set_index('BuildingCode')
+    for mmi in [6.0, 7.5, 9.0]:
+        rates = semi1.getCollapse('US', mmi, resinv)
+        assert rates.index.tolist() == btypes.tolist()
+        np.testing.assert_almost_equal(rates.values,
+                                       collapse.loc[btypes, 'MMI_%s' % mmi].values)
+
+    casualty = HDFContainer.load(fatfile).getDataFrame('US').set_index('BuildingCode')
+    fatrates = semi1.getFatalityRates('US', 'night', resinv)
+    np.testing.assert_almost_equal(fatrates.values,
+                                   casualty.loc[btypes, 'CasualtyNight'].values)
+
+    workforce = HDFContainer.load(workfile).getDataFrame('Workforce')
+    wrow = workforce.set_index('CountryCode').loc['US']
+    pd.testing.assert_series_equal(semi1.getWorkforce('US'), wrow)
+
+    buildings = HDFContainer.load(invfile).getDataFrame('BuildingTypes').set_index('Code')
+    assert semi1.getBuildingDesc('W1') == buildings.loc['W1', 'ShortDescription']
+    print('Passed.')
+
+
 def disable_test_model_real():
     # test with real data
     popyear = 2012
@@ -125,6 +198,8 @@ def test_manual_calcs():
 if __name__ == '__main__':
     test_times()
     test_work()
+    test_group_cells()
+    test_semi_tables()
     test_manual_calcs()
     # test_model_single()
     test_model_real()
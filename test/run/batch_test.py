@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+# stdlib imports
+import os.path
+import tempfile
+import shutil
+import json
+import multiprocessing
+
+# third party imports
+import pandas as pd
+
+# local imports
+import losspager.run.batch
+from losspager.io.resultstore import ResultsStore
+from losspager.run.batch import run_batch, read_checkpoint, HEADER_COLS
+
+
+def test_batch_checkpoint():
+    tdir = tempfile.mkdtemp()
+    try:
+        print("Testing resuming a batch from a checkpoint file...")
+        checkpoint = os.path.join(tdir, "batch.checkpoint")
+        row = dict([(col, 0) for col in HEADER_COLS])
+        row.update({"EventID": "us1234", "Time": "2016-01-01T12:00:00.000",
+                    "CountryCode": "Total"})
+        with open(checkpoint, "wt") as f:
+            record = {"gridfile": "grid1.xml", "rows": [row], "error": None}
+            f.write(json.dumps(record) + "\n")
+            record = {"gridfile": "grid2.xml", "rows": None, "error": "Failed."}
+            f.write(json.dumps(record) + "\n")
+            # partial line from an interrupted batch
+            f.write('{"gridfile": "grid3.x')
+        results = read_checkpoint(checkpoint)
+        assert sorted(results.keys()) == ["grid1.xml", "grid2.xml"]
+
+        # grids in the checkpoint are not processed again
+        dataframe, errors = run_batch(["grid1.xml", "grid2.xml"], {},
+                                      checkpoint=checkpoint, retry_failed=False)
+        assert list(dataframe.columns) == HEADER_COLS
+        assert len(dataframe) == 1
+        assert dataframe["Time"].iloc[0].year == 2016
+        assert errors == {"grid2.xml": "Failed."}
+
+        # unless they failed
+        dataframe, errors = run_batch(["grid1.xml", "grid2.xml"], {},
+                                      checkpoint=checkpoint)
+        assert len(dataframe) == 1
+        assert list(errors.keys()) == ["grid2.xml"]
+        assert errors["grid2.xml"] != "Failed."
+        assert read_checkpoint(checkpoint)["grid2.xml"][1] == errors["grid2.xml"]
+        print("Passed resuming a batch from a checkpoint file.")
+
+        print("Testing that batch failures are reported and saved...")
+        missing = os.path.join(tdir, "missing_grid.xml")
+        dataframe, errors = run_batch(["grid1.xml", missing], {}, nprocs=2,
+                                      checkpoint=checkpoint)
+        assert len(dataframe) == 1
+        assert missing in errors
+        assert missing in read_checkpoint(checkpoint)
+        print("Passed reporting batch failures.")
+    finally:
+        shutil.rmtree(tdir)
+
+
+def test_batch_store_checkpoint():
+    tdir = tempfile.mkdtemp()
+    try:
+        print("Testing resuming a batch saved to a results store...")
+        store = ResultsStore(os.path.join(tdir, "store"), fmt="pickle")
+        checkpoint = os.path.join(tdir, "batch.checkpoint")
+        row = dict([(col, 0) for col in HEADER_COLS])
+        partfile = store.newPartition()
+        assert store.append(pd.DataFrame([row], columns=HEADER_COLS), partfile=partfile) == partfile
+        # the batch was interrupted after grid2.xml was recorded, but before its partition
+        # was written
+        missing = os.path.basename(store.newPartition())
+        with open(checkpoint, "wt") as f:
+            for gridfile, partition in [("grid1.xml", os.path.basename(partfile)),
+                                        ("grid2.xml", missing)]:
+                record = {"gridfile": gridfile, "rows": None, "error": None,
+                          "partition": partition}
+                f.write(json.dumps(record) + "\n")
+        assert sorted(read_checkpoint(checkpoint).keys()) == ["grid1.xml", "grid2.xml"]
+        assert list(read_checkpoint(checkpoint, store=store).keys()) == ["grid1.xml"]
+
+        # so grid2.xml is processed again, and grid1.xml is not appended to the store twice
+        dataframe, errors = run_batch(["grid1.xml", "grid2.xml"], {}, nprocs=1,
+                                      checkpoint=checkpoint, store=store)
+        assert dataframe is None
+        assert list(errors.keys()) == ["grid2.xml"]
+        assert store.getRowCount() == 1
+        print("Passed resuming a batch saved to a results store.")
+    finally:
+        shutil.rmtree(tdir)
+
+
+def _exit_process(gridfile):
+    # stand in for _process_grid that kills the worker process on one grid
+    if gridfile == "crash.xml":
+        os._exit(1)
+    return (gridfile, None, "Failed.")
+
+
+def test_batch_broken_pool():
+    tdir = tempfile.mkdtemp()
+    process_grid = losspager.run.batch._process_grid
+    try:
+        print("Testing that a batch survives a worker process dying...")
+        checkpoint = os.path.join(tdir, "batch.checkpoint")
+        # worker processes are forked (whatever the platform default start method is),
+        # so they call the replacement function
+        losspager.run.batch._process_grid = _exit_process
+        gridfiles = ["crash.xml", "grid1.xml", "grid2.xml"]
+        dataframe, errors = run_batch(gridfiles, {}, nprocs=1, checkpoint=checkpoint,
+                                      mp_context=multiprocessing.get_context("fork"))
+        assert sorted(errors.keys()) == gridfiles
+        assert "Worker process died" in errors["crash.xml"]
+        # every grid is in the checkpoint, so the batch can be resumed
+        assert sorted(read_checkpoint(checkpoint).keys()) == gridfiles
+        print("Passed a batch surviving a worker process dying.")
+    finally:
+        losspager.run.batch._process_grid = process_grid
+        shutil.rmtree(tdir)
+
+
+if __name__ == "__main__":
+    test_batch_checkpoint()
+    test_batch_store_checkpoint()
+    test_batch_broken_pool()
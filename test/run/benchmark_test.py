@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+# stdlib imports
+import os.path
+import tempfile
+import shutil
+from datetime import datetime
+
+# third party imports
+import numpy as np
+import pandas as pd
+from mapio.shake import ShakeGrid
+from mapio.reader import read
+
+# local imports
+from losspager.run.benchmark import (
+    BENCHMARK_COLUMNS,
+    check_regressions,
+    get_benchmark_countries,
+    make_benchmark_grids,
+    run_benchmarks,
+)
+
+
+def test_benchmark_grids():
+    tdir = tempfile.mkdtemp()
+    try:
+        print("Testing making synthetic benchmark grids...")
+        gridfile, popfile, isofile, urbanfile = make_benchmark_grids(tdir, 20, 3)
+        shakegrid = ShakeGrid.load(gridfile)
+        mmidata = shakegrid.getLayer("mmi").getData()
+        assert mmidata.shape == (20, 20)
+        assert mmidata.max() > 9.0 and mmidata.min() < 4.0
+        isogrid = read(isofile)
+        assert isogrid.getGeoDict().nx == 40
+        ccodes = get_benchmark_countries(3)
+        assert sorted(np.unique(isogrid.getData())) == sorted(ccodes)
+        # existing grids are re-used
+        mtime = os.path.getmtime(gridfile)
+        assert make_benchmark_grids(tdir, 20, 3)[0] == gridfile
+        assert os.path.getmtime(gridfile) == mtime
+        print("Passed making synthetic benchmark grids.")
+
+        print("Testing running benchmarks...")
+        results = run_benchmarks(tdir, sizes=[20], countries=[1, 3], repeat=1)
+        assert list(results.columns) == BENCHMARK_COLUMNS
+        assert len(results) == 16
+        assert "Exposure.calcExposure" in results["Benchmark"].values
+        assert (results["WallTime"] >= 0).all()
+        print("Passed running benchmarks.")
+    finally:
+        shutil.rmtree(tdir)
+
+
+def test_check_regressions():
+    print("Testing finding benchmark regressions...")
+    rows = []
+    for day, walltime in enumerate([1.0, 1.1, 0.9, 1.0, 10.0]):
+        rows.append([datetime(2020, 1, day + 1), "host1", "1.0", "calc_exposure",
+                     100, 1, walltime, walltime, 100.0])
+    history = pd.DataFrame(rows, columns=BENCHMARK_COLUMNS)
+    results = pd.DataFrame(
+        [[datetime(2020, 2, 1), "host1", "1.0", "calc_exposure", 100, 1, 2.0, 2.0, 100.0],
+         [datetime(2020, 2, 1), "host1", "1.0", "calc_exposure", 1000, 1, 50.0, 50.0, 100.0],
+         [datetime(2020, 2, 1), "host2", "1.0", "calc_exposure", 100, 1, 50.0, 50.0, 100.0]],
+        columns=BENCHMARK_COLUMNS)
+    # only the first row has any history, and it is much slower than the median of 1.0
+    regressions = check_regressions(history, results)
+    assert len(regressions) == 1
+    assert regressions["Baseline"].iloc[0] == 1.0
+    assert regressions["Ratio"].iloc[0] == 2.0
+    # the median of the last two runs is 5.5
+    assert len(check_regressions(history, results, window=2)) == 0
+    assert len(check_regressions(history, results, tolerance=1.5)) == 0
+    # CPU time can be compared instead of wall time
+    results.loc[0, "CPUTime"] = 1.1
+    assert len(check_regressions(history, results, metric="CPUTime")) == 0
+    empty = pd.DataFrame(columns=BENCHMARK_COLUMNS)
+    assert len(check_regressions(empty, results)) == 0
+    print("Passed finding benchmark regressions.")
+
+
+if __name__ == "__main__":
+    test_benchmark_grids()
+    test_check_regressions()
@@ -17,6 +17,7 @@ class Args:
     cancel: False
     tsunami: False
     elapsed: 0
+    no_cache: False
 
 
 def test_pager_main():
@@ -38,6 +39,7 @@ def test_pager_main():
         cancel=False,
         tsunami=False,
         elapsed=False,
+        no_cache=True,
     )
     config = read_config()
     main(args, config)
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+# stdlib imports
+import os.path
+import stat
+import tempfile
+import shutil
+import sys
+import threading
+import time
+from multiprocessing.connection import Client
+
+# local imports
+from losspager.run.pager_worker import PagerWorker
+from losspager.run.worker_client import submit_job, send_command
+
+
+def test_pager_worker():
+    tdir = tempfile.mkdtemp()
+    config = {"output_folder": tdir, "worker": {"authkey": "test", "jobs": 2}}
+    # the worker calls this in place of the PAGER main program, in its pool processes,
+    # so the jobs are recorded in a file.
+    jobfile = os.path.join(tdir, "jobs.txt")
+
+    def runner(pargs, config):
+        with open(jobfile, "at") as f:
+            f.write("%s %s %s\n" % (pargs.gridfile, pargs.debug, pargs.tsunami))
+        if pargs.gridfile == "missing.xml":
+            sys.exit(1)
+        if pargs.gridfile == "slow.xml":
+            time.sleep(1.0)
+        if pargs.gridfile == "die.xml":
+            # i.e., killed for running out of memory
+            os._exit(9)
+        return pargs.gridfile.endswith(".xml")
+
+    try:
+        print("Testing sending jobs to a PAGER worker...")
+        worker = PagerWorker(config, runner=runner)
+        thread = threading.Thread(target=worker.serve)
+        thread.start()
+        socket_file = os.path.join(tdir, "pager_worker.sock")
+        for i in range(100):
+            if os.path.exists(socket_file):
+                break
+            time.sleep(0.05)
+
+        response = submit_job(config, "grid.xml", debug=True)
+        assert response["result"]
+        response = submit_job(config, "grid.txt")
+        assert not response["result"]
+        with open(jobfile, "rt") as f:
+            jobs = f.read().splitlines()
+        assert jobs == ["grid.xml True auto", "grid.txt False auto"]
+
+        # only this user can connect to the worker
+        assert stat.S_IMODE(os.stat(socket_file).st_mode) == 0o600
+
+        # jobs that exit do not stop the worker
+        response = submit_job(config, "missing.xml")
+        assert not response["result"]
+        assert "SystemExit" in response["error"]
+
+        # the worker only accepts dictionaries
+        with Client(socket_file, family="AF_UNIX", authkey=b"test") as conn:
+            conn.send(["grid.xml"])
+            response = conn.recv()
+        assert not response["result"]
+        assert "not a dictionary" in response["error"]
+
+        # jobs run at the same time, up to the configured number of jobs
+        responses = []
+
+        def submit_slow():
+            responses.append(submit_job(config, "slow.xml"))
+
+        t1 = time.time()
+        threads = [threading.Thread(target=submit_slow) for i in range(2)]
+        for sthread in threads:
+            sthread.start()
+        for sthread in threads:
+            sthread.join()
+        assert time.time() - t1 < 1.9
+        assert all(response["result"] for response in responses)
+        assert all(response["waited"] < 0.9 for response in responses)
+
+        # a job that dies does not stop the jobs running alongside it
+        responses = []
+        sthread = threading.Thread(target=submit_slow)
+        sthread.start()
+        time.sleep(0.2)
+        try:
+            submit_job(config, "die.xml")
+            assert False
+        except EOFError:
+            pass
+        sthread.join()
+        assert responses[0]["result"]
+
+        response = send_command(config, "ping")
+        assert response["jobs"] == 7
+        response = send_command(config, "stop")
+        thread.join()
+        assert not os.path.exists(socket_file)
+        print("Passed sending jobs to a PAGER worker.")
+    finally:
+        shutil.rmtree(tdir)
+
+
+if __name__ == "__main__":
+    test_pager_worker()
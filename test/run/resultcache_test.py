@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+# stdlib imports
+import os.path
+import tempfile
+import shutil
+
+# local imports
+from losspager.run.resultcache import ResultCache, get_grid_hash, get_result_key
+
+GRID_HEADER = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<shakemap_grid event_id="us1234" shakemap_id="us1234" shakemap_version="%i" code_version="4.5" process_timestamp="%s" shakemap_originator="us" map_status="RELEASED" shakemap_event_type="ACTUAL">
+<event event_id="us1234" magnitude="7.8" depth="10.0" lat="2.5000" lon="2.5000" event_timestamp="2016-01-01T12:00:00" event_network="us" event_description="foo" />
+"""
+
+GRID_DATA = """<grid_specification lon_min="0.5000" lat_min="0.5000" lon_max="1.0000" lat_max="1.0000" nominal_lon_spacing="0.5000" nominal_lat_spacing="0.5000" nlon="2" nlat="2"/>
+<grid_field index="1" name="LON" units="dd" />
+<grid_field index="2" name="LAT" units="dd" />
+<grid_field index="3" name="MMI" units="" />
+<grid_data>
+0.5000 1.0000 %s
+1.0000 1.0000 5.5
+0.5000 0.5000 6
+1.0000 0.5000 6.5
+</grid_data>
+</shakemap_grid>
+"""
+
+
+def test_grid_hash():
+    tdir = tempfile.mkdtemp()
+    try:
+        print("Testing hashing ShakeMap grid values...")
+        grid1 = os.path.join(tdir, "grid1.xml")
+        grid2 = os.path.join(tdir, "grid2.xml")
+        grid3 = os.path.join(tdir, "grid3.xml")
+        with open(grid1, "wt") as f:
+            f.write(GRID_HEADER % (1, "2016-01-01T12:10:00") + GRID_DATA % "5")
+        # only the metadata is different
+        with open(grid2, "wt") as f:
+            f.write(GRID_HEADER % (2, "2016-01-01T12:30:00") + GRID_DATA % "5")
+        # one MMI value is different
+        with open(grid3, "wt") as f:
+            f.write(GRID_HEADER % (3, "2016-01-01T12:40:00") + GRID_DATA % "5.2")
+        assert get_grid_hash(grid1) == get_grid_hash(grid2)
+        assert get_grid_hash(grid1) != get_grid_hash(grid3)
+
+        event = {"lat": 2.5, "lon": 2.5, "magnitude": 7.8}
+        datafile = os.path.join(tdir, "data.txt")
+        with open(datafile, "wt") as f:
+            f.write("model data")
+        key = get_result_key(grid1, event, [datafile])
+        assert get_result_key(grid2, event, [datafile]) == key
+        assert get_result_key(grid3, event, [datafile]) != key
+        assert get_result_key(grid1, dict(event, magnitude=7.9), [datafile]) != key
+        with open(datafile, "wt") as f:
+            f.write("new model data")
+        assert get_result_key(grid1, event, [datafile]) != key
+        print("Passed hashing ShakeMap grid values.")
+    finally:
+        shutil.rmtree(tdir)
+
+
+def test_result_cache():
+    tdir = tempfile.mkdtemp()
+    try:
+        print("Testing saving and loading cached results...")
+        cache = ResultCache.fromConfig({"result_cache": {"folder": tdir, "max_entries": 2}})
+        assert ResultCache.fromConfig({"result_cache": {"enabled": False}}) is None
+        outfolder = os.path.join(tdir, "output")
+        os.makedirs(outfolder)
+        mapfile = os.path.join(outfolder, "exposure.png")
+        with open(mapfile, "wt") as f:
+            f.write("map")
+        assert cache.load("key1", outfolder) is None
+        cache.save("key1", {"exposure": [1, 2, 3]}, [mapfile])
+        os.remove(mapfile)
+        results = cache.load("key1", outfolder)
+        assert results == {"exposure": [1, 2, 3]}
+        assert open(mapfile, "rt").read() == "map"
+
+        # the least recently used entries are removed
+        cache.save("key2", {"exposure": [4]}, [])
+        cache.load("key1", outfolder)
+        cache.save("key3", {"exposure": [5]}, [])
+        assert sorted(cache.getEntries()) == ["key1", "key3"]
+        print("Passed saving and loading cached results.")
+    finally:
+        shutil.rmtree(tdir)
+
+
+if __name__ == "__main__":
+    test_grid_hash()
+    test_result_cache()
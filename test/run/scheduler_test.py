@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+# stdlib imports
+import os
+import time
+
+# local imports
+from losspager.run.scheduler import StageScheduler
+from losspager.utils.exception import PagerException
+
+
+def _add(*values):
+    return sum(values)
+
+
+def _sleep(seconds):
+    time.sleep(seconds)
+    return seconds
+
+
+def _get_pid():
+    return os.getpid()
+
+
+def _fail():
+    raise ValueError("stage failed")
+
+
+def test_scheduler():
+    print("Testing running stages in dependency order...")
+    scheduler = StageScheduler(max_threads=4, max_processes=0)
+    scheduler.addStage("a", _add, args=(1,))
+    scheduler.addStage("b", _add, depends=["a"], args=(10,))
+    scheduler.addStage("c", _add, depends=["a", "b"], kwargs={})
+    results = scheduler.run()
+    assert results == {"a": 1, "b": 11, "c": 12}
+    assert [name for name, elapsed in scheduler.getCriticalPath()] == ["a", "b", "c"]
+    try:
+        scheduler.addStage("c", _add)
+        assert 1 == 2
+    except PagerException:
+        pass
+    try:
+        scheduler.addStage("d", _add, depends=["e"])
+        assert 1 == 2
+    except PagerException:
+        pass
+    print("Passed running stages in dependency order.")
+
+    print("Testing running independent stages concurrently...")
+    scheduler = StageScheduler(max_threads=2, max_processes=0)
+    scheduler.addStage("sleep1", _sleep, args=(0.5,))
+    scheduler.addStage("sleep2", _sleep, args=(0.5,))
+    t1 = time.time()
+    scheduler.run()
+    assert time.time() - t1 < 0.9
+    times = scheduler.getTimes()
+    assert times["sleep1"][0] < times["sleep2"][1]
+    assert times["sleep2"][0] < times["sleep1"][1]
+    print("Passed running independent stages concurrently.")
+
+    print("Testing running stages in processes...")
+    scheduler = StageScheduler(max_threads=2, max_processes=1)
+    scheduler.addStage("thread", _get_pid)
+    scheduler.addStage("process", _get_pid, process=True)
+    results = scheduler.run()
+    assert results["thread"] == os.getpid()
+    assert results["process"] != os.getpid()
+    # without a process pool, process stages run in threads
+    scheduler = StageScheduler(max_threads=2, max_processes=0)
+    scheduler.addStage("process", _get_pid, process=True)
+    assert scheduler.run()["process"] == os.getpid()
+    print("Passed running stages in processes.")
+
+    print("Testing failing stages...")
+    scheduler = StageScheduler()
+    scheduler.addStage("fail", _fail)
+    scheduler.addStage("after", _add, depends=["fail"])
+    try:
+        scheduler.run()
+        assert 1 == 2
+    except ValueError:
+        pass
+    assert "after" not in scheduler.getTimes()
+    print("Passed failing stages.")
+
+
+if __name__ == "__main__":
+    test_scheduler()
@@ -70,6 +70,35 @@ def test():
 
     print('Passed numpy numbers test.')
 
+    print('Test retrieving dictionary from name with special characters...')
+    row6 = country.getCountry('Falkland Islands (Malvinas)')
+    assert row6['ISO2'] == 'FK'
+    print('Passed retrieving dictionary from name with special characters.')
+
+    print('Test that name searches match the first country containing the name...')
+    index = country.getIndex()
+    names = [str(name).lower() for name in index.getColumn('Name')]
+    for fragment in ['guinea', 'states', 'islands', 'ia', 'z', names[0], names[-1]]:
+        rowidx = [i for i, name in enumerate(names) if fragment in name][0]
+        assert index.findName(fragment) == rowidx
+        assert index.findName(fragment.upper()) == rowidx
+    assert country.getCountry('guinea')['Name'] == 'Equatorial Guinea'
+    assert index.findName('states\nunited') is None
+    assert Country().getIndex() is index
+    print('Passed name searches.')
+
+    print('Test translating a grid of numeric codes...')
+    isodata = np.array([[840, 4, np.nan],
+                        [840.0, 12345, -3]])
+    rows = index.getRowIndices(isodata)
+    assert rows[0, 2] == rows[1, 1] == rows[1, 2] == -1
+    assert rows[1, 0] == rows[0, 0]
+    assert index.getColumn('ISO2')[rows[0, 0]] == 'US'
+    assert index.getRow(rows[0, 1]) == country.getCountry('AF')
+    iso2 = index.translate(isodata, 'ISO2')
+    assert iso2.tolist() == [['US', 'AF', 'UK'], ['US', 'UK', 'UK']]
+    assert index.translate([392], 'Name')[0] == country.getCountry(392)['Name']
+    print('Passed translating a grid of numeric codes.')
 
 if __name__ == '__main__':
     test()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+# stdlib imports
+import os.path
+import tempfile
+import shutil
+
+# third party imports
+import pandas as pd
+
+# local imports
+from losspager.utils.datacache import (read_excel_cached, get_cache_file,
+                                       load_cached, CACHE_ENV)
+
+
+def test_read_excel_cached():
+    tdir = tempfile.mkdtemp()
+    oldcache = os.environ.get(CACHE_ENV)
+    try:
+        os.environ[CACHE_ENV] = os.path.join(tdir, 'cache')
+        excelfile = os.path.join(tdir, 'test.xlsx')
+        df = pd.DataFrame({'Code': ['AF', 'US'], 'Value': [1.5, 2.5]})
+        df.to_excel(excelfile, index=False)
+
+        print('Testing reading Excel file through the cache...')
+        cachefile = get_cache_file(excelfile)
+        assert not os.path.isfile(cachefile)
+        df1 = read_excel_cached(excelfile)
+        assert os.path.isfile(cachefile)
+        df2 = read_excel_cached(excelfile)
+        pd.testing.assert_frame_equal(df1, df)
+        pd.testing.assert_frame_equal(df2, df)
+        print('Passed reading Excel file through the cache.')
+
+        print('Testing that cache is keyed on read options and file contents...')
+        assert get_cache_file(excelfile, header=1) != cachefile
+        df = pd.DataFrame({'Code': ['AF', 'US'], 'Value': [3.5, 4.5]})
+        df.to_excel(excelfile, index=False)
+        assert get_cache_file(excelfile) != cachefile
+        pd.testing.assert_frame_equal(read_excel_cached(excelfile), df)
+        print('Passed testing that cache is keyed on read options and file contents.')
+    finally:
+        if oldcache is None:
+            del os.environ[CACHE_ENV]
+        else:
+            os.environ[CACHE_ENV] = oldcache
+        shutil.rmtree(tdir)
+
+
+def test_load_cached():
+    tdir = tempfile.mkdtemp()
+    try:
+        print('Testing loading arbitrary objects through the cache...')
+        cachefile = os.path.join(tdir, 'cache', 'test.pkl')
+        calls = []
+
+        def loader():
+            calls.append(1)
+            return {'US': pd.DataFrame({'Value': [1.5, 2.5]})}
+
+        data1 = load_cached(cachefile, loader)
+        data2 = load_cached(cachefile, loader)
+        assert len(calls) == 1
+        pd.testing.assert_frame_equal(data1['US'], data2['US'])
+        print('Passed loading arbitrary objects through the cache.')
+    finally:
+        shutil.rmtree(tdir)
+
+
+if __name__ == '__main__':
+    test_read_excel_cached()
+    test_load_cached()
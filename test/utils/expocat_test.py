@@ -9,9 +9,10 @@ from datetime import datetime
 
 # third party imports
 import numpy as np
+from impactutils.extern.openquake.geodetic import geodetic_distance
 
 # local imports
-from losspager.utils.expocat import ExpoCat
+from losspager.utils.expocat import ExpoCat, SpatialIndex
 
 
 def commify(value):
@@ -67,5 +68,104 @@ def test():
     print('Passed.')
 
 
+def test_spatial_index():
+    print('Testing that spatial index searches match brute force searches...')
+    expocat = ExpoCat.fromDefault()
+    df = expocat.getDataFrame()
+    lats = df['Lat'].values
+    lons = df['Lon'].values
+    index = SpatialIndex(lats, lons)
+    assert len(index) == len(expocat)
+    # include searches near the poles and across the 180 meridian
+    for clat, clon, radius in [(0.37, -79.94, 400), (35.0, 139.0, 1000),
+                               (-15.0, 179.5, 2000), (85.0, 0.0, 3000),
+                               (40.0, 20.0, 25000)]:
+        distances = geodetic_distance(clon, clat, lons, lats)
+        positions, pdistances = index.getRadiusPositions(clat, clon, radius)
+        np.testing.assert_equal(positions, np.nonzero(distances < radius)[0])
+        np.testing.assert_equal(pdistances, distances[distances < radius])
+
+    xmin, xmax, ymin, ymax = (100.0, 150.0, -10.0, 45.0)
+    inbounds = (lons > xmin) & (lons <= xmax) & (lats > ymin) & (lats <= ymax)
+    positions = index.getBoundsPositions(xmin, xmax, ymin, ymax)
+    np.testing.assert_equal(positions, np.nonzero(inbounds)[0])
+    assert len(expocat.selectByBounds(xmin, xmax, ymin, ymax)) == inbounds.sum()
+
+    # excluding events invalidates the index
+    expocat.excludeFutureEvents(datetime(1994, 1, 1))
+    assert len(expocat.getSpatialIndex()) == len(expocat)
+    print('Passed.')
+
+
+def test_query():
+    print('Testing that chained queries match chained selections...')
+    expocat = ExpoCat.fromDefault()
+    query = expocat.query().byRadius(35.0, 139.0, 800).byHazard('fire').byMagnitude(6.0)
+    minicat = expocat.selectByRadius(35.0, 139.0, 800).selectByHazard('fire').selectByMagnitude(6.0)
+    df = minicat.getDataFrame()
+    assert len(query) == len(minicat)
+    np.testing.assert_equal(query.getPositions(), df.index.values)
+    np.testing.assert_equal(query.getDistances(), df['Distance'].values)
+    assert query.getDataFrame().equals(df)
+
+    # queries without a search radius have no distances
+    query = expocat.query().byTime(datetime(1980, 1, 1), datetime(2000, 1, 1)).byShakingDeaths(100)
+    assert query.getDistances() is None
+    minicat = query.getExpoCat()
+    assert minicat.getDataFrame().equals(
+        expocat.selectByTime(datetime(1980, 1, 1), datetime(2000, 1, 1)).selectByShakingDeaths(100).getDataFrame())
+    print('Passed.')
+
+
+def search_historical(expocat, maxmmi, nmmi, ndeaths):
+    # the original DataFrame search for historical events, using getSimilarEvent()
+    newdf = expocat.getDataFrame().sort_values(['ShakingDeaths', 'MaxMMI', 'NumMaxMMI'],
+                                               ascending=False)
+    if not len(newdf):
+        return []
+    worst = newdf.iloc[0]
+    newdf = newdf.drop(newdf.index[[0]])
+    events = []
+    if len(newdf):
+        less_bad, newdf = expocat.getSimilarEvent(newdf, maxmmi, nmmi, ndeaths, go_down=True)
+        events.append(less_bad['EventID'])
+    if len(newdf):
+        more_bad, newdf = expocat.getSimilarEvent(newdf, maxmmi, nmmi, ndeaths, go_down=False)
+        events.append(more_bad['EventID'])
+    events.append(worst['EventID'])
+    return events
+
+
+def test_historical_batch():
+    print('Testing that batches of historical events match the DataFrame search...')
+    expocat = ExpoCat.fromDefault()
+    targets = [(maxmmi, ndeaths) for maxmmi in range(1, 11)
+               for ndeaths in [0, 9, 100, 1000, 100000]]
+    regions = [(0.37, -79.94, 400), (35.0, 139.0, 800), (28.2, 84.7, 1000), (38.3, 142.4, 100)]
+    for clat, clon, radius in regions:
+        minicat = expocat.selectByRadius(clat, clon, radius)
+        batch = minicat.getHistoricalEventsBatch([t[0] for t in targets],
+                                                 [t[1] for t in targets])
+        assert len(batch) == len(targets)
+        for (maxmmi, ndeaths), events in zip(targets, batch):
+            eventids = [e['EventID'] for e in events if e is not None]
+            assert eventids == search_historical(minicat, maxmmi, 0, ndeaths)
+            single = minicat.getHistoricalEvents(maxmmi, 0, ndeaths, clat, clon)
+            assert [e['EventID'] for e in single if e is not None] == eventids
+
+    minicat = expocat.selectByRadius(0.37, -79.94, 400)
+    events = minicat.getHistoricalEvents(8, 0, 9, 0.37, -79.94)
+    assert [e['EventID'] for e in events] == ['199603282303', '197912120759', '198703060410']
+
+    # the analogue index gives positions of events in the catalog
+    analogues = minicat.getAnalogueIndex().getAnalogues(8, 9)
+    df = minicat.getDataFrame()
+    assert df['EventID'].iloc[analogues[0, 2]] == '198703060410'
+    print('Passed.')
+
+
 if __name__ == '__main__':
     test()
+    test_spatial_index()
+    test_query()
+    test_historical_batch()
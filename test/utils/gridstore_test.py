@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+# stdlib imports
+import os.path
+import tempfile
+import shutil
+
+# third party imports
+import numpy as np
+from mapio.geodict import GeoDict
+from mapio.grid2d import Grid2D
+from mapio.writer import write
+
+# local imports
+from losspager.utils.datacache import CACHE_ENV
+from losspager.utils.gridstore import GridStore, get_grid_store
+
+
+def test_grid_store():
+    print('Testing memory mapped grid store...')
+    tdir = tempfile.mkdtemp()
+    oldcache = os.environ.get(CACHE_ENV)
+    os.environ[CACHE_ENV] = os.path.join(tdir, 'cache')
+    try:
+        # a global population grid, and a coarser country grid
+        popdict = GeoDict({'xmin': -179.5, 'xmax': 179.5, 'ymin': -89.5,
+                           'ymax': 89.5, 'dx': 1.0, 'dy': 1.0, 'nx': 360, 'ny': 180})
+        isodict = GeoDict({'xmin': -179.0, 'xmax': 179.0, 'ymin': -89.0,
+                           'ymax': 89.0, 'dx': 2.0, 'dy': 2.0, 'nx': 180, 'ny': 90})
+        popdata = np.arange(180 * 360, dtype=np.float32).reshape((180, 360))
+        isodata = np.arange(90 * 180, dtype=np.float32).reshape((90, 180))
+        popfile = os.path.join(tdir, 'pop.grd')
+        isofile = os.path.join(tdir, 'iso.grd')
+        write(Grid2D(popdata, popdict), popfile, 'netcdf')
+        write(Grid2D(isodata, isodict), isofile, 'netcdf')
+
+        assert get_grid_store(popfile) is None
+        store = GridStore.create(popfile, isofile=isofile)
+        assert get_grid_store(popfile) is not None
+        assert store.hasGrid(popfile)
+        assert store.hasGrid(isofile)
+        assert store.getGeoDict() == popdict
+
+        # a window is a view of the stored population data
+        sampledict = GeoDict({'xmin': 10.5, 'xmax': 14.5, 'ymin': 20.5,
+                              'ymax': 22.5, 'dx': 1.0, 'dy': 1.0, 'nx': 5, 'ny': 3})
+        popgrid = store.getGrid(popfile, sampledict)
+        assert popgrid.getGeoDict() == sampledict
+        np.testing.assert_equal(popgrid.getData(), popdata[67:70, 190:195])
+        assert not popgrid.getData().flags.writeable
+
+        # the country grid is aligned with the population grid
+        isogrid = store.getGrid(isofile, sampledict)
+        rows = np.arange(67, 70) // 2
+        cols = np.arange(190, 195) // 2
+        np.testing.assert_equal(isogrid.getData(), isodata[rows][:, cols])
+
+        # windows crossing the 180 meridian are gathered from both edges of the grid
+        sampledict = GeoDict({'xmin': 178.5, 'xmax': -178.5, 'ymin': 20.5,
+                              'ymax': 22.5, 'dx': 1.0, 'dy': 1.0, 'nx': 4, 'ny': 3})
+        popgrid = store.getGrid(popfile, sampledict)
+        np.testing.assert_equal(popgrid.getData(), popdata[67:70, [358, 359, 0, 1]])
+
+        # misaligned windows, and grids that are not in the store, are not read from the store
+        sampledict = GeoDict({'xmin': 10.0, 'xmax': 14.0, 'ymin': 20.0,
+                              'ymax': 22.0, 'dx': 1.0, 'dy': 1.0, 'nx': 5, 'ny': 3})
+        assert store.getGrid(popfile, sampledict) is None
+        assert store.getGrid(os.path.join(tdir, 'urban.grd'), sampledict) is None
+
+        GridStore.delete(popfile)
+        assert get_grid_store(popfile) is None
+    finally:
+        if oldcache is None:
+            del os.environ[CACHE_ENV]
+        else:
+            os.environ[CACHE_ENV] = oldcache
+        shutil.rmtree(tdir)
+    print('Passed memory mapped grid store.')
+
+
+if __name__ == '__main__':
+    test_grid_store()
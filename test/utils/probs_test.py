@@ -8,7 +8,8 @@ from losspager.utils.probs import (phi,
                                    invphi,
                                    calcEmpiricalValueFromProb,
                                    calcEmpiricalProbFromRange,
-                                   calcEmpiricalProbFromValue)
+                                   calcEmpiricalProbFromValue,
+                                   calcEmpiricalProbsFromBins)
 
 
 def test():
@@ -25,5 +26,28 @@ def test():
     print('Passed testing all probs functions.')
 
 
+def test_vectorized():
+    print('Testing array inputs to probs functions...')
+    G = np.array([1.0, 2.5])
+    expected = np.array([[0.0], [50.0], [1e6]])
+    edges = [0, 1, 10, 100, 1000]
+    probs = calcEmpiricalProbsFromBins(G, expected, edges)
+    assert probs.shape == (3, 2, 4)
+    for i in range(0, 3):
+        for j in range(0, 2):
+            for k in range(0, 4):
+                drange = edges[k:k + 2]
+                p = calcEmpiricalProbFromRange(G[j], expected[i, 0], drange)
+                np.testing.assert_almost_equal(probs[i, j, k], p)
+                pr = calcEmpiricalProbFromRange(G, expected, drange)
+                np.testing.assert_almost_equal(pr[i, j], p)
+    values = calcEmpiricalProbFromValue(2.5, 1e6, np.array([10e6, 1e6]))
+    np.testing.assert_almost_equal(values[0], 0.82148367161911606)
+    losses = calcEmpiricalValueFromProb(2.5, np.array([1e6, 1e6]), values)
+    np.testing.assert_almost_equal(losses / 1e6, [10.0, 1.0])
+    print('Passed testing array inputs to probs functions.')
+
+
 if __name__ == '__main__':
     test()
+    test_vectorized()
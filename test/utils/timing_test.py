@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+# stdlib imports
+import os.path
+import tempfile
+import shutil
+import time
+
+# local imports
+from losspager.utils.timing import StageTimings, get_timings, timed
+
+
+@timed('test.sleep')
+def _sleep(seconds):
+    time.sleep(seconds)
+    return seconds
+
+
+def test_timings():
+    print('Testing recording stage timings...')
+    timings = StageTimings()
+    # nothing is recorded until the timings are started
+    with timings.stage('before') as record:
+        pass
+    assert 'wall_time' in record
+    assert timings.getStages() == []
+
+    timings.start()
+    with timings.stage('sleep'):
+        time.sleep(0.2)
+    with timings.stage('busy'):
+        sum(range(1000000))
+    stages = timings.stop()
+    assert [stage['name'] for stage in stages] == ['sleep', 'busy']
+    sleep, busy = stages
+    assert sleep['wall_time'] >= 0.2
+    # sleeping does not use any CPU time
+    assert sleep['cpu_time'] < 0.1
+    assert busy['cpu_time'] > 0
+    assert sleep['peak_rss'] is None or sleep['peak_rss'] > 0
+    with timings.stage('after'):
+        pass
+    assert len(timings.getStages()) == 2
+    print('Passed recording stage timings.')
+
+    print('Testing the timed decorator...')
+    assert _sleep(0.01) == 0.01
+    get_timings().start()
+    try:
+        assert _sleep(0.01) == 0.01
+        assert [stage['name'] for stage in get_timings().getStages()] == ['test.sleep']
+    finally:
+        get_timings().stop()
+    print('Passed the timed decorator.')
+
+    print('Testing saving stage timings...')
+    tdir = tempfile.mkdtemp()
+    try:
+        timingsfile = os.path.join(tdir, 'timings.json')
+        timings.save(timingsfile)
+        assert StageTimings.load(timingsfile) == stages
+    finally:
+        shutil.rmtree(tdir)
+    print('Passed saving stage timings.')
+
+
+if __name__ == '__main__':
+    test_timings()